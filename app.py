@@ -1,673 +1,3560 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, send_file
+from werkzeug.security import safe_join
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict, deque
+from urllib.parse import urlparse, parse_qs
+from itertools import islice
+import importlib
+import multiprocessing
+import logging
+import logging.handlers
+import ctypes
+import ctypes.util
+import sys
 import threading
+import queue
+import subprocess
+import sqlite3
+import atexit
+import mimetypes
+import hashlib
+import gzip
+import shutil
+import json
 import time
+import uuid
 import os
-import yt_dlp
-import vlc
+import re
+import extraction_worker
+
+MODULE_LOADED_AT = time.time()
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access"""
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.import_seconds = None
+
+    def load(self):
+        if self.module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self.name)  # The import lock makes racing first uses safe
+            self.import_seconds = round(time.perf_counter() - started, 3)
+            self.module = module
+        return self.module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+# yt-dlp and libvlc take seconds to load on a Pi, so they load in the background warm-up instead
+yt_dlp = LazyModule('yt_dlp')
+vlc = LazyModule('vlc')
+
+# Static files are served by our own route below, compressed and with long-lived cache headers
+app = Flask(__name__, static_folder=None)
+
+# Extraction workers run the main script again, as __mp_main__, before their first job (see ExtractionService).
+# When that script is this file, the copy must not open, prune or clean up the files the server is using
+WORKER_COPY = __name__ == '__mp_main__'
+
+# ---------------------------------------------------------------------------
+# Logging: recent records stay in memory for /logs, only warnings and up are written out
+# ---------------------------------------------------------------------------
+
+LOG_LEVEL = os.environ.get('JUNIE_LOG_LEVEL', 'INFO').upper()                  # Lowest level recorded at all
+LOG_PERSIST_LEVEL = os.environ.get('JUNIE_LOG_PERSIST_LEVEL', 'WARNING').upper() # Lowest level written to stderr / the log file
+LOG_FILE = os.environ.get('JUNIE_LOG_FILE')                                      # Optional rotating log file
+LOG_BUFFER_SIZE = int(os.environ.get('JUNIE_LOG_BUFFER', '1000'))                # Records kept in memory for /logs
+LOG_FILE_BYTES = 1024 * 1024    # Rotate the log file at this size
+LOG_FILE_BACKUPS = 3            # Rotated log files kept
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+class LogBuffer(logging.Handler):
+    """Ring buffer of the most recent log records, as dicts ready to serve"""
+
+    def __init__(self, capacity):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self.sequence = 0
+        self.exception_formatter = logging.Formatter()
+
+    def emit(self, record):
+        # logging holds self.lock around emit()
+        self.sequence += 1
+        entry = {
+            'seq': self.sequence,
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.exception_formatter.formatException(record.exc_info)
+        self.records.append(entry)
+
+    def snapshot(self, since=0, level=logging.NOTSET, limit=None):
+        """Records newer than sequence number `since` at `level` or above, oldest first"""
+        with self.lock:
+            records = [entry for entry in self.records
+                       if entry['seq'] > since and logging.getLevelName(entry['level']) >= level]
+            sequence = self.sequence
+        return (records[-limit:] if limit else records), sequence
+
+def log_level(name, default):
+    """Numeric logging level for a name like 'warning', or `default` if it isn't one"""
+    level = logging.getLevelName(str(name).upper())
+    return level if isinstance(level, int) else default
+
+log = logging.getLogger('junie')
+log.setLevel(log_level(LOG_LEVEL, logging.INFO))
+log.propagate = False
+
+log_buffer = LogBuffer(LOG_BUFFER_SIZE)
+log.addHandler(log_buffer)
+
+# Under systemd stderr ends up in the journal on the SD card, so it only gets what's worth keeping
+persistent_handlers = [logging.StreamHandler(sys.stderr)]
+if LOG_FILE and not WORKER_COPY:
+    try:
+        persistent_handlers.append(logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_FILE_BYTES, backupCount=LOG_FILE_BACKUPS))
+    except OSError as e:
+        log.warning(f"Log file {LOG_FILE} unavailable: {e}")
+for handler in persistent_handlers:
+    handler.setLevel(log_level(LOG_PERSIST_LEVEL, logging.WARNING))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log.addHandler(handler)
+
+# ---------------------------------------------------------------------------
+# Metrics, served in the Prometheus text format at /metrics
+# ---------------------------------------------------------------------------
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOCK_BUCKETS = (0.00001, 0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+metrics_registry = []
+
+def format_labels(names, values, extra=None):
+    """Render a Prometheus label set like {strategy="android",le="0.5"}"""
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+        metrics_registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, key)} {value}')
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        metrics_registry.append(self)
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge',
+                f'{self.name} {self.callback()}']
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        metrics_registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", "+Inf")])} {series[-1]}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {series[-2]}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, key)} {series[-1]}')
+        return lines
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+LOCK_WAIT_SECONDS = Histogram('junie_lock_wait_seconds', 'Time spent waiting to acquire a lock', ('lock',), LOCK_BUCKETS)
+LOCK_HOLD_SECONDS = Histogram('junie_lock_hold_seconds', 'Time a lock was held', ('lock',), LOCK_BUCKETS)
+EXTRACTION_SECONDS = Histogram('junie_extraction_seconds', 'Time taken by one extraction strategy attempt',
+                               ('strategy', 'purpose', 'outcome'))
+LOOKUP_SECONDS = Histogram('junie_extraction_lookup_seconds', 'End-to-end time of a hedged extraction lookup',
+                           ('purpose', 'outcome'))
+TIME_TO_FIRST_AUDIO_SECONDS = Histogram('junie_time_to_first_audio_seconds',
+                                        'Time from a track being due to VLC reporting Playing', ('source',))
+TRACK_GAP_SECONDS = Histogram('junie_track_gap_seconds', 'Silence between one track ending and the next one playing')
+PLAYBACK_FAILURES = Counter('junie_playback_failures_total', 'Tracks that could not be played, by cause', ('cause',))
+TRACKS_PLAYED = Counter('junie_tracks_played_total', 'Tracks that started playing', ('source',))
+COALESCED_LOOKUPS = Counter('junie_coalesced_lookups_total', 'Lookups that joined one already in flight for the same video',
+                            ('purpose',))
+STREAM_RESUMES = Counter('junie_stream_resumes_total', 'Attempts to resume a track after a mid-track stream error or stall',
+                         ('cause', 'outcome'))
+STREAM_RECOVERY_SECONDS = Histogram('junie_stream_recovery_seconds',
+                                    'Time from a failed or stalled stream to playing again', ('cause',))
+PLAYBACK_STALLS = Counter('junie_playback_stalls_total', 'Stalls noticed by the playback watchdog, by signal', ('signal',))
+
+class InstrumentedLock:
+    """threading.Lock that records wait and hold times; works as the lock behind a threading.Condition"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.owner = None
+        self.acquired_at = 0
+
+    def acquire(self, blocking=True, timeout=-1):
+        started = time.perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = time.perf_counter()
+            self.owner = threading.get_ident()
+            LOCK_WAIT_SECONDS.observe(self.acquired_at - started, lock=self.name)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self.acquired_at
+        self.owner = None
+        self.lock.release()
+        LOCK_HOLD_SECONDS.observe(held, lock=self.name)
+
+    def locked(self):
+        return self.lock.locked()
+
+    def _is_owned(self):
+        # Lets threading.Condition check ownership without a trial acquire skewing the figures
+        return self.owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class Track:
+    """A queued, playing or recently played video; a fixed set of slots keeps thousands of them small"""
+
+    __slots__ = ('entry_id', 'url', 'video_id', 'title', 'thumbnail', 'duration', 'added_time', 'status', 'votes',
+                 'loudness', 'stream_url', 'stream_resolved_at', 'stream_expires_at', 'audio_format', 'throughput_kbps')
+
+    def __init__(self, url, video_id=None, title=None, thumbnail='', duration=0, loudness=None, status='pending'):
+        self.entry_id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.video_id = video_id
+        self.title = title or url
+        self.thumbnail = thumbnail or ''
+        self.duration = duration or 0
+        self.added_time = time.time()
+        self.status = status    # 'lazy', 'pending', 'ready' or 'failed'
+        self.votes = 1
+        self.loudness = loudness
+        self.stream_url = None  # The stream fields are internal and never sent to clients
+        self.stream_resolved_at = None
+        self.stream_expires_at = 0
+        self.audio_format = None     # The format picked for the stream, kept after playing
+        self.throughput_kbps = None  # Download rate measured while this track played
+
+    @classmethod
+    def from_info(cls, url, info, status='ready'):
+        """A track from extracted or cached metadata (a dict with METADATA_FIELDS)"""
+        return cls(url, info.get('id'), info.get('title'), info.get('thumbnail'), info.get('duration'),
+                   info.get('loudness'), status)
+
+    def fill(self, info):
+        """Take the details from a finished lookup, keeping a measured loudness the lookup didn't have"""
+        self.video_id = info.get('id') or self.video_id
+        self.title = info.get('title') or self.title
+        self.thumbnail = info.get('thumbnail') or ''
+        self.duration = info.get('duration') or 0
+        self.loudness = info.get('loudness') or self.loudness
+
+    def forget_stream(self):
+        self.stream_url = None
+        self.stream_resolved_at = None
+        self.stream_expires_at = 0
+
+    def to_dict(self):
+        """What clients see of the track"""
+        return {
+            'entry_id': self.entry_id,
+            'id': self.video_id,
+            'url': self.url,
+            'title': self.title,
+            'thumbnail': self.thumbnail,
+            'duration': self.duration,
+            'added_time': self.added_time,
+            'status': self.status,
+            'votes': self.votes,
+            'loudness': self.loudness,
+            'audio_format': self.audio_format,
+            'throughput_kbps': self.throughput_kbps,
+        }
 
-app = Flask(__name__)
+class VideoQueue:
+    """Queue entries in play order, indexed by entry_id (use with queue_lock held)
+
+    Popping the front, removing any entry and moving one to either end are O(1);
+    moving to a position in the middle rebuilds the order.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()  # entry_id -> queue entry, in play order
+        self.by_video = {}            # duplicate_key() -> entry_ids queued for that video
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def get(self, entry_id):
+        return self.entries.get(entry_id)
+
+    def first(self):
+        """The entry that plays next, or None"""
+        return next(iter(self.entries.values()), None)
+
+    def head(self, count):
+        """The next count entries, without copying the rest of the queue"""
+        return list(islice(self.entries.values(), count))
+
+    def find(self, key):
+        """A queued entry for the video with this duplicate_key(), or None"""
+        entry_ids = self.by_video.get(key)
+        return self.entries[next(iter(entry_ids))] if entry_ids else None
+
+    def append(self, track):
+        self.entries[track.entry_id] = track
+        self.by_video.setdefault(duplicate_key(track.url), set()).add(track.entry_id)
+
+    def _unindex(self, track):
+        key = duplicate_key(track.url)
+        entry_ids = self.by_video.get(key)
+        if entry_ids:
+            entry_ids.discard(track.entry_id)
+            if not entry_ids:
+                del self.by_video[key]
+
+    def extend(self, tracks):
+        for track in tracks:
+            self.append(track)
+
+    def popleft(self):
+        track = self.entries.popitem(last=False)[1]
+        self._unindex(track)
+        return track
+
+    def remove(self, entry_id):
+        """Drop an entry; returns it, or None if it isn't queued"""
+        track = self.entries.pop(entry_id, None)
+        if track is not None:
+            self._unindex(track)
+        return track
+
+    def move(self, entry_id, position):
+        """Move an entry to a 0-based position, clamped to the queue; returns where it ended up, or None if it isn't queued"""
+        if entry_id not in self.entries:
+            return None
+
+        position = max(0, min(position, len(self.entries) - 1))
+        if position == 0:
+            self.entries.move_to_end(entry_id, last=False)
+        elif position == len(self.entries) - 1:
+            self.entries.move_to_end(entry_id)
+        else:
+            order = [key for key in self.entries if key != entry_id]
+            order.insert(position, entry_id)
+            self.entries = OrderedDict((key, self.entries[key]) for key in order)
+        return position
+
+    def promote(self, entry_id):
+        """Move an entry ahead of every entry with fewer votes; returns its new position"""
+        votes = self.entries[entry_id].votes
+        for position, track in enumerate(self.entries.values()):
+            if track.entry_id == entry_id:
+                return position
+            if track.votes < votes:
+                return self.move(entry_id, position)
+
+    def clear(self):
+        self.entries.clear()
+        self.by_video.clear()
 
 # Video queue to store YouTube video information
-video_queue = []
+video_queue = VideoQueue()
 current_video = None
+
+# The last few finished tracks, for /history; older ones are only in the persistent play history
+RECENT_PLAYS = int(os.environ.get('JUNIE_RECENT_PLAYS', '200'))
+HISTORY_PAGE_SIZE = 20      # Tracks per /history page unless the client asks for another size
+recent_plays = deque(maxlen=RECENT_PLAYS)  # (finished_at, outcome, track), oldest first, guarded by queue_lock
 player = None
-player_lock = threading.Lock()
-queue_lock = threading.Lock()
+player_lock = InstrumentedLock('player_lock')
+queue_lock = InstrumentedLock('queue_lock')
+
+# Notified (with queue_lock held) whenever the queue changes, a skip is requested or VLC reports an event
+queue_changed = threading.Condition(queue_lock)
+playback_event = None   # Latest VLC event for the current track: 'playing', 'ended' or 'error' (an end is kept until taken)
+playback_position = 0   # Last reported position of the current track in milliseconds, from TimeChanged events
+skip_requested = False
+track_due = None        # (time, source) the current track became due, until VLC reports Playing
+track_ended_at = None   # When the last track ended with another one waiting, until the next one plays
+
+COLD_START_SECONDS = Gauge('junie_cold_start_seconds', 'Process start until background warm-up finished',
+                           lambda: cold_start_seconds or 0)
+QUEUE_DEPTH = Gauge('junie_queue_depth', 'Videos waiting in the queue', lambda: len(video_queue))
+
+# Bumped whenever anything clients can see in /queue changes, so they only fetch what's new
+state_version = 0
+snapshot_cache = (-1, '')  # (state_version, serialized /queue body), replaced whole and never mutated
+BOOT_ID = uuid.uuid4().hex[:8]  # Keeps ETags from a previous run from matching this one
+EVENTS_KEEPALIVE_INTERVAL = 15  # Seconds between SSE keep-alive comments
+EVENTS_DISCONNECT_CHECK_INTERVAL = 5  # Seconds between checks whether an /events client has gone
+EVENTS_MAX_STREAMS = int(os.environ.get('JUNIE_EVENTS_MAX_STREAMS', '24'))  # Open /events streams; keep well under the server threads
+EVENTS_RETRY_SECONDS = 60       # Pages turned away from /events poll /queue this long before trying again
+event_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
 
 # Thread for playing videos
 player_thread = None
 player_thread_running = False
+engine_start_lock = threading.Lock()
+app_initialized = False
+
+# Start-up: the port binds first, everything slow happens on the warm-up thread
+warmup_thread = None
+warmup_done = threading.Event()
+warmup_steps = OrderedDict()  # step name -> {'seconds': ..., 'ok': ...}
+app_ready_seconds = None      # Process start until the app was handed to the server
+cold_start_seconds = None     # Process start until warm-up finished
+
+# Stream URL pre-resolution for the next few queued videos
+PRERESOLVE_AHEAD = int(os.environ.get('JUNIE_PRERESOLVE_AHEAD', '3'))     # How many queued videos to keep ready
+PRERESOLVE_WORKERS = int(os.environ.get('JUNIE_PRERESOLVE_WORKERS', '2')) # Parallel resolutions
+STREAM_URL_MAX_AGE = int(os.environ.get('JUNIE_STREAM_URL_MAX_AGE', '3600')) # Lifetime assumed for URLs without an expire parameter (seconds)
+STREAM_URL_REFRESH_MARGIN = int(os.environ.get('JUNIE_STREAM_URL_REFRESH_MARGIN', '900')) # Re-resolve this long before a URL expires (seconds)
+STREAM_EXPIRE_PATTERN = re.compile(r'[?&/]expire[=/](\d+)')  # googlevideo URLs carry expire=<unix time> (or /expire/<t>/)
+MID_TRACK_RESUME_ATTEMPTS = 2   # Re-resolve and resume this many times per track after a stream error or stall
+STALL_CHECK_INTERVAL = 1        # Seconds between watchdog samples while a track plays
+STALL_SECONDS = float(os.environ.get('JUNIE_STALL_SECONDS', '3'))  # No progress and no new input for this long is a stall
+STALL_BUFFERING_SECONDS = float(os.environ.get('JUNIE_STALL_BUFFERING_SECONDS', '10'))  # No progress at all, even with input trickling in
+RESOLVER_RECHECK_INTERVAL = 30  # Seconds between staleness checks when the queue is idle
+
+# Audio format selection from measured download throughput
+AUDIO_MAX_KBPS = int(os.environ.get('JUNIE_AUDIO_MAX_KBPS', '0'))  # Never pick a format above this bitrate (0: no limit)
+AUDIO_THROUGHPUT_HEADROOM = 0.75  # Only formats up to this share of the measured throughput are picked
+AUDIO_UPSWITCH_MARGIN = 1.25      # The throughput has to beat the current ceiling by this factor to raise it
+THROUGHPUT_SMOOTHING = 0.3        # Weight of each new sample in the moving average
+THROUGHPUT_PROBE_BYTES = 64 * 1024  # The range probe of a resolved URL downloads this much
+THROUGHPUT_PROBE_MIN_BYTES = 16 * 1024  # Shorter probe bodies say more about latency than throughput
+THROUGHPUT_WINDOW = 5             # Seconds of playback per throughput sample
+THROUGHPUT_PACED_RATIO = 0.8      # Reading at least this share of a track's bitrate counts as keeping up (VBR varies)
+PLAYBACK_START_TIMEOUT = 5      # Seconds to wait for VLC to report Playing
+
+resolver_thread = None
+resolver_wakeup = threading.Event()
+resolver_executor = ThreadPoolExecutor(max_workers=PRERESOLVE_WORKERS, thread_name_prefix='resolver-worker')
+resolving_videos = set()  # id() of queue entries currently being resolved, guarded by queue_lock
+
+# One VLC instance and player for the whole process, guarded by player_lock
+VLC_ARGS = [
+    '--verbose=0',                # VLC's own console logging: errors only, unless our log callback takes over
+    '--aout=alsa',                # Use ALSA audio output
+    '--alsa-audio-device=default', # Use default ALSA device (3.5mm jack if configured)
+    '--file-caching=3000',        # Increase file cache
+    '--network-caching=3000',     # Increase network cache
+    '--sout-mux-caching=3000',    # Increase mux cache
+    '--no-video',                 # Disable video output since we only need audio
+]
+
+# Loudness: each track gets a fixed gain from its measured loudness; the realtime compressor is opt-in
+AUDIO_COMPRESSOR = os.environ.get('JUNIE_AUDIO_COMPRESSOR', '0') == '1'
+if AUDIO_COMPRESSOR:
+    VLC_ARGS.append('--audio-filter=compressor')
+PREROLL_SECONDS = int(os.environ.get('JUNIE_PREROLL_SECONDS', '15'))  # Queue the next track this long before the current one ends
+
+# libvlc messages can be passed to the 'junie.vlc' logger at or above this level (changeable through /logs/level).
+# Capturing them means formatting libvlc's va_list through ctypes, which relies on the platform's calling
+# convention and can crash in native code where that differs, so it is opt-in
+VLC_LOG_CAPTURE = os.environ.get('JUNIE_VLC_LOG_CAPTURE', '0') == '1'
+VLC_LOG_LEVEL = os.environ.get('JUNIE_VLC_LOG_LEVEL', 'WARNING').upper()
+VLC_LOG_LEVELS = {0: logging.DEBUG, 2: logging.INFO, 3: logging.WARNING, 4: logging.ERROR}  # libvlc level -> logging level
+VLC_LOG_MESSAGE_BYTES = 1024
+
+vlc_log = logging.getLogger('junie.vlc')
+vlc_log_threshold = logging.WARNING
+vlc_log_callback = None  # Must stay referenced for as long as libvlc may call it
+libc = None
+
+def on_vlc_log(data, level, context, message_format, arguments):
+    """libvlc log callback, called on VLC's threads"""
+    level = VLC_LOG_LEVELS.get(level, logging.DEBUG)
+    threshold = vlc_log_threshold
+    # Most messages are debug chatter, dropped here before any formatting
+    if threshold is None or level < threshold or not vlc_log.isEnabledFor(level):
+        return
+    try:
+        message = ctypes.create_string_buffer(VLC_LOG_MESSAGE_BYTES)
+        libc.vsnprintf(message, VLC_LOG_MESSAGE_BYTES, message_format, ctypes.cast(arguments, ctypes.c_void_p))
+        vlc_log.log(level, message.value.decode('utf-8', 'replace'))
+    except Exception:
+        pass  # Never let an exception escape into libvlc
+
+def install_vlc_logging(instance):
+    """Route libvlc's log messages into our logging instead of stderr, if JUNIE_VLC_LOG_CAPTURE asks for it"""
+    global vlc_log_callback, libc
+
+    if not VLC_LOG_CAPTURE:
+        return
+    decorators = getattr(vlc, 'CallbackDecorators', None)
+    if decorators is None or not hasattr(instance, 'log_set'):
+        return
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.vsnprintf.argtypes = [ctypes.c_char_p, ctypes.c_size_t, ctypes.c_char_p, ctypes.c_void_p]
+        vlc_log_callback = decorators.LogCb(on_vlc_log)
+        instance.log_set(vlc_log_callback, None)
+    except Exception as e:
+        log.warning(f"Could not capture VLC's log, it stays on stderr: {e}")
+
+def set_vlc_log_level(name):
+    """Change which libvlc messages are logged, e.g. 'debug' while chasing a playback problem or 'off'"""
+    global vlc_log_threshold
+    name = str(name).upper()
+    level = None if name == 'OFF' else log_level(name, None)
+    if level is None and name != 'OFF':
+        raise ValueError(f"Unknown log level '{name}'")
+    vlc_log_threshold = level
+    # The VLC records still have to get past the logger's own level
+    if level is not None and level < log.getEffectiveLevel():
+        vlc_log.setLevel(level)
+    else:
+        vlc_log.setLevel(logging.NOTSET)
+
+def vlc_log_level_name():
+    return 'OFF' if vlc_log_threshold is None else logging.getLevelName(vlc_log_threshold)
+
+try:
+    set_vlc_log_level(VLC_LOG_LEVEL)
+except ValueError:
+    log.warning(f"Unknown JUNIE_VLC_LOG_LEVEL '{VLC_LOG_LEVEL}', using WARNING")
+
+vlc_instance = None
+list_player = None
+media_list = None
+audio_device = None
+preloaded_video = None  # Queue entry already appended to media_list behind the current track
+rolled_video = None     # Pre-rolled entry VLC has moved on to, waiting for the player thread to pick it up
+
+# On-disk caches live next to the app unless told otherwise
+CACHE_DIR = os.environ.get('JUNIE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+METADATA_CACHE_SIZE = int(os.environ.get('JUNIE_METADATA_CACHE_SIZE', '5000'))   # Max cached videos
+METADATA_CACHE_TTL = int(os.environ.get('JUNIE_METADATA_CACHE_TTL', str(7 * 24 * 3600)))  # Seconds
+METADATA_TOUCH_BATCH = 100           # Cache hits whose last_used is written together
+METADATA_TOUCH_FLUSH_INTERVAL = 300  # ... or at least this often (seconds)
+METADATA_FIELDS = ('id', 'title', 'thumbnail', 'duration', 'loudness')  # What we keep per video
+
+VIDEO_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+def normalize_video_id(url):
+    """Return the 11-character YouTube video ID for a watch, youtu.be, shorts, embed or music URL, or None"""
+    if not url:
+        return None
 
-def extract_video_info(url):
-    """Extract video information from YouTube URL"""
-    # Use the same improved options as in download_and_play_video
-    ydl_opts = {
-        # More specific format selection to target audio streams
-        'format': 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio[ext=webm]/bestaudio/best',
-        'noplaylist': True,
-        'quiet': False,  # Set to False for debugging
-        'nocheckcertificate': True,
-        'ignoreerrors': False,
-        'logtostderr': False,
-        'default_search': 'auto',
-        'source_address': '0.0.0.0',
-        # Updated user-agent to a more recent browser version
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-        },
-        # Add youtube-dl specific options
-        'youtube_include_dash_manifest': False,
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['android'],
-                'skip': ['hls', 'dash'],
+    url = url.strip()
+    if VIDEO_ID_PATTERN.match(url):
+        return url
+    if '://' not in url:
+        url = 'https://' + url
+
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+
+    host = (parsed.hostname or '').lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+
+    candidate = None
+    if host == 'youtu.be':
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host in ('youtube.com', 'music.youtube.com', 'youtube-nocookie.com'):
+        parts = [p for p in parsed.path.split('/') if p]
+        if parts and parts[0] == 'watch':
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        elif len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+            candidate = parts[1]
+
+    if candidate and VIDEO_ID_PATTERN.match(candidate):
+        return candidate
+    return None
+
+def duplicate_key(url):
+    """What makes two queued URLs the same video: the video ID, or the URL itself if it has none"""
+    return normalize_video_id(url) or url
+
+class SingleFlight:
+    """Lets concurrent calls for the same key share the result of the one already running"""
+
+    def __init__(self, purpose):
+        self.purpose = purpose
+        self.lock = threading.Lock()
+        self.calls = {}  # key -> Future of the call in flight
+
+    def run(self, key, function, *args):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            COALESCED_LOOKUPS.inc(purpose=self.purpose)
+            return future.result()
+
+        try:
+            result = function(*args)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+metadata_flights = SingleFlight('metadata')
+stream_flights = SingleFlight('stream')
+
+class MetadataCache:
+    """LRU cache of video metadata keyed by video ID, persisted to SQLite so it survives restarts"""
+
+    def __init__(self, path, max_entries, ttl):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # video_id -> (stored_at, metadata), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.db = None
+        # Hits only move an entry in the LRU; its last_used is written in batches rather than per hit
+        self.touched = {}  # video_id -> last_used not yet written
+        self.touches_flushed_at = time.time()
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            # Fewer fsyncs on the SD card; a crash may lose the last commits but never corrupts the cache
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                                   video_id TEXT PRIMARY KEY,
+                                   data TEXT NOT NULL,
+                                   stored_at REAL NOT NULL,
+                                   last_used REAL NOT NULL)''')
+            self.db.commit()
+            self._load()
+        except Exception as e:
+            log.warning(f"Metadata cache at {path} unavailable, keeping it in memory only: {e}")
+            self.db = None
+
+    def _load(self):
+        """Warm the in-memory LRU from disk, most recently used entries last"""
+        cutoff = time.time() - self.ttl
+        self.db.execute('DELETE FROM metadata WHERE stored_at < ?', (cutoff,))
+        rows = self.db.execute('SELECT video_id, data, stored_at FROM metadata ORDER BY last_used DESC LIMIT ?',
+                               (self.max_entries,)).fetchall()
+        for video_id, data, stored_at in reversed(rows):
+            self.entries[video_id] = (stored_at, json.loads(data))
+        self.db.execute('DELETE FROM metadata WHERE video_id NOT IN (SELECT video_id FROM metadata ORDER BY last_used DESC LIMIT ?)',
+                        (self.max_entries,))
+        self.db.commit()
+        log.info(f"Loaded {len(self.entries)} cached video(s) from {self.path}")
+
+    def _db_execute(self, sql, params):
+        """Write through to SQLite; a failing disk should never break adding videos"""
+        if self.db is None:
+            return
+        try:
+            self.db.execute(sql, params)
+            self.db.commit()
+        except Exception as e:
+            log.warning(f"Metadata cache write failed: {e}")
+
+    def flush_touches(self, commit=True):
+        """Write the pending last_used times in one transaction (call with lock held)"""
+        self.touches_flushed_at = time.time()
+        if not self.touched:
+            return
+        touched, self.touched = self.touched, {}
+        if self.db is None:
+            return
+        try:
+            self.db.executemany('UPDATE metadata SET last_used = ? WHERE video_id = ?',
+                                [(last_used, video_id) for video_id, last_used in touched.items()])
+            if commit:
+                self.db.commit()
+        except Exception as e:
+            log.warning(f"Metadata cache write failed: {e}")
+
+    def flush(self):
+        """Write the pending last_used times now, e.g. on shutdown"""
+        with self.lock:
+            self.flush_touches()
+
+    def get(self, video_id):
+        """Return cached metadata for a video ID, or None on a miss or expired entry"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, metadata = entry
+            if time.time() - stored_at > self.ttl:
+                del self.entries[video_id]
+                self.expired += 1
+                self.misses += 1
+                self.touched.pop(video_id, None)
+                self._db_execute('DELETE FROM metadata WHERE video_id = ?', (video_id,))
+                return None
+
+            self.entries.move_to_end(video_id)
+            self.hits += 1
+            now = time.time()
+            self.touched[video_id] = now
+            if len(self.touched) >= METADATA_TOUCH_BATCH or now - self.touches_flushed_at >= METADATA_TOUCH_FLUSH_INTERVAL:
+                self.flush_touches()
+            return dict(metadata)
+
+    def peek(self, video_id):
+        """Cached, unexpired metadata for a video ID without counting a lookup or refreshing its place in the LRU"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                return None
+            return dict(entry[1])
+
+    def update(self, video_id, **fields):
+        """Add fields to an already cached video, e.g. its loudness once measured"""
+        with self.lock:
+            entry = self.entries.get(video_id)
+            if entry is None:
+                return
+            stored_at, metadata = entry
+            metadata = dict(metadata, **fields)
+            self.entries[video_id] = (stored_at, metadata)
+            self._db_execute('UPDATE metadata SET data = ? WHERE video_id = ?', (json.dumps(metadata), video_id))
+
+    def put(self, video_id, metadata):
+        """Store metadata for a video ID, evicting the least recently used entries past the size limit"""
+        now = time.time()
+        metadata = {k: metadata.get(k) for k in METADATA_FIELDS}
+        with self.lock:
+            # A fresh lookup doesn't measure loudness, so keep what we already know
+            previous = self.entries.get(video_id)
+            if previous and metadata['loudness'] is None:
+                metadata['loudness'] = previous[1].get('loudness')
+            self.entries[video_id] = (now, metadata)
+            self.entries.move_to_end(video_id)
+            self.touched.pop(video_id, None)
+            # The hits since the last write go out in the same commit
+            self.flush_touches(commit=False)
+            self._db_execute('INSERT OR REPLACE INTO metadata (video_id, data, stored_at, last_used) VALUES (?, ?, ?, ?)',
+                             (video_id, json.dumps(metadata), now, now))
+
+            while len(self.entries) > self.max_entries:
+                evicted_id, _ = self.entries.popitem(last=False)
+                self.evictions += 1
+                self._db_execute('DELETE FROM metadata WHERE video_id = ?', (evicted_id,))
+
+    def stats(self):
+        """Hit/miss counters for the /stats endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'persistent': self.db is not None,
+            }
+
+if not WORKER_COPY:
+    metadata_cache = MetadataCache(os.path.join(CACHE_DIR, 'metadata.sqlite3'), METADATA_CACHE_SIZE, METADATA_CACHE_TTL)
+    atexit.register(metadata_cache.flush)
+
+# Optional on-disk audio cache so repeat requests play from the SD card instead of YouTube
+AUDIO_CACHE_BYTES = int(float(os.environ.get('JUNIE_AUDIO_CACHE_MB', '0')) * 1024 * 1024)  # 0 disables the cache
+AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, 'audio')
+AUDIO_CACHE_SPARE = 2           # Download only while the bitrate ceiling fits the track this many times over
+AUDIO_CACHE_TRACK_KBPS = 160    # Bitrate assumed for a track whose format isn't known yet
+
+def track_video_id(track):
+    """Best video ID for a track: the extracted one if it looks real, otherwise parsed from the URL"""
+    if track.video_id and VIDEO_ID_PATTERN.match(track.video_id):
+        return track.video_id
+    return normalize_video_id(track.url)
+
+class AudioCache:
+    """Byte-bounded LRU cache of downloaded audio files, one file per video ID"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = OrderedDict()  # video_id -> (path, size), least recently used first
+        self.total_bytes = 0
+        self.downloading = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.downloads = 0
+        self.download_failures = 0
+        self.deferred = 0  # Downloads put off because playback needed the link
+        self.executor = None
+
+        if not self.enabled:
+            return
+
+        # Downloads share the uplink with the live stream, so only ever run one at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-cache')
+        try:
+            os.makedirs(os.path.join(directory, 'tmp'), exist_ok=True)
+            self._load()
+        except Exception as e:
+            log.warning(f"Audio cache at {directory} unavailable: {e}")
+            self.max_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load(self):
+        """Index files left from previous runs, using modification time as the last-used time"""
+        shutil.rmtree(os.path.join(self.directory, 'tmp'), ignore_errors=True)
+        os.makedirs(os.path.join(self.directory, 'tmp'), exist_ok=True)
+
+        found = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            video_id = name.split('.')[0]
+            if os.path.isfile(path) and VIDEO_ID_PATTERN.match(video_id):
+                stat = os.stat(path)
+                found.append((stat.st_mtime, video_id, path, stat.st_size))
+
+        for _, video_id, path, size in sorted(found):
+            self.files[video_id] = (path, size)
+            self.total_bytes += size
+
+        with self.lock:
+            self._evict()
+        log.info(f"Audio cache holds {len(self.files)} file(s), {self.total_bytes // (1024 * 1024)} MB")
+
+    def _evict(self):
+        """Drop least recently used files until we're within budget (call with self.lock held)"""
+        while self.total_bytes > self.max_bytes and self.files:
+            video_id, (path, size) = self.files.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError as e:
+                log.warning(f"Could not remove cached audio {path}: {e}")
+
+    def contains(self, video_id):
+        """Whether a file is cached for this video ID, without counting a lookup"""
+        with self.lock:
+            return video_id in self.files
+
+    def record_lookup(self, hit):
+        """Count a hit or miss for a lookup made with count=False"""
+        if not self.enabled:
+            return
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, video_id, count=True):
+        """Return the cached file path for a video ID and mark it recently used, or None"""
+        if not self.enabled or not video_id:
+            return None
+
+        with self.lock:
+            entry = self.files.get(video_id)
+            if entry is None or not os.path.exists(entry[0]):
+                if entry is not None:
+                    del self.files[video_id]
+                    self.total_bytes -= entry[1]
+                if count:
+                    self.misses += 1
+                return None
+
+            self.files.move_to_end(video_id)
+            if count:
+                self.hits += 1
+
+        # Persist the LRU order across restarts
+        try:
+            os.utime(entry[0])
+        except OSError:
+            pass
+        return entry[0]
+
+    @staticmethod
+    def link_has_room(kbps):
+        """Whether the link leaves room to download a track of kbps bitrate next to the stream that's playing"""
+        return link_throughput.has_room(AUDIO_CACHE_SPARE * (kbps or AUDIO_CACHE_TRACK_KBPS))
+
+    def schedule(self, track):
+        """Download a track's audio in the background if it isn't cached yet and the link has room"""
+        video_id = track_video_id(track)
+        if not self.enabled or not video_id:
+            return
+        kbps = track.audio_format and track.audio_format['kbps']
+
+        with self.lock:
+            if video_id in self.files or video_id in self.downloading:
+                return
+            if not self.link_has_room(kbps):
+                self.deferred += 1
+                return  # A later resolver pass tries again
+            self.downloading.add(video_id)
+
+        self.executor.submit(self._download, video_id, track.url, kbps)
+
+    @staticmethod
+    def format_selector(ceiling):
+        """yt-dlp format for a cached download: like choose_audio_format, the best audio under the ceiling,
+        otherwise the smallest"""
+        if ceiling is None:
+            return 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
+        limit = f'[abr<={ceiling:.0f}]'
+        return f'bestaudio[ext=m4a]{limit}/bestaudio[ext=webm]{limit}/bestaudio{limit}/worstaudio/worst'
+
+    def _download(self, video_id, url, kbps=None):
+        """Fetch the audio for one video into the cache"""
+        tmp_dir = os.path.join(self.directory, 'tmp', video_id)
+        try:
+            # Downloads queue up behind each other, so the link may have filled up since this one was scheduled
+            if not self.link_has_room(kbps):
+                with self.lock:
+                    self.deferred += 1
+                return
+
+            ydl_opts = {
+                'format': self.format_selector(link_throughput.ceiling()),
+                'outtmpl': os.path.join(tmp_dir, f'{video_id}.%(ext)s'),
+                'noplaylist': True,
+                'quiet': True,
+                'no_warnings': True,
+                'nocheckcertificate': True,
+                'noprogress': True,
+                'max_filesize': self.max_bytes,
+                'http_headers': {
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+                },
             }
+            log.debug(f"Caching audio for {video_id}")
+            if extraction_service.enabled:
+                extraction_service.download(ydl_opts, url)
+            else:
+                with yt_dlp.YoutubeDL(dict(ydl_opts, logger=ydl_logger)) as ydl:
+                    ydl.download([url])
+
+            downloaded = [name for name in os.listdir(tmp_dir) if not name.endswith('.part')] if os.path.isdir(tmp_dir) else []
+            if not downloaded:
+                raise Exception("yt-dlp produced no file")
+
+            path = os.path.join(self.directory, downloaded[0])
+            os.replace(os.path.join(tmp_dir, downloaded[0]), path)
+            size = os.path.getsize(path)
+
+            with self.lock:
+                old = self.files.pop(video_id, None)
+                if old:
+                    self.total_bytes -= old[1]
+                self.files[video_id] = (path, size)
+                self.total_bytes += size
+                self.downloads += 1
+                self._evict()
+            log.info(f"Cached audio for {video_id} ({size // 1024} KB)")
+            loudness_analyzer.schedule(video_id, path)
+
+        except Exception as e:
+            log.warning(f"Audio cache download failed for {video_id}: {e}")
+            with self.lock:
+                self.download_failures += 1
+
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            with self.lock:
+                self.downloading.discard(video_id)
+
+    def stats(self):
+        """Counters for the /stats endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'files': len(self.files),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'downloads': self.downloads,
+                'download_failures': self.download_failures,
+                'deferred': self.deferred,
+                'downloading': len(self.downloading),
+            }
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, 0 if WORKER_COPY else AUDIO_CACHE_BYTES)
+
+# Loudness analysis, measured ahead of playback with ffmpeg's EBU R128 filter
+LOUDNESS_NORMALIZE = os.environ.get('JUNIE_LOUDNESS_NORMALIZE', '1') == '1'   # Needs ffmpeg on the PATH
+LOUDNESS_TARGET = float(os.environ.get('JUNIE_LOUDNESS_TARGET', '-14'))       # Integrated loudness to aim for (LUFS)
+LOUDNESS_MAX_BOOST = 6.0        # dB; quiet tracks are raised at most this much
+LOUDNESS_MAX_CUT = 20.0         # dB
+LOUDNESS_PEAK_CEILING = -1.0    # dBTP a boost may not push the true peak past
+LOUDNESS_MAX_SECONDS = 900      # Only the first this-many seconds of very long tracks are measured
+LOUDNESS_STREAM_SECONDS = 45    # Stream URLs are only sampled this far, so the track isn't downloaded twice
+LOUDNESS_STREAM_SPARE = 2       # Sample a stream only while the bitrate ceiling fits it this many times over
+LOUDNESS_STREAM_KBPS = 160      # Bitrate assumed for a stream whose format isn't known
+LOUDNESS_TIMEOUT = 300          # Seconds before an analysis is abandoned
+LOUDNESS_INTEGRATED_PATTERN = re.compile(r'I:\s+(-?[\d.]+) LUFS')
+LOUDNESS_PEAK_PATTERN = re.compile(r'Peak:\s+(-?[\d.]+|-inf) dBFS')
+
+class LoudnessAnalyzer:
+    """Measures each track's integrated loudness in the background and stores it with the video's metadata"""
+
+    def __init__(self, enabled):
+        self.ffmpeg = shutil.which('ffmpeg') if enabled else None
+        self.nice = shutil.which('nice')
+        self.lock = threading.Lock()
+        self.analyzing = set()  # Video IDs being measured
+        self.analyzed = 0
+        self.failures = 0
+        # One worker, run at low priority, so analysis never competes with playback
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='loudness')
+
+        if enabled and not self.ffmpeg:
+            log.warning("ffmpeg not found, tracks will play without loudness normalization")
+
+    @property
+    def enabled(self):
+        return self.ffmpeg is not None
+
+    def schedule(self, video_id, source, kbps=None, known=None):
+        """Measure a video from a local file, or sample its stream URL (of kbps bitrate) while the link has room;
+        a sampled measurement, whether `known` from the track or in the metadata cache, is only replaced from a file"""
+        if not self.enabled or not video_id or not source:
+            return
+        streaming = source.startswith(('http://', 'https://'))
+        if not known:
+            cached = metadata_cache.peek(video_id)
+            known = cached and cached.get('loudness')
+        if known and (streaming or not known.get('sampled')):
+            return
+        if streaming and not link_throughput.has_room(LOUDNESS_STREAM_SPARE * (kbps or LOUDNESS_STREAM_KBPS)):
+            return  # Playback needs the link more; a later pass or the audio cache can measure it
+
+        with self.lock:
+            if video_id in self.analyzing:
+                return
+            self.analyzing.add(video_id)
+
+        self.executor.submit(self._analyze, video_id, source, streaming)
+
+    def measure(self, source, seconds=LOUDNESS_MAX_SECONDS):
+        """Run ffmpeg's ebur128 filter over a file or URL; returns {'lufs': ..., 'peak': ...}"""
+        command = [self.ffmpeg, '-hide_banner', '-nostats', '-nostdin', '-t', str(seconds),
+                   '-i', source, '-map', '0:a:0', '-af', 'ebur128=peak=true:framelog=quiet', '-f', 'null', '-']
+        if self.nice:
+            command = [self.nice, '-n', '10'] + command
+
+        result = subprocess.run(command, capture_output=True, text=True, timeout=LOUDNESS_TIMEOUT)
+        integrated = LOUDNESS_INTEGRATED_PATTERN.findall(result.stderr)
+        if result.returncode != 0 or not integrated:
+            raise Exception(f"ffmpeg exited with {result.returncode}: {result.stderr.strip()[-200:]}")
+
+        # The summary comes last; a silent track has no peak
+        peak = LOUDNESS_PEAK_PATTERN.findall(result.stderr)
+        return {
+            'lufs': float(integrated[-1]),
+            'peak': float(peak[-1]) if peak and peak[-1] != '-inf' else None,
         }
-    }
 
-    try:
-        print(f"Extracting info for URL: {url}")
+    def _analyze(self, video_id, source, streaming=False):
+        try:
+            started = time.perf_counter()
+            if streaming:
+                loudness = dict(self.measure(source, LOUDNESS_STREAM_SECONDS), sampled=True)
+            else:
+                loudness = self.measure(source)
+            log.info(f"Loudness of {video_id}: {loudness['lufs']} LUFS, peak {loudness['peak']} dBTP "
+                     f"({time.perf_counter() - started:.1f}s)")
+
+            metadata_cache.update(video_id, loudness=loudness)
+            with queue_lock:
+                for track in [current_video] + list(video_queue):
+                    if track and track_video_id(track) == video_id:
+                        track.loudness = loudness
+                mark_queue_changed()
+            with self.lock:
+                self.analyzed += 1
+
+        except Exception as e:
+            log.warning(f"Loudness analysis failed for {video_id}: {e}")
+            with self.lock:
+                self.failures += 1
+
+        finally:
+            with self.lock:
+                self.analyzing.discard(video_id)
+
+    def stats(self):
+        """Counters for the /stats endpoint"""
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'target_lufs': LOUDNESS_TARGET,
+                'analyzed': self.analyzed,
+                'failures': self.failures,
+                'analyzing': len(self.analyzing),
+                'compressor': AUDIO_COMPRESSOR,
+            }
+
+loudness_analyzer = LoudnessAnalyzer(LOUDNESS_NORMALIZE and not WORKER_COPY)
+
+def track_gain_db(track):
+    """Fixed gain that brings a track to LOUDNESS_TARGET, without letting a boost push its peak past the ceiling"""
+    loudness = track.loudness
+    if not loudness:
+        cached = metadata_cache.peek(track_video_id(track) or '')
+        loudness = cached.get('loudness') if cached else None
+    if not loudness:
+        return 0.0
+
+    gain = max(-LOUDNESS_MAX_CUT, min(LOUDNESS_MAX_BOOST, LOUDNESS_TARGET - loudness['lufs']))
+    if gain > 0 and loudness.get('peak') is not None:
+        gain = min(gain, max(0.0, LOUDNESS_PEAK_CEILING - loudness['peak']))
+    return round(gain, 1)
+
+# Persistent play history with a full-text index over titles, for /search
+HISTORY_SEARCH_LIMIT = 10   # Results returned by /search unless the client asks for fewer
+SEARCH_RANK_WINDOW = 200    # Most recently played matches ranked by relevance for each search
+SEARCH_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+class PlayHistory:
+    """Every video that played, with its metadata, searchable by title through SQLite FTS5"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        # Writes go through one worker so the player thread never waits on the SD card
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
 
-        # First attempt with standard options
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-
-                # Check if we got actual audio formats
-                if 'formats' in info:
-                    audio_formats = [f for f in info.get('formats', []) 
-                                    if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
-
-                    print("Available formats:")
-                    for fmt in info.get('formats', []):
-                        print(f"  {fmt.get('format_id')}: {fmt.get('ext')} - {fmt.get('format_note', 'N/A')}")
-
-                    if not audio_formats:
-                        print("Warning: No audio-only formats found")
-
-                # Verify we have the necessary information
-                if not info.get('id') or not info.get('title'):
-                    print(f"Warning: Incomplete video information extracted: {info}")
-
-                return {
-                    'id': info.get('id'),
-                    'title': info.get('title', 'Unknown Title'),
-                    'url': url,
-                    'thumbnail': info.get('thumbnail', ''),
-                    'duration': info.get('duration', 0),
-                    'added_time': time.time()
-                }
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript('''
+                CREATE TABLE IF NOT EXISTS plays (
+                    video_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    thumbnail TEXT,
+                    duration REAL,
+                    loudness TEXT,
+                    play_count INTEGER NOT NULL DEFAULT 0,
+                    last_played REAL NOT NULL);
+                CREATE INDEX IF NOT EXISTS plays_last_played ON plays (last_played);
+                CREATE VIRTUAL TABLE IF NOT EXISTS plays_fts USING fts5(
+                    title, content='plays', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3');
+                CREATE TRIGGER IF NOT EXISTS plays_ai AFTER INSERT ON plays BEGIN
+                    INSERT INTO plays_fts (rowid, title) VALUES (new.rowid, new.title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS plays_ad AFTER DELETE ON plays BEGIN
+                    INSERT INTO plays_fts (plays_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+                END;
+                CREATE TRIGGER IF NOT EXISTS plays_au AFTER UPDATE OF title ON plays BEGIN
+                    INSERT INTO plays_fts (plays_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+                    INSERT INTO plays_fts (rowid, title) VALUES (new.rowid, new.title);
+                END;
+            ''')
+            self.db.commit()
+        except Exception as e:
+            log.warning(f"Play history at {path} unavailable: {e}")
+            self.db = None
+
+    def record(self, track):
+        """Remember that a track played, unless we never found out what it was"""
+        video_id = track_video_id(track)
+        if self.db is None or not video_id or track.status == 'failed':
+            return
+        self.executor.submit(self._record, video_id, track.to_dict())
 
+    def _record(self, video_id, video_info):
+        try:
+            loudness = video_info.get('loudness')
+            with self.lock:
+                # An upsert keeps the rowid, which the full-text index refers to
+                self.db.execute('''INSERT INTO plays (video_id, url, title, thumbnail, duration, loudness, play_count, last_played)
+                                   VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+                                   ON CONFLICT (video_id) DO UPDATE SET
+                                       url = excluded.url, title = excluded.title, thumbnail = excluded.thumbnail,
+                                       duration = excluded.duration, loudness = COALESCE(excluded.loudness, loudness),
+                                       play_count = play_count + 1, last_played = excluded.last_played''',
+                                (video_id, video_info['url'], video_info.get('title') or video_info['url'],
+                                 video_info.get('thumbnail') or '', video_info.get('duration') or 0,
+                                 json.dumps(loudness) if loudness else None, time.time()))
+                self.db.commit()
         except Exception as e:
-            print(f"First info extraction attempt failed: {e}")
-            print("Trying alternative extraction method...")
+            log.warning(f"Could not record play history for {video_id}: {e}")
+
+    def search(self, text, limit=HISTORY_SEARCH_LIMIT):
+        """Videos whose titles match every word, the last one as a prefix; recent plays for an empty query"""
+        if self.db is None:
+            return []
+
+        tokens = SEARCH_TOKEN_PATTERN.findall(text.lower())
+        columns = 'p.video_id, p.url, p.title, p.thumbnail, p.duration, p.play_count, p.last_played'
+        with self.lock:
+            if not tokens:
+                rows = self.db.execute(f'SELECT {columns} FROM plays p ORDER BY p.last_played DESC LIMIT ?',
+                                       (limit,)).fetchall()
+            else:
+                # Quoted tokens can't be read as FTS operators
+                match = ' '.join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+                # Ranking every match of a one-letter prefix would take too long for autocomplete, so only
+                # the most recently played matches are ranked. Rowids keep the order of first plays, so
+                # the window comes from the last_played index instead.
+                recent = [rowid for rowid, in self.db.execute(
+                    '''SELECT rowid FROM plays INDEXED BY plays_last_played
+                       WHERE rowid IN (SELECT rowid FROM plays_fts WHERE plays_fts MATCH ?)
+                       ORDER BY last_played DESC LIMIT ?''', (match, SEARCH_RANK_WINDOW))]
+                # The + keeps FTS5 from re-running the prefix query once per rowid; it scans the matches
+                # once and only the window's rows get a bm25 rank
+                rows = self.db.execute(f'''SELECT {columns} FROM plays_fts f JOIN plays p ON p.rowid = f.rowid
+                                           WHERE plays_fts MATCH ? AND +f.rowid IN ({', '.join('?' * len(recent))})
+                                           ORDER BY f.rank, p.play_count DESC LIMIT ?''',
+                                       (match, *recent, limit)).fetchall()
+
+        return [{'id': video_id, 'url': url, 'title': title, 'thumbnail': thumbnail, 'duration': duration,
+                 'play_count': play_count, 'last_played': last_played}
+                for video_id, url, title, thumbnail, duration, play_count, last_played in rows]
+
+    def metadata(self, video_id):
+        """Stored metadata for a video that played before, in the metadata cache's format, or None"""
+        if self.db is None:
+            return None
+        with self.lock:
+            row = self.db.execute('SELECT title, thumbnail, duration, loudness FROM plays WHERE video_id = ?',
+                                  (video_id,)).fetchone()
+        if row is None:
+            return None
+        title, thumbnail, duration, loudness = row
+        return {'id': video_id, 'title': title, 'thumbnail': thumbnail, 'duration': duration,
+                'loudness': json.loads(loudness) if loudness else None}
+
+    def stats(self):
+        if self.db is None:
+            return {'entries': 0, 'persistent': False}
+        with self.lock:
+            entries = self.db.execute('SELECT COUNT(*) FROM plays').fetchone()[0]
+        return {'entries': entries, 'persistent': True}
+
+if not WORKER_COPY:
+    play_history = PlayHistory(os.path.join(CACHE_DIR, 'history.sqlite3'))
+
+# Thumbnails, fetched from YouTube once per video and served to clients from the SD card
+THUMB_CACHE_DIR = os.path.join(CACHE_DIR, 'thumbs')
+THUMB_CACHE_BYTES = int(float(os.environ.get('JUNIE_THUMB_CACHE_MB', '50')) * 1024 * 1024)
+THUMB_WIDTH = 240               # Pixels; twice what the page shows, for high-density screens
+THUMB_QUALITY = 80              # JPEG quality of downsized thumbnails
+THUMB_MAX_AGE = 30 * 24 * 3600  # Seconds browsers may keep a thumbnail without asking again
+THUMB_RETRY_AFTER = 300         # Seconds before fetching a thumbnail that failed is tried again
+
+thumbnail_flights = SingleFlight('thumbnail')
+
+def downsize_thumbnail(data):
+    """Shrink a thumbnail to THUMB_WIDTH as a JPEG if Pillow is installed; otherwise keep it as it is"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
 
-            # Second attempt with different options
-            alt_opts = ydl_opts.copy()
-            alt_opts['format'] = 'bestaudio/best'  # Simpler format selection
-            alt_opts['youtube_include_dash_manifest'] = True  # Try including DASH
+    try:
+        import io
+        image = Image.open(io.BytesIO(data)).convert('RGB')
+        image.thumbnail((THUMB_WIDTH, THUMB_WIDTH))
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=THUMB_QUALITY, optimize=True, progressive=True)
+        return output.getvalue() if output.tell() < len(data) else data
+    except Exception as e:
+        log.warning(f"Could not downsize thumbnail: {e}")
+        return data
+
+def image_mimetype(header):
+    """Content type of a stored thumbnail from its first bytes"""
+    if header.startswith(b'\x89PNG'):
+        return 'image/png'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+class ThumbnailCache:
+    """Size-bounded LRU of downsized thumbnails on disk, keyed by video ID"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.files = OrderedDict()  # video_id -> size in bytes, least recently used first
+        self.total_bytes = 0
+        self.failed = {}            # video_id -> when fetching it last failed
+        self.hits = 0
+        self.misses = 0
+        self.fetch_failures = 0
 
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+        except Exception as e:
+            log.warning(f"Thumbnail cache at {directory} unavailable: {e}")
+
+    def _load(self):
+        """Pick up thumbnails from a previous run, oldest first"""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                 if VIDEO_ID_PATTERN.match(name)]
+        for path in sorted(paths, key=os.path.getmtime):
+            size = os.path.getsize(path)
+            self.files[os.path.basename(path)] = size
+            self.total_bytes += size
+
+    def path(self, video_id):
+        return os.path.join(self.directory, video_id)
+
+    def get(self, video_id, source_url=None):
+        """Path of the video's thumbnail, fetching it first if needed; None if it can't be had"""
+        with self.lock:
+            if video_id in self.files:
+                self.files.move_to_end(video_id)
+                self.hits += 1
+                return self.path(video_id)
+            if time.time() - self.failed.get(video_id, 0) < THUMB_RETRY_AFTER:
+                return None
+            self.misses += 1
+
+        # Every page asks at once when a video is added, but it's fetched once
+        return thumbnail_flights.run(video_id, self._fetch, video_id, source_url)
+
+    def _fetch(self, video_id, source_url):
+        with self.lock:
+            if video_id in self.files:
+                return self.path(video_id)
+
+        # The medium-size JPEG exists for every video; the extracted URL can be a large WebP
+        data = None
+        for url in [f'https://i.ytimg.com/vi/{video_id}/mqdefault.jpg'] + ([source_url] if source_url else []):
             try:
-                with yt_dlp.YoutubeDL(alt_opts) as alt_ydl:
-                    info = alt_ydl.extract_info(url, download=False)
-
-                    # Verify we have the necessary information
-                    if not info.get('id') or not info.get('title'):
-                        print(f"Warning: Incomplete video information extracted (second attempt): {info}")
-
-                    return {
-                        'id': info.get('id'),
-                        'title': info.get('title', 'Unknown Title'),
-                        'url': url,
-                        'thumbnail': info.get('thumbnail', ''),
-                        'duration': info.get('duration', 0),
-                        'added_time': time.time()
-                    }
+                response = get_http_session().get(url, timeout=(3, 10))
+                if response.status_code == 200 and response.content:
+                    data = response.content
+                    break
             except Exception as e:
-                print(f"Second info extraction attempt failed: {e}")
-                print("Trying third extraction method...")
-
-                # Third attempt with completely different approach
-                third_opts = {
-                    'format': 'bestaudio',
-                    'quiet': False,
-                    'no_warnings': False,
-                    'nocheckcertificate': True,
-                    'ignoreerrors': False,
-                    'logtostderr': False,
-                    'geo_bypass': True,  # Try to bypass geo-restrictions
-                    'geo_bypass_country': 'US',  # Pretend to be in the US
-                    'http_headers': {
-                        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0',
-                        'Accept-Language': 'en-US,en;q=0.5',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                    },
-                    'extractor_args': {
-                        'youtube': {
-                            'player_client': ['web'],  # Try web client instead
-                            'skip': [],  # Don't skip any formats
-                        }
-                    }
-                }
+                log.warning(f"Could not fetch thumbnail {url}: {e}")
 
+        if data is None:
+            with self.lock:
+                self.failed[video_id] = time.time()
+                self.fetch_failures += 1
+            return None
+
+        data = downsize_thumbnail(data)
+        path = self.path(video_id)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            log.warning(f"Could not store thumbnail for {video_id}: {e}")
+            return None
+
+        with self.lock:
+            self.failed.pop(video_id, None)
+            self.files[video_id] = len(data)
+            self.total_bytes += len(data)
+            while self.total_bytes > self.max_bytes and len(self.files) > 1:
+                evicted_id, size = self.files.popitem(last=False)
+                self.total_bytes -= size
                 try:
-                    with yt_dlp.YoutubeDL(third_opts) as third_ydl:
-                        info = third_ydl.extract_info(url, download=False)
-
-                        # Verify we have the necessary information
-                        if not info.get('id') or not info.get('title'):
-                            print(f"Warning: Incomplete video information extracted (third attempt): {info}")
-                            raise Exception("Incomplete video information")
-
-                        return {
-                            'id': info.get('id'),
-                            'title': info.get('title', 'Unknown Title'),
-                            'url': url,
-                            'thumbnail': info.get('thumbnail', ''),
-                            'duration': info.get('duration', 0),
-                            'added_time': time.time()
-                        }
-                except Exception as e:
-                    print(f"Third info extraction attempt failed: {e}")
-                    print("Trying fourth extraction method with invidious API...")
-
-                    # Fourth attempt using invidious API as a fallback
-                    try:
-                        import requests
-                        import json
-                        import random
-
-                        # List of public invidious instances
-                        invidious_instances = [
-                            "https://invidious.snopyta.org",
-                            "https://yewtu.be",
-                            "https://invidious.kavin.rocks",
-                            "https://vid.puffyan.us",
-                            "https://invidious.namazso.eu"
-                        ]
-
-                        # Select a random instance
-                        instance = random.choice(invidious_instances)
-                        video_id = url.split('v=')[1].split('&')[0] if 'v=' in url else url.split('/')[-1]
-                        api_url = f"{instance}/api/v1/videos/{video_id}"
-
-                        print(f"Trying invidious API for info extraction: {api_url}")
-
-                        response = requests.get(api_url, timeout=10)
-                        if response.status_code == 200:
-                            data = response.json()
-
-                            return {
-                                'id': video_id,
-                                'title': data.get('title', 'Unknown Title (Invidious)'),
-                                'url': url,
-                                'thumbnail': data.get('thumbnailUrl', ''),
-                                'duration': data.get('lengthSeconds', 0),
-                                'added_time': time.time()
-                            }
-                        else:
-                            print(f"Invidious API returned status code: {response.status_code}")
-                    except Exception as e:
-                        print(f"Invidious API info extraction failed: {e}")
-
-                    # If all methods fail, return minimal info
-                    return {
-                        'id': 'unknown',
-                        'title': f"Unknown Title (URL: {url})",
-                        'url': url,
-                        'thumbnail': '',
-                        'duration': 0,
-                        'added_time': time.time()
-                    }
+                    os.remove(self.path(evicted_id))
+                except OSError:
+                    pass
+        return path
+
+    def stats(self):
+        with self.lock:
+            return {
+                'files': len(self.files),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetch_failures': self.fetch_failures,
+            }
 
-    except Exception as e:
-        print(f"Error extracting video info: {e}")
-        # Return minimal info so the queue still works
-        return {
-            'id': 'error',
-            'title': f"Error: {str(e)[:50]}...",
-            'url': url,
-            'thumbnail': '',
-            'duration': 0,
-            'added_time': time.time()
+if not WORKER_COPY:
+    thumbnail_cache = ThumbnailCache(THUMB_CACHE_DIR, THUMB_CACHE_BYTES)
+
+# Bundled CSS and JavaScript, served from memory with gzip so the page loads from the Pi alone
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_MAX_AGE = 365 * 24 * 3600  # Asset URLs carry a content hash, so they can be cached for good
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+static_assets = {}  # filename -> (mtime, version, mimetype, body, gzipped body or None)
+static_assets_lock = threading.Lock()
+
+def load_static_asset(filename):
+    """Read and compress a bundled file once (again if it changes on disk); None if there's no such file"""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+
+    mtime = os.path.getmtime(path)
+    with static_assets_lock:
+        asset = static_assets.get(filename)
+    if asset and asset[0] == mtime:
+        return asset
+
+    with open(path, 'rb') as f:
+        body = f.read()
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    gzipped = gzip.compress(body, 9) if mimetype.startswith(COMPRESSIBLE_TYPES) else None
+    asset = (mtime, hashlib.sha1(body).hexdigest()[:12], mimetype, body, gzipped)
+    with static_assets_lock:
+        static_assets[filename] = asset
+    return asset
+
+@app.template_global()
+def asset_url(filename):
+    """URL of a bundled file, versioned by its content so browsers can cache it indefinitely"""
+    asset = load_static_asset(filename)
+    return url_for('static', filename=filename, v=asset[1] if asset else None)
+
+def compressible_response(body, gzipped, mimetype, etag):
+    """Response that sends the gzipped body to clients that accept it, answering 304 for a matching ETag"""
+    use_gzip = gzipped is not None and request.accept_encodings['gzip'] > 0
+    etag = f'{etag}-gz' if use_gzip else etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(gzipped if use_gzip else body, mimetype=mimetype)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Background metadata lookups for /add
+METADATA_WORKERS = int(os.environ.get('JUNIE_METADATA_WORKERS', '2'))        # Parallel extractions
+METADATA_MAX_PENDING = int(os.environ.get('JUNIE_METADATA_MAX_PENDING', '20')) # Lookups allowed to wait before /add pushes back
+
+DUPLICATE_POLICY = os.environ.get('JUNIE_DUPLICATE_POLICY', 'allow')        # Adding a queued video again: 'allow', 'reject' or 'vote'
+if DUPLICATE_POLICY not in ('allow', 'reject', 'vote'):
+    log.warning(f"Unknown JUNIE_DUPLICATE_POLICY '{DUPLICATE_POLICY}', allowing duplicates")
+    DUPLICATE_POLICY = 'allow'
+
+metadata_executor = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix='metadata-worker')
+metadata_slots = threading.BoundedSemaphore(METADATA_MAX_PENDING)
+
+# Playlist imports: entries are queued from a flat listing and looked up properly near the front
+PLAYLIST_MAX_ENTRIES = int(os.environ.get('JUNIE_PLAYLIST_MAX_ENTRIES', '500'))         # Cap per import
+PLAYLIST_RESOLVE_DISTANCE = int(os.environ.get('JUNIE_PLAYLIST_RESOLVE_DISTANCE', '5')) # Full lookup once this close to the front
+PLAYLIST_BATCH_SIZE = 20  # Entries published to the queue at a time while importing
+playlist_import_slots = threading.BoundedSemaphore(int(os.environ.get('JUNIE_PLAYLIST_IMPORTS', '1')))
+
+def cached_video_info(url):
+    """Return a video's metadata from the cache or the play history, or None if the video hasn't been seen before"""
+    video_id = normalize_video_id(url)
+    if not video_id:
+        return None
+
+    cached = metadata_cache.get(video_id)
+    if cached:
+        log.debug(f"Metadata cache hit for {video_id}")
+    else:
+        # Anything that played before is in the history, even once the cache has forgotten it
+        cached = play_history.metadata(video_id)
+        if cached is None:
+            return None
+        log.debug(f"Play history hit for {video_id}")
+        metadata_cache.put(video_id, cached)
+
+    return cached
+
+def extract_video_info(url, check_cache=True):
+    """A video's metadata, using the metadata cache when we've seen the video before; None if the lookup failed"""
+    if check_cache:
+        cached = cached_video_info(url)
+        if cached:
+            return cached
+
+    # Several guests pasting the same link share one extraction
+    return metadata_flights.run(duplicate_key(url), fetch_and_cache_video_info, url)
+
+def fetch_and_cache_video_info(url):
+    """Extract a video's metadata and remember it if the extraction worked"""
+    video_id = normalize_video_id(url)
+
+    # A lookup that waited behind an identical one finds its result already cached
+    cached = metadata_cache.peek(video_id) if video_id else None
+    if cached:
+        COALESCED_LOOKUPS.inc(purpose='metadata')
+        return cached
+
+    info = fetch_video_info(url)
+    if info:
+        metadata_cache.put(video_id or info['id'], info)
+    return info
+
+class YtDlpLogger:
+    """Sends yt-dlp's output to the 'junie.yt_dlp' logger instead of stdout"""
+
+    def __init__(self):
+        self.log = logging.getLogger('junie.yt_dlp')
+
+    def debug(self, message):
+        self.log.debug(message)
+
+    def info(self, message):
+        self.log.info(message)
+
+    def warning(self, message):
+        self.log.warning(message)
+
+    def error(self, message):
+        # The error is raised as well and logged by whoever tried the extraction
+        self.log.info(message)
+
+ydl_logger = YtDlpLogger()
+
+# yt-dlp option sets for each extraction strategy
+YDL_ANDROID_OPTS = {
+    # More specific format selection to target audio streams
+    'format': 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio[ext=webm]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': False,  # Progress goes to ydl_logger at debug level
+    'logger': ydl_logger,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'default_search': 'auto',
+    'source_address': '0.0.0.0',
+    # Updated user-agent to a more recent browser version
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
+    },
+    # Add youtube-dl specific options
+    'youtube_include_dash_manifest': False,  # Skip DASH manifests that might cause issues
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['android'],  # Try android client which might be more reliable
+            'skip': ['hls', 'dash'],  # Skip HLS and DASH formats which might cause issues
         }
+    }
+}
+
+YDL_DASH_OPTS = dict(YDL_ANDROID_OPTS,
+                     format='bestaudio/best',            # Simpler format selection
+                     youtube_include_dash_manifest=True) # Try including DASH
+
+YDL_WEB_OPTS = {
+    'format': 'bestaudio',
+    'quiet': False,
+    'no_warnings': False,
+    'logger': ydl_logger,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'geo_bypass': True,  # Try to bypass geo-restrictions
+    'geo_bypass_country': 'US',  # Pretend to be in the US
+    'http_headers': {
+        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    },
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['web'],  # Try web client instead
+            'skip': [],  # Don't skip any formats
+        }
+    }
+}
+
+# Public Invidious instances, overridable with a comma-separated JUNIE_INVIDIOUS_INSTANCES
+INVIDIOUS_INSTANCES = [instance.strip().rstrip('/') for instance in os.environ.get(
+    'JUNIE_INVIDIOUS_INSTANCES', 'https://inv.nadeko.net,https://yewtu.be,https://invidious.nerdvpn.de').split(',')
+    if instance.strip()]
+INVIDIOUS_ATTEMPTS = 2              # Instances tried per lookup
+INVIDIOUS_TIMEOUT = (3, 10)         # Connect and read timeouts (seconds)
+INVIDIOUS_FAILURE_THRESHOLD = 2     # Consecutive failures before an instance is taken out of rotation
+INVIDIOUS_COOLDOWN = 60             # Seconds out of rotation after the first trip; doubles on every further trip
+INVIDIOUS_MAX_COOLDOWN = 3600
+
+# One pooled keep-alive HTTP session shared by every outbound request
+HTTP_POOL_HOSTS = 8                 # Hosts kept in the pool
+HTTP_POOL_SIZE = 16                 # Connections kept per host
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+http_session = None
+http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Shared requests session with connection pooling, created on first use"""
+    global http_session
+
+    with http_session_lock:
+        if http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = BROWSER_USER_AGENT
+            http_session = session
+        return http_session
+
+class InstanceHealth:
+    """Latency and circuit-breaker state for one Invidious instance"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.latency = None   # Moving average of successful request times
+        self.failures = 0     # Consecutive failures since the last success
+        self.trips = 0        # Times the circuit opened without a success in between
+        self.open_until = 0   # Out of rotation until this time
+        self.probing = False  # A trial request after a cooldown is in flight
+
+class InvidiousPool:
+    """Ranks Invidious instances by latency and skips dead ones until their cooldown runs out"""
+
+    def __init__(self, instances):
+        self.lock = threading.Lock()
+        self.instances = [InstanceHealth(base_url) for base_url in instances]
+
+    def candidates(self, count):
+        """Up to count live instances, fastest first; one that has cooled down gets a single trial request"""
+        now = time.time()
+        with self.lock:
+            live = [health for health in self.instances
+                    if health.open_until <= now and not (health.trips and health.probing)]
+            # Untried instances go first so each one gets measured
+            live.sort(key=lambda health: health.latency or 0)
+            chosen = live[:count]
+            for health in chosen:
+                if health.trips:
+                    health.probing = True
+            return chosen
+
+    def record(self, health, succeeded, seconds):
+        with self.lock:
+            health.probing = False
+            if succeeded:
+                health.latency = seconds if health.latency is None else 0.7 * health.latency + 0.3 * seconds
+                health.failures = 0
+                health.trips = 0
+                health.open_until = 0
+                return
 
-def download_and_play_video(video_info):
-    """Stream and play a YouTube video"""
-    global player, current_video
+            health.failures += 1
+            # A failed trial after a cooldown reopens the circuit straight away, for twice as long
+            if health.failures >= INVIDIOUS_FAILURE_THRESHOLD or health.trips:
+                health.trips += 1
+                health.failures = 0
+                health.open_until = time.time() + min(INVIDIOUS_MAX_COOLDOWN, INVIDIOUS_COOLDOWN * 2 ** (health.trips - 1))
+                log.warning(f"Invidious instance {health.base_url} taken out of rotation for {health.open_until - time.time():.0f}s")
+
+    def stats(self):
+        now = time.time()
+        with self.lock:
+            return [{
+                'instance': health.base_url,
+                'latency_seconds': round(health.latency, 3) if health.latency is not None else None,
+                'consecutive_failures': health.failures,
+                'available_in_seconds': max(0, round(health.open_until - now)),
+            } for health in self.instances]
+
+invidious_pool = InvidiousPool(INVIDIOUS_INSTANCES)
+
+IMAGE_URL_MARKERS = ['.jpg', '.jpeg', '.png', '.webp', 'storyboard']
+
+# Hedged extraction: start the best strategy, then race the next one if it hasn't answered in time
+EXTRACTION_HEDGE_DELAY = float(os.environ.get('JUNIE_EXTRACTION_HEDGE_DELAY', '2.5'))  # Seconds before starting a second strategy
+EXTRACTION_HEDGE_WIDTH = int(os.environ.get('JUNIE_EXTRACTION_HEDGE_WIDTH', '2'))      # Strategies allowed to run at once per lookup
+EXTRACTION_TIMEOUT = 60             # Give up on a lookup after this many seconds
+STRATEGY_STATS_WINDOW = 50          # Recent attempts per strategy used for ranking
+STRATEGY_DEFAULT_LATENCY = 5.0      # Assumed seconds for an untimed strategy, and the cost of falling back after a failure
+
+strategy_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='strategy')
+
+def is_image_url(url):
+    """Check whether an extracted URL is really a thumbnail or storyboard instead of audio"""
+    return any(marker in url.lower() for marker in IMAGE_URL_MARKERS)
+
+# yt-dlp runs in worker processes, since its deciphering and JSON parsing would otherwise hold our GIL
+EXTRACTION_PROCESSES = int(os.environ.get('JUNIE_EXTRACTION_PROCESSES', '4'))  # 0 runs yt-dlp on threads instead
+EXTRACTION_MAX_WAITING = int(os.environ.get('JUNIE_EXTRACTION_MAX_WAITING', '16'))  # Jobs allowed to wait for a free worker
+
+# yt-dlp option sets by strategy name; the worker processes keep a YoutubeDL for each
+YTDLP_OPTION_SETS = OrderedDict([
+    ('android', YDL_ANDROID_OPTS),
+    ('dash', YDL_DASH_OPTS),
+    ('web', YDL_WEB_OPTS),
+])
+
+class ExtractionBusy(Exception):
+    """The extraction workers are saturated; not held against the strategy that ran into it"""
+
+class ExtractionService:
+    """Pool of worker processes with warm YoutubeDL instances, a bounded wait queue and priority for stream lookups"""
+
+    def __init__(self, processes, max_waiting):
+        self.enabled = processes > 0
+        self.processes = processes
+        self.max_waiting = max_waiting
+        self.condition = threading.Condition()
+        self.pool = None
+        self.running = 0         # Jobs handed to the pool and not finished
+        self.waiting = 0         # Callers waiting for a free worker
+        self.urgent_waiting = 0  # ... of which are stream lookups, which go first
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.worker_prepare = None  # Picklable callable each worker runs before init, e.g. the benchmark's fakes
+
+    def get_pool(self):
+        """Create the process pool on first use (call with condition held)"""
+        if self.pool is None:
+            # The logger can't cross into another process; each worker collects warnings itself
+            option_sets = {name: {key: value for key, value in options.items() if key != 'logger'}
+                           for name, options in YTDLP_OPTION_SETS.items()}
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=self.worker_context(),
+                                            initializer=extraction_worker.init,
+                                            initargs=(option_sets, self.worker_prepare))
+        return self.pool
+
+    @staticmethod
+    def worker_context():
+        """Start workers from a clean process rather than forking this one, whose other threads may hold locks
+        and whose libvlc and SQLite state a child must not share"""
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['extraction_worker'])
+            return context
+        return multiprocessing.get_context('spawn')
+
+    def admit(self, urgent, timeout):
+        """Wait for a free worker and return the pool, or raise ExtractionBusy if the queue is full"""
+        deadline = time.time() + timeout
+        with self.condition:
+            if not urgent and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise ExtractionBusy(f"{self.waiting} extractions are already waiting for a worker")
+
+            self.waiting += 1
+            self.urgent_waiting += urgent
+            try:
+                while self.running >= self.processes or (not urgent and self.urgent_waiting):
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise ExtractionBusy("Timed out waiting for an extraction worker")
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+                self.urgent_waiting -= urgent
+                if urgent:
+                    self.condition.notify_all()
+
+            self.running += 1
+            return self.get_pool()
+
+    def finished(self, future):
+        with self.condition:
+            self.running -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self.condition.notify_all()
+
+    def replace(self, pool):
+        """Drop a pool whose worker died, e.g. to the OOM killer; the next job starts a new one"""
+        with self.condition:
+            if self.pool is pool:
+                log.warning("An extraction worker process died, starting a new pool")
+                self.pool = None
+                self.restarts += 1
+                pool.shutdown(wait=False)
+
+    def extract(self, strategy, video_url, urgent=False):
+        """Run a yt-dlp strategy in a worker process and return its result"""
+        return self.run(extraction_worker.extract, strategy, video_url, urgent=urgent)
+
+    def download(self, options, url):
+        """Download a URL with yt-dlp in a worker process, waiting as long as the download takes"""
+        return self.run(extraction_worker.download, options, url, timeout=None)
+
+    def run(self, function, *args, urgent=False, timeout=EXTRACTION_TIMEOUT):
+        """Run an extraction_worker function in a worker process; returns its result, logging yt-dlp's warnings"""
+        pool = self.admit(urgent, EXTRACTION_TIMEOUT)
+        try:
+            future = pool.submit(function, *args)
+        except (BrokenProcessPool, RuntimeError):
+            with self.condition:
+                self.running -= 1
+                self.condition.notify_all()
+            self.replace(pool)
+            raise
+        future.add_done_callback(self.finished)
 
-    # Streaming options with improved configuration
-    ydl_opts = {
-        # More specific format selection to target audio streams
-        'format': 'bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio[ext=webm]/bestaudio/best',
-        'quiet': False,  # Set to False to see detailed output for debugging
-        'noplaylist': True,
-        'nocheckcertificate': True,
-        'ignoreerrors': False,
-        'logtostderr': False,
-        'default_search': 'auto',
-        'source_address': '0.0.0.0',
-        # Updated user-agent to a more recent browser version
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36',
-        },
-        # Add youtube-dl specific options
-        'youtube_include_dash_manifest': False,  # Skip DASH manifests that might cause issues
-        'extractor_args': {
-            'youtube': {
-                'player_client': ['android'],  # Try android client which might be more reliable
-                'skip': ['hls', 'dash'],  # Skip HLS and DASH formats which might cause issues
+        try:
+            result, warnings = future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self.replace(pool)
+            raise
+        for warning in warnings:
+            ydl_logger.warning(warning)
+        return result
+
+    def warm(self):
+        """Start and initialize every worker now rather than on the first lookups"""
+        if not self.enabled:
+            return
+        with self.condition:
+            pool = self.get_pool()
+        for future in [pool.submit(extraction_worker.ping) for _ in range(self.processes)]:
+            future.result(timeout=EXTRACTION_TIMEOUT)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'processes': self.processes if self.enabled else 0,
+                'running': self.running,
+                'waiting': self.waiting,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'restarts': self.restarts,
             }
+
+extraction_service = ExtractionService(EXTRACTION_PROCESSES, EXTRACTION_MAX_WAITING)
+
+def ytdlp_strategy(name):
+    """Build a strategy that runs yt-dlp with one of YTDLP_OPTION_SETS, in a worker process if there are any"""
+    def run(video_url, purpose):
+        if extraction_service.enabled:
+            # Stream lookups hold up playback, so they jump ahead of queued metadata lookups
+            return extraction_service.extract(name, video_url, urgent=purpose == 'stream')
+
+        with yt_dlp.YoutubeDL(YTDLP_OPTION_SETS[name]) as ydl:
+            return extraction_worker.ytdlp_result(ydl.extract_info(video_url, download=False))
+    return run
+
+def invidious_strategy(video_url, purpose=None):
+    """Look the video up through the fastest live Invidious instance, moving on to the next one if it fails"""
+    video_id = normalize_video_id(video_url)
+    if not video_id:
+        raise Exception("Could not extract video ID from URL")
+
+    errors = []
+    data = None
+    for health in invidious_pool.candidates(INVIDIOUS_ATTEMPTS):
+        api_url = f"{health.base_url}/api/v1/videos/{video_id}"
+        log.debug(f"Trying invidious API: {api_url}")
+        started = time.perf_counter()
+        try:
+            response = get_http_session().get(api_url, timeout=INVIDIOUS_TIMEOUT)
+            if response.status_code != 200:
+                raise Exception(f"status code {response.status_code}")
+            data = response.json()
+        except Exception as e:
+            invidious_pool.record(health, False, time.perf_counter() - started)
+            errors.append(f"{health.base_url}: {e}")
+            continue
+        invidious_pool.record(health, True, time.perf_counter() - started)
+        break
+
+    if data is None:
+        raise Exception(f"Invidious lookup failed ({'; '.join(errors)})" if errors
+                        else "Every Invidious instance is cooling down")
+
+    # Find audio streams, highest bitrate first
+    audio_formats = [{'id': f.get('itag'), 'url': f['url'], 'kbps': round(int(f.get('bitrate') or 0) / 1000),
+                      'ext': f.get('container'), 'codec': f.get('encoding')}
+                     for f in data.get('adaptiveFormats', [])
+                     if f.get('type', '').startswith('audio/') and f.get('url')]
+    audio_formats.sort(key=lambda f: f['kbps'], reverse=True)
+
+    return {
+        'id': video_id,
+        'title': data.get('title', 'Unknown Title (Invidious)'),
+        'thumbnail': data.get('thumbnailUrl', ''),
+        'duration': data.get('lengthSeconds', 0),
+        'stream_url': audio_formats[0]['url'] if audio_formats else None,
+        'format_id': audio_formats[0]['id'] if audio_formats else None,
+        'audio_formats': audio_formats,
+    }
+
+# Registered strategies in their default order; stats below decide the order at runtime
+EXTRACTION_STRATEGIES = OrderedDict([
+    ('android', ytdlp_strategy('android')),
+    ('dash', ytdlp_strategy('dash')),
+    ('web', ytdlp_strategy('web')),
+    ('invidious', invidious_strategy),
+])
+
+# What a result needs for each kind of lookup to count as a success
+EXTRACTION_VALIDATORS = {
+    'metadata': lambda result: bool(result.get('id') and result.get('title')),
+    'stream': lambda result: bool(result.get('stream_url')) and not is_image_url(result['stream_url']),
+}
+
+strategy_stats_lock = threading.Lock()
+strategy_stats = {name: deque(maxlen=STRATEGY_STATS_WINDOW) for name in EXTRACTION_STRATEGIES}  # (succeeded, seconds)
+
+def record_strategy_result(name, succeeded, seconds):
+    """Remember how a strategy did so future lookups can rank it"""
+    with strategy_stats_lock:
+        strategy_stats[name].append((succeeded, seconds))
+
+def strategy_score(name):
+    """Rough expected seconds to a usable result when trying this strategy first (lower is better)"""
+    with strategy_stats_lock:
+        attempts = list(strategy_stats[name])
+
+    # Smoothed success rate so a single lucky or unlucky attempt doesn't decide the order
+    successes = sum(1 for succeeded, _ in attempts if succeeded)
+    success_rate = (successes + 1) / (len(attempts) + 2)
+    latency = sum(seconds for _, seconds in attempts) / len(attempts) if attempts else STRATEGY_DEFAULT_LATENCY
+
+    # Failures also cost a fallback, so a strategy that fails quickly still sinks in the ranking
+    return (latency + STRATEGY_DEFAULT_LATENCY * (1 - success_rate)) / success_rate
+
+def ranked_strategies():
+    """Strategy names, best first; registration order breaks ties"""
+    names = list(EXTRACTION_STRATEGIES)
+    return sorted(names, key=lambda name: (strategy_score(name), names.index(name)))
+
+def run_strategy(name, video_url, purpose, validate, results):
+    """Run one strategy on a worker thread and report (name, result or None, error) to the race"""
+    started = time.time()
+    try:
+        result = EXTRACTION_STRATEGIES[name](video_url, purpose)
+        if not validate(result):
+            raise Exception("Incomplete or unusable result")
+        record_strategy_result(name, True, time.time() - started)
+        EXTRACTION_SECONDS.observe(time.time() - started, strategy=name, purpose=purpose, outcome='success')
+        results.put((name, result, None))
+    except (ExtractionBusy, BrokenProcessPool) as e:
+        # A full or restarting worker pool says nothing about the strategy itself
+        results.put((name, None, e))
+    except Exception as e:
+        record_strategy_result(name, False, time.time() - started)
+        EXTRACTION_SECONDS.observe(time.time() - started, strategy=name, purpose=purpose, outcome='failure')
+        results.put((name, None, e))
+
+def run_extraction(video_url, purpose):
+    """Race the best-ranked strategies for a URL and return the first valid result, or None if all fail"""
+    validate = EXTRACTION_VALIDATORS[purpose]
+    order = ranked_strategies()
+    results = queue.Queue()
+    next_index = 0
+    running = 0
+    lookup_started = time.time()
+    give_up_at = lookup_started + EXTRACTION_TIMEOUT
+    hedge_at = give_up_at
+
+    while True:
+        # Start another strategy if the last one has had its head start, or if nothing is running
+        now = time.time()
+        if next_index < len(order) and running < EXTRACTION_HEDGE_WIDTH and (running == 0 or now >= hedge_at):
+            name = order[next_index]
+            log.debug(f"Starting {purpose} extraction strategy '{name}' for {video_url}")
+            strategy_executor.submit(run_strategy, name, video_url, purpose, validate, results)
+            next_index += 1
+            running += 1
+            hedge_at = now + EXTRACTION_HEDGE_DELAY
+            continue
+
+        if running == 0:
+            log.warning(f"All {purpose} extraction strategies failed for {video_url}")
+            LOOKUP_SECONDS.observe(time.time() - lookup_started, purpose=purpose, outcome='failure')
+            return None
+
+        # Wait for a result, or until it's time to hedge with the next strategy
+        can_hedge = next_index < len(order) and running < EXTRACTION_HEDGE_WIDTH
+        deadline = min(hedge_at, give_up_at) if can_hedge else give_up_at
+        try:
+            name, result, error = results.get(timeout=max(0, deadline - time.time()))
+        except queue.Empty:
+            if time.time() >= give_up_at:
+                log.warning(f"Extraction timed out after {EXTRACTION_TIMEOUT} seconds for {video_url}")
+                LOOKUP_SECONDS.observe(time.time() - lookup_started, purpose=purpose, outcome='timeout')
+                return None
+            continue
+
+        running -= 1
+        if result is not None:
+            log.debug(f"Strategy '{name}' won the {purpose} extraction")
+            LOOKUP_SECONDS.observe(time.time() - lookup_started, purpose=purpose, outcome='success')
+            return result
+        log.info(f"Strategy '{name}' failed: {error}")
+
+def strategy_stats_snapshot():
+    """Per-strategy success rates and latencies for the /stats endpoint"""
+    snapshot = {}
+    for rank, name in enumerate(ranked_strategies()):
+        with strategy_stats_lock:
+            attempts = list(strategy_stats[name])
+        successes = [seconds for succeeded, seconds in attempts if succeeded]
+        snapshot[name] = {
+            'rank': rank + 1,
+            'attempts': len(attempts),
+            'success_rate': round(len(successes) / len(attempts), 3) if attempts else None,
+            'mean_success_seconds': round(sum(successes) / len(successes), 3) if successes else None,
+            'score': round(strategy_score(name), 3),
         }
+    return snapshot
+
+def fetch_video_info(url):
+    """Extract a video's metadata (METADATA_FIELDS) from its URL, or None if every strategy failed"""
+    try:
+        log.debug(f"Extracting info for URL: {url}")
+        result = run_extraction(url, 'metadata')
+    except Exception as e:
+        log.error(f"Error extracting video info: {e}")
+        return None
+
+    if not result:
+        return None
+    return {
+        'id': result['id'],
+        'title': result.get('title') or 'Unknown Title',
+        'thumbnail': result.get('thumbnail') or '',
+        'duration': result.get('duration') or 0,
+        'loudness': None,
     }
 
+class LinkThroughput:
+    """Moving average of the download rate from YouTube, and the bitrate ceiling it allows (with hysteresis)"""
+
+    def __init__(self, max_kbps):
+        self.lock = threading.Lock()
+        self.max_kbps = max_kbps
+        self.estimate_kbps = None
+        self.ceiling_kbps = None  # Highest bitrate currently allowed, None until there is a measurement
+        self.samples = {}         # source -> count
+        self.last_sample = None
+        self.raised = 0
+        self.lowered = 0
+
+    def observe(self, kbps, source, lower_bound=False):
+        """Add a throughput sample; a lower bound (VLC reading only as fast as it plays) can raise the estimate but not lower it"""
+        with self.lock:
+            if lower_bound:
+                # Keeping up with a format proves the link carries it with headroom, nothing more
+                kbps /= AUDIO_THROUGHPUT_HEADROOM
+                if self.estimate_kbps is None or kbps <= self.estimate_kbps:
+                    return
+            if self.estimate_kbps is None:
+                self.estimate_kbps = kbps
+            else:
+                self.estimate_kbps += THROUGHPUT_SMOOTHING * (kbps - self.estimate_kbps)
+            self.samples[source] = self.samples.get(source, 0) + 1
+            self.last_sample = {'time': time.time(), 'source': source, 'kbps': round(kbps)}
+            self.update_ceiling()
+
+    def update_ceiling(self):
+        """Lower the ceiling as soon as throughput drops, raise it only once throughput is clearly higher (call with lock held)"""
+        sustainable = self.estimate_kbps * AUDIO_THROUGHPUT_HEADROOM
+        if self.ceiling_kbps is None:
+            self.ceiling_kbps = sustainable
+        elif sustainable < self.ceiling_kbps:
+            self.ceiling_kbps = sustainable
+            self.lowered += 1
+        elif sustainable > self.ceiling_kbps * AUDIO_UPSWITCH_MARGIN:
+            self.ceiling_kbps = sustainable
+            self.raised += 1
+
+    def has_room(self, kbps):
+        """Whether the measured link leaves room for this much streaming (true until there is a measurement)"""
+        with self.lock:
+            return self.ceiling_kbps is None or self.ceiling_kbps >= kbps
+
+    def ceiling(self):
+        """Highest audio bitrate to pick right now in kbps, or None for no limit"""
+        with self.lock:
+            limits = [limit for limit in (self.ceiling_kbps, self.max_kbps) if limit]
+        return min(limits) if limits else None
+
+    def stats(self):
+        """Throughput estimate and ceiling for the /stats endpoint"""
+        ceiling = self.ceiling()
+        with self.lock:
+            return {
+                'estimate_kbps': round(self.estimate_kbps) if self.estimate_kbps is not None else None,
+                'ceiling_kbps': round(ceiling) if ceiling is not None else None,
+                'max_kbps': self.max_kbps or None,
+                'samples': dict(self.samples),
+                'last_sample': self.last_sample,
+                'ceiling_raised': self.raised,
+                'ceiling_lowered': self.lowered,
+            }
+
+link_throughput = LinkThroughput(AUDIO_MAX_KBPS)
+THROUGHPUT_KBPS = Gauge('junie_throughput_kbps', 'Moving average of the measured download rate from YouTube',
+                        lambda: link_throughput.estimate_kbps or 0)
+
+def choose_audio_format(result):
+    """Pick the stream URL for an extraction result: the strategy's own pick unless it is over the bitrate
+    ceiling, otherwise the best format under it (or the smallest one); returns (url, format details)"""
+    formats = [f for f in result.get('audio_formats') or () if f['kbps'] > 0]
+    picked = next((f for f in formats if f['id'] == result.get('format_id') and f['url'] == result['stream_url']), None)
+    ceiling = link_throughput.ceiling()
+
+    if ceiling is not None and formats and (picked is None or picked['kbps'] > ceiling):
+        fitting = [f for f in formats if f['kbps'] <= ceiling]
+        if fitting:
+            picked = max(fitting, key=lambda f: f['kbps'])
+        else:
+            picked = min(formats, key=lambda f: f['kbps'])
+        log.info(f"Picked {picked['kbps']} kbps audio (format {picked['id']}) for a {ceiling:.0f} kbps ceiling")
+
+    if picked is None:
+        return result['stream_url'], None
+    details = {key: picked[key] for key in ('id', 'ext', 'codec', 'kbps')}
+    details['ceiling_kbps'] = round(ceiling) if ceiling is not None else None
+    return picked['url'], details
+
+def exceeds_ceiling(audio_format):
+    """Whether the ceiling dropped below a stream picked earlier, so a smaller format should be picked instead"""
+    ceiling = link_throughput.ceiling()
+    if audio_format is None or ceiling is None or audio_format['kbps'] <= ceiling:
+        return False
+    return audio_format['ceiling_kbps'] is None or ceiling < audio_format['ceiling_kbps']
+
+def resolve_stream_url(video_url):
+    """Resolve a YouTube URL to (audio stream URL, format details), sharing a resolution already running for the same video"""
+    return stream_flights.run(duplicate_key(video_url), resolve_stream_url_once, video_url)
+
+def resolve_stream_url_once(video_url):
+    """Resolve a YouTube URL to (audio stream URL, format details or None); the URL is None if every method fails"""
+    audio_format = None
     try:
-        # Get the direct streaming URL
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            print(f"Extracting audio from: {video_info['url']}")
+        # Get the direct streaming URL, in a format the connection can keep up with
+        log.debug(f"Extracting audio from: {video_url}")
+        result = run_extraction(video_url, 'stream')
+        url, audio_format = choose_audio_format(result) if result else (None, None)
 
-            # First attempt with standard options
-            try:
-                info = ydl.extract_info(video_info['url'], download=False)
+        if url:
+            log.debug(f"Extracted audio URL: {url}")
+        else:
+            # Try one more approach - direct YouTube embed URL
+            log.warning("Attempting to use YouTube embed URL as a last resort...")
+            video_id = normalize_video_id(video_url)
 
-                # Check if we got actual audio formats or just images
-                if 'formats' in info:
-                    audio_formats = [f for f in info.get('formats', []) 
-                                    if f.get('acodec') != 'none' and f.get('vcodec') == 'none']
+            if video_id:
+                # Try to use the YouTube embed URL which sometimes works when the API fails
+                embed_url = f"https://www.youtube.com/embed/{video_id}?autoplay=1&controls=0"
+                log.info(f"Using YouTube embed URL: {embed_url}")
 
-                    if not audio_formats and 'url' in info:
-                        # If no specific audio formats but we have a direct URL, check if it's not an image
-                        if any(img_ext in info['url'] for img_ext in ['.jpg', '.jpeg', '.png', '.webp']):
-                            print("Warning: URL appears to be an image, not an audio stream")
-                            raise Exception("No valid audio stream found, only images")
+                # This is a workaround - VLC might be able to extract the audio from the embed page
+                url = embed_url
+            else:
+                log.warning("Could not extract video ID from URL")
+                return None, None
 
-                # Make sure we have a valid URL
-                if 'url' not in info:
-                    print("Error: No URL found in extracted info")
-                    raise Exception("No URL found in extracted info")
+        # Only web URLs can be probed; anything else goes straight to VLC
+        if not url.startswith(('http://', 'https://')):
+            return url, audio_format
 
-                url = info['url']
+        # Check if URL is accessible, over a pooled keep-alive connection
+        try:
+            log.debug(f"Validating URL accessibility: {url}")
+            started = time.perf_counter()
+            response = get_http_session().get(
+                url,
+                # The first bytes show the URL works, and how long they take shows the throughput
+                headers={'Range': f'bytes=0-{THROUGHPUT_PROBE_BYTES - 1}'},
+                timeout=5,
+                stream=True
+            )
+            try:
+                if response.status_code >= 400:
+                    log.warning(f"HTTP Error validating URL: {response.status_code} - {response.reason}")
+                    if response.status_code == 404:
+                        log.warning("URL returns 404 Not Found, cannot play this stream")
+                        return None, None
+                    # For other HTTP errors, we'll still try to play
+                    log.info("Continuing despite HTTP error...")
+                else:
+                    content_type = response.headers.get('Content-Type', '')
+                    log.debug(f"URL validation successful. Content-Type: {content_type}")
+
+                    # Check if content type is audio or video
+                    if not any(media_type in content_type.lower() for media_type in ['audio', 'video', 'mp4', 'mp3', 'ogg', 'webm']):
+                        log.warning(f"Content-Type does not appear to be audio/video: {content_type}")
+                        # Continue anyway as VLC might still be able to handle it
+
+                # Reading a short body hands the connection back to the pool; a server that
+                # ignored the Range header would send the whole file, so that one is dropped
+                if response.status_code == 206 or int(response.headers.get('Content-Length') or 1 << 20) <= THROUGHPUT_PROBE_BYTES:
+                    received = len(response.content)
+                    if response.status_code == 206 and received >= THROUGHPUT_PROBE_MIN_BYTES:
+                        link_throughput.observe(received * 8 / 1000 / (time.perf_counter() - started), 'probe')
+            finally:
+                response.close()
 
-                # Check if URL is an image (storyboard)
-                if any(img_ext in url for img_ext in ['.jpg', '.jpeg', '.png', '.webp']):
-                    print(f"Warning: Extracted URL appears to be an image: {url}")
-                    raise Exception("Extracted URL is an image, not an audio stream")
+        except Exception as e:
+            log.warning(f"Error validating URL: {e}")
+            log.info("Continuing anyway...")
 
-                print(f"Extracted audio URL: {url}")
+        return url, audio_format
 
-            except Exception as e:
-                print(f"First extraction attempt failed: {e}")
-                print("Trying alternative extraction method...")
+    except Exception as e:
+        log.error(f"Error resolving stream URL: {e}")
+        return None, None
+
+def playable_url(track, count=True):
+    """Cached audio file for a track if there is one, otherwise its pre-resolved stream URL if still fresh (call with queue_lock held)"""
+    cached_path = audio_cache.lookup(track_video_id(track), count)
+    if cached_path:
+        return cached_path
+    return track.stream_url if stream_url_is_fresh(track) else None
+
+def stream_url_expiry(url, resolved_at):
+    """When a stream URL stops working: its expire parameter if it has one, otherwise STREAM_URL_MAX_AGE after resolving"""
+    match = STREAM_EXPIRE_PATTERN.search(url or '')
+    if match:
+        return int(match.group(1))
+    return resolved_at + STREAM_URL_MAX_AGE
+
+def attach_stream_url(track, url, audio_format=None):
+    """Record a freshly resolved stream URL, its format and when it expires on a track (call with queue_lock held)"""
+    now = time.time()
+    track.stream_url = url
+    track.audio_format = audio_format
+    track.stream_resolved_at = now
+    track.stream_expires_at = stream_url_expiry(url, now) if url else now
+
+def stream_url_is_fresh(track):
+    """Check whether a track carries a stream URL that won't expire before it's needed"""
+    if not track.stream_url or exceeds_ceiling(track.audio_format):
+        return False
+    return time.time() < track.stream_expires_at - STREAM_URL_REFRESH_MARGIN
+
+def preresolve_video(track):
+    """Resolve the stream URL for a queued track and attach it to the track"""
+    try:
+        log.debug(f"Pre-resolving stream for: {track.title}")
+        url, audio_format = resolve_stream_url(track.url)
+        with queue_changed:
+            attach_stream_url(track, url, audio_format)
+            # The player may be waiting on this URL to pre-roll the next track
+            queue_changed.notify_all()
+        loudness_analyzer.schedule(track_video_id(track), url, audio_format and audio_format['kbps'], track.loudness)
+    finally:
+        with queue_lock:
+            resolving_videos.discard(id(track))
 
-                # Second attempt with different options
-                alt_opts = ydl_opts.copy()
-                alt_opts['format'] = 'bestaudio/best'  # Simpler format selection
-                alt_opts['youtube_include_dash_manifest'] = True  # Try including DASH
+def schedule_preresolve():
+    """Wake the resolver thread so it looks at the head of the queue again"""
+    resolver_wakeup.set()
 
-                try:
-                    with yt_dlp.YoutubeDL(alt_opts) as alt_ydl:
-                        info = alt_ydl.extract_info(video_info['url'], download=False)
+def resolver_thread_function():
+    """Thread function to keep stream URLs ready for the next few queued videos"""
+    while player_thread_running:
+        # Wake on queue changes, and periodically to refresh URLs before they expire
+        resolver_wakeup.wait(timeout=RESOLVER_RECHECK_INTERVAL)
+        resolver_wakeup.clear()
 
-                        # Make sure we have a valid URL
-                        if 'url' not in info:
-                            print("Error: No URL found in second extraction attempt")
-                            raise Exception("No URL found in second extraction attempt")
+        with queue_lock:
+            upcoming = video_queue.head(PRERESOLVE_AHEAD)
+            pending = [v for v in upcoming
+                       if not stream_url_is_fresh(v) and id(v) not in resolving_videos
+                       and not audio_cache.contains(track_video_id(v))]
+            for video_info in pending:
+                resolving_videos.add(id(video_info))
+
+            # Measure loudness from whatever is already playable: a cached file or a fresh URL
+            measurable = [(track_video_id(v), playable_url(v, count=False), v.audio_format and v.audio_format['kbps'],
+                           v.loudness) for v in upcoming if not v.loudness or v.loudness.get('sampled')]
+
+            # Playlist entries only get their full lookup once they come near the front
+            lazy = []
+            for video_info in video_queue.head(PLAYLIST_RESOLVE_DISTANCE):
+                if video_info.status == 'lazy' and metadata_slots.acquire(blocking=False):
+                    video_info.status = 'pending'
+                    lazy.append(video_info)
+            if lazy:
+                mark_queue_changed()
+
+        for video_info in lazy:
+            metadata_executor.submit(resolve_metadata, video_info, True)
+
+        # Start filling the audio cache for what's coming up
+        for video_info in upcoming:
+            audio_cache.schedule(video_info)
+
+        for video_id, source, kbps, known in measurable:
+            loudness_analyzer.schedule(video_id, source, kbps, known)
+
+        for video_info in pending:
+            resolver_executor.submit(preresolve_video, video_info)
+
+def mark_track_due(source):
+    """Start the time-to-first-audio clock for the track about to play (call with queue_lock held)"""
+    global track_due
+
+    track_due = (time.time(), source)
+
+def on_vlc_time_changed(event):
+    """VLC TimeChanged callback: remember the position so a failed stream can resume from it"""
+    global playback_position
+
+    # Fires several times a second, so no lock; a stale read only costs a fraction of a second
+    playback_position = event.u.new_time
+
+def on_vlc_event(event, name):
+    """VLC event callback: record what happened and wake the player thread (never call libvlc from here)"""
+    global playback_event, playback_position, track_due, track_ended_at
+
+    with queue_changed:
+        now = time.time()
+        if name == 'ended':
+            playback_position = 0
+            # Time the silence until the next track, if one is waiting
+            track_ended_at = now if video_queue else None
+            if preloaded_video is not None:
+                mark_track_due('preroll')
+        elif name == 'playing':
+            if track_ended_at is not None:
+                TRACK_GAP_SECONDS.observe(now - track_ended_at)
+                track_ended_at = None
+            if track_due is not None:
+                due_at, source = track_due
+                TIME_TO_FIRST_AUDIO_SECONDS.observe(now - due_at, source=source)
+                TRACKS_PLAYED.inc(source=source)
+                track_due = None
+
+        # A pre-rolled track can report Playing before the player thread has taken the end of the
+        # previous one; that end must not be lost, and the rolled-in track needs no start event
+        if not (name == 'playing' and playback_event in ('ended', 'error')):
+            playback_event = name
+        queue_changed.notify_all()
+
+def take_track_outcome():
+    """Consume a pending skip or end-of-track event (call with queue_lock held)"""
+    global playback_event, skip_requested
+
+    if skip_requested:
+        skip_requested = False
+        return 'skip'
+    if playback_event in ('ended', 'error'):
+        outcome, playback_event = playback_event, None
+        return outcome
+    return None
+
+def wait_for_playback_start(timeout=None):
+    """Wait for VLC to report that playback started; returns 'playing', 'ended', 'error', 'skip' or None on timeout"""
+    deadline = time.time() + (timeout or PLAYBACK_START_TIMEOUT)
+    with queue_changed:
+        while True:
+            outcome = take_track_outcome()
+            if outcome:
+                return outcome
+            if playback_event == 'playing':
+                return 'playing'
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            queue_changed.wait(remaining)
+
+def select_audio_device(instance, media_player):
+    """Route audio to the headphones/analog output if there is one; done once per process"""
+    try:
+        # Get list of audio output devices
+        audio_output = instance.audio_output_enumerate_devices()
+        if audio_output:
+            log.debug("Available audio output devices:")
+            for device in audio_output:
+                try:
+                    log.debug(f"  - {device.description} ({device.device})")
+                except:
+                    log.debug("  - Device info unavailable")
 
-                        url = info['url']
-                        print(f"Extracted audio URL (second attempt): {url}")
+            # First try to find and use the headphones/analog output
+            headphones_device = None
+            for device in audio_output:
+                try:
+                    desc = str(device.description).lower()
+                    if "analog" in desc or "headphones" in desc or "3.5" in desc or "bcm2835" in desc:
+                        headphones_device = device
+                        log.debug(f"Found headphones/analog device: {device.device}")
+                        break
+                except:
+                    continue
+
+            # If headphones device found, use it
+            if headphones_device:
+                try:
+                    log.info(f"Setting audio output to: {headphones_device.device}")
+                    media_player.audio_output_device_set(None, headphones_device.device)
+                    return headphones_device.device
                 except Exception as e:
-                    print(f"Second extraction attempt failed: {e}")
-                    print("Trying third extraction method...")
-
-                    # Third attempt with completely different approach
-                    third_opts = {
-                        'format': 'bestaudio',
-                        'quiet': False,
-                        'no_warnings': False,
-                        'nocheckcertificate': True,
-                        'ignoreerrors': False,
-                        'logtostderr': False,
-                        'geo_bypass': True,  # Try to bypass geo-restrictions
-                        'geo_bypass_country': 'US',  # Pretend to be in the US
-                        'http_headers': {
-                            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0',
-                            'Accept-Language': 'en-US,en;q=0.5',
-                            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                        },
-                        'extractor_args': {
-                            'youtube': {
-                                'player_client': ['web'],  # Try web client instead
-                                'skip': [],  # Don't skip any formats
-                            }
-                        }
-                    }
-
-                    with yt_dlp.YoutubeDL(third_opts) as third_ydl:
-                        info = third_ydl.extract_info(video_info['url'], download=False)
-
-                        # Make sure we have a valid URL
-                        if 'url' not in info:
-                            print("Error: No URL found in third extraction attempt")
-                            print("Trying fourth extraction method with invidious API...")
-
-                            # Fourth attempt using invidious API as a fallback
-                            try:
-                                import requests
-                                import json
-                                import random
-
-                                # List of public invidious instances
-                                invidious_instances = [
-                                    "https://invidious.snopyta.org",
-                                    "https://yewtu.be",
-                                    "https://invidious.kavin.rocks",
-                                    "https://vid.puffyan.us",
-                                    "https://invidious.namazso.eu"
-                                ]
-
-                                # Select a random instance
-                                instance = random.choice(invidious_instances)
-                                video_id = video_info['url'].split('v=')[1].split('&')[0]
-                                api_url = f"{instance}/api/v1/videos/{video_id}"
-
-                                print(f"Trying invidious API: {api_url}")
-
-                                response = requests.get(api_url, timeout=10)
-                                if response.status_code == 200:
-                                    data = response.json()
-
-                                    # Find audio streams
-                                    audio_formats = [f for f in data.get('adaptiveFormats', []) 
-                                                    if f.get('type', '').startswith('audio/')]
-
-                                    if audio_formats:
-                                        # Sort by bitrate (highest first)
-                                        audio_formats.sort(key=lambda x: x.get('bitrate', 0), reverse=True)
-                                        url = audio_formats[0]['url']
-                                        print(f"Extracted audio URL (invidious API): {url}")
-                                        return url
-                                    else:
-                                        print("No audio formats found in invidious API response")
-                            except Exception as e:
-                                print(f"Invidious API extraction failed: {e}")
-
-                            # If we get here, all extraction methods have failed
-                            print("All extraction methods failed, cannot play this video")
-                            return
-
-                        url = info['url']
-                        print(f"Extracted audio URL (third attempt): {url}")
-
-        # Final validation check for the URL
-        if not url:
-            print("Error: No URL extracted after all attempts")
+                    log.warning(f"Error setting headphones device: {e}")
+            else:
+                log.info("No headphones/analog device found, using default")
+    except Exception as e:
+        log.warning(f"Error enumerating audio output devices: {e}")
+        log.info("Falling back to default audio device")
+
+    return None
+
+def get_vlc_player():
+    """Create the process-wide VLC instance and media list player on first use (call with player_lock held)"""
+    global vlc_instance, list_player, player, audio_device
+
+    if vlc_instance is None:
+        log.info("Creating VLC instance...")
+        vlc_instance = vlc.Instance(' '.join(VLC_ARGS))
+        install_vlc_logging(vlc_instance)
+        player = vlc_instance.media_player_new()
+
+        # Set audio output volume to maximum
+        player.audio_set_volume(100)
+        audio_device = select_audio_device(vlc_instance, player)
+
+        # The list player drives our media player so queued tracks follow on without a gap
+        list_player = vlc_instance.media_list_player_new()
+        list_player.set_media_player(player)
+
+        # Playback is driven by these events rather than by polling the player state
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerPlaying, on_vlc_event, 'playing')
+        events.event_attach(vlc.EventType.MediaPlayerEndReached, on_vlc_event, 'ended')
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError, on_vlc_event, 'error')
+        events.event_attach(vlc.EventType.MediaPlayerTimeChanged, on_vlc_time_changed)
+
+    return player
+
+def create_media(url, gain_db=0.0):
+    """Create VLC media for a stream URL with our streaming options and the track's loudness gain"""
+    media = vlc_instance.media_new(url)
+
+    # Add media options for better streaming
+    media.add_option(':network-caching=3000')  # Increase network buffer
+    media.add_option(':file-caching=3000')     # Increase file buffer
+    media.add_option(':sout-mux-caching=3000') # Increase mux buffer
+    media.add_option(':no-video')              # Disable video
+
+    # A fixed gain costs next to nothing; the compressor runs for the whole track, so it's opt-in
+    filters = []
+    if gain_db:
+        filters.append('gain')
+        media.add_option(f':gain-value={10 ** (gain_db / 20):.3f}')
+    if AUDIO_COMPRESSOR:
+        filters.append('compressor')
+    if filters:
+        media.add_option(':audio-filter=' + ':'.join(filters))
+    return media
+
+def preload_next_video():
+    """Append the next queued video to the media list so VLC rolls straight into it when the current one ends"""
+    global preloaded_video
+
+    with queue_lock:
+        next_video = video_queue.first()
+        url = playable_url(next_video, count=False) if next_video else None
+
+    if not url:
+        return
+
+    with player_lock:
+        if preloaded_video is next_video or media_list is None:
             return
 
-        # Check if URL is an image or storyboard
-        if any(img_ext in url.lower() for img_ext in ['.jpg', '.jpeg', '.png', '.webp', 'storyboard']):
-            print(f"Error: Invalid audio URL detected: {url}")
-            print("URL appears to be an image or storyboard, not an audio stream")
+        log.info(f"Pre-rolling next track: {next_video.title}")
+        media_list.lock()
+        try:
+            media_list.add_media(create_media(url, track_gain_db(next_video)))
+        finally:
+            media_list.unlock()
+        preloaded_video = next_video
+        audio_cache.record_lookup(hit=not url.startswith('http'))
+
+def withdraw_preroll():
+    """Take the pre-rolled track back off the media list once it is no longer next in the queue"""
+    global preloaded_video
 
-            # Try one more approach - direct YouTube embed URL
-            try:
-                print("Attempting to use YouTube embed URL as a last resort...")
-                video_id = None
-
-                # Extract video ID from the original URL
-                if "youtube.com/watch?v=" in video_info['url']:
-                    video_id = video_info['url'].split("v=")[1].split("&")[0]
-                elif "youtu.be/" in video_info['url']:
-                    video_id = video_info['url'].split("youtu.be/")[1].split("?")[0]
-
-                if video_id:
-                    # Try to use the YouTube embed URL which sometimes works when the API fails
-                    embed_url = f"https://www.youtube.com/embed/{video_id}?autoplay=1&controls=0"
-                    print(f"Using YouTube embed URL: {embed_url}")
-
-                    # This is a workaround - VLC might be able to extract the audio from the embed page
-                    url = embed_url
-                else:
-                    print("Could not extract video ID from URL")
-                    return
-            except Exception as e:
-                print(f"Error creating embed URL: {e}")
+    with player_lock:
+        if preloaded_video is None or media_list is None:
+            return
+        with queue_lock:
+            if video_queue.first() is preloaded_video:
                 return
 
-        # Check if URL is accessible
+        log.info("Queue changed under the pre-rolled track, withdrawing it")
+        media_list.lock()
         try:
-            import urllib.request
-            import urllib.error
-
-            print(f"Validating URL accessibility: {url}")
-            req = urllib.request.Request(
-                url, 
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                    'Range': 'bytes=0-1000'  # Just request the first 1000 bytes to check accessibility
+            media_list.remove_index(media_list.count() - 1)
+        finally:
+            media_list.unlock()
+        preloaded_video = None
+
+def media_input_stats():
+    """VLC's input counters for the playing media as (bytes read, audio buffers lost), or None if unavailable"""
+    media = player.get_media()
+    if media is None:
+        return None
+    try:
+        stats = vlc.MediaStats()
+        if not media.get_stats(stats):
+            return None
+        return stats.read_bytes, stats.lost_abuffers
+    except AttributeError:
+        return None  # libvlc 4 dropped media statistics; the position alone still catches stalls
+    finally:
+        media.release()
+
+class StallWatchdog:
+    """Notices when the playing track stops moving, from its position and VLC's input statistics,
+    and measures the download rate while it plays"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stalls = {}  # signal -> count
+        self.last_stall = None
+        self.recoveries = {}  # cause -> {'resumed': n, 'failed': n, 'seconds': [total, max]}
+        self.track = None
+        self.reset()
+
+    def reset(self, track=None):
+        """Start watching a newly started (or resumed) stream"""
+        now = time.monotonic()
+        self.checked_at = now
+        self.position = None
+        self.progress_at = now  # Position last moved
+        self.input = None
+        self.input_at = now     # Bytes last arrived (or audio buffers last got through)
+        self.window = None      # (time, bytes read) at the start of the current throughput sample
+        if track is not self.track:
+            self.track = track
+            self.track_transfer = [0, 0.0]  # Bytes and seconds measured for this track, across resumes
+
+    def check(self):
+        """Sample the player (call from the player thread, without queue_lock); returns the stall signal or None"""
+        now = time.monotonic()
+        if now - self.checked_at < STALL_CHECK_INTERVAL:
+            return None
+        self.checked_at = now
+        if player.get_state() not in (vlc.State.Playing, vlc.State.Buffering):
+            self.progress_at = self.input_at = now
+            self.window = None
+            return None
+
+        if playback_position != self.position:
+            self.position = playback_position
+            self.progress_at = now
+        counters = media_input_stats()
+        if counters is not None:
+            read_bytes, lost_buffers = counters
+            # Input counts as flowing only while bytes arrive without audio buffers being dropped
+            if self.input is not None and read_bytes > self.input[0] and lost_buffers == self.input[1]:
+                self.input_at = now
+            self.input = counters
+            self.measure_throughput(now, read_bytes)
+        else:
+            self.input_at = self.progress_at
+
+        stuck = now - self.progress_at
+        if stuck >= STALL_BUFFERING_SECONDS:
+            signal = 'buffering'  # Data trickles in, but never enough to play on
+        elif stuck >= STALL_SECONDS and now - self.input_at >= STALL_SECONDS:
+            signal = 'no_input' if counters is not None else 'position'
+        else:
+            return None
+
+        with self.lock:
+            self.stalls[signal] = self.stalls.get(signal, 0) + 1
+            self.last_stall = {'time': time.time(), 'signal': signal, 'position_seconds': round((self.position or 0) / 1000, 1),
+                               'stuck_seconds': round(stuck, 1)}
+        PLAYBACK_STALLS.inc(signal=signal)
+        log.warning(f"Playback stalled ({signal}): no progress for {stuck:.1f}s at {(self.position or 0) / 1000:.1f}s")
+        return signal
+
+    def measure_throughput(self, now, read_bytes):
+        """Turn every THROUGHPUT_WINDOW of VLC's byte counter into a throughput sample for format selection"""
+        audio_format = self.track.audio_format if self.track is not None else None
+        if audio_format is None:
+            return  # Cached files and unknown formats say nothing about the connection
+        if self.window is None or read_bytes < self.window[1]:
+            self.window = (now, read_bytes)
+            return
+        started, start_bytes = self.window
+        if now - started < THROUGHPUT_WINDOW:
+            return
+        self.window = (now, read_bytes)
+
+        received = read_bytes - start_bytes
+        kbps = received * 8 / 1000 / (now - started)
+        # Once its cache is full VLC reads only as fast as it plays, so a rate near the
+        # track's own bitrate shows the connection keeps up, not how fast it could go
+        paced = kbps >= audio_format['kbps'] * THROUGHPUT_PACED_RATIO
+        link_throughput.observe(max(kbps, audio_format['kbps']) if paced else kbps, 'playback', lower_bound=paced)
+        self.track_transfer[0] += received
+        self.track_transfer[1] += now - started
+        with queue_lock:
+            self.track.throughput_kbps = round(self.track_transfer[0] * 8 / 1000 / self.track_transfer[1])
+
+    def recovery_finished(self, cause, resumed, seconds):
+        """Record how an attempt to resume after an error or stall went"""
+        STREAM_RESUMES.inc(cause=cause, outcome='resumed' if resumed else 'failed')
+        with self.lock:
+            counts = self.recoveries.setdefault(cause, {'resumed': 0, 'failed': 0, 'seconds': [0.0, 0.0]})
+            if not resumed:
+                counts['failed'] += 1
+                return
+            counts['resumed'] += 1
+            counts['seconds'][0] += seconds
+            counts['seconds'][1] = max(counts['seconds'][1], seconds)
+        STREAM_RECOVERY_SECONDS.observe(seconds, cause=cause)
+
+    def stats(self):
+        """Stall and recovery counters for the /stats endpoint"""
+        with self.lock:
+            recoveries = {}
+            for cause, counts in self.recoveries.items():
+                total, longest = counts['seconds']
+                recoveries[cause] = {
+                    'resumed': counts['resumed'],
+                    'failed': counts['failed'],
+                    'mean_seconds': round(total / counts['resumed'], 3) if counts['resumed'] else None,
+                    'max_seconds': round(longest, 3),
                 }
-            )
-            response = urllib.request.urlopen(req, timeout=5)
-            content_type = response.headers.get('Content-Type', '')
+            return {
+                'stall_seconds': STALL_SECONDS,
+                'buffering_stall_seconds': STALL_BUFFERING_SECONDS,
+                'stalls': dict(self.stalls),
+                'last_stall': self.last_stall,
+                'recoveries': recoveries,
+            }
 
-            print(f"URL validation successful. Content-Type: {content_type}")
+stall_watchdog = StallWatchdog()
 
-            # Check if content type is audio or video
-            if not any(media_type in content_type.lower() for media_type in ['audio', 'video', 'mp4', 'mp3', 'ogg', 'webm']):
-                print(f"Warning: Content-Type does not appear to be audio/video: {content_type}")
-                # Continue anyway as VLC might still be able to handle it
+def resume_stream(video_info, cause):
+    """Re-resolve the current track after a stream error or stall and carry on where it stopped; returns the start outcome"""
+    global media_list, preloaded_video, playback_event
 
-        except urllib.error.HTTPError as e:
-            print(f"HTTP Error validating URL: {e.code} - {e.reason}")
-            if e.code == 404:
-                print("URL returns 404 Not Found, cannot play this stream")
-                return
-            # For other HTTP errors, we'll still try to play
-            print("Continuing despite HTTP error...")
-        except Exception as e:
-            print(f"Error validating URL: {e}")
-            print("Continuing anyway...")
+    position = playback_position
+    log.warning(f"Stream {'failed' if cause == 'error' else 'stalled'} {position / 1000:.1f}s into the track, "
+                f"re-resolving and resuming")
 
-        # Play the audio directly from the URL
+    # The old URL may simply have expired, so don't reuse it
+    url, audio_format = resolve_stream_url(video_info.url)
+    if not url:
+        return None
+    with queue_lock:
+        attach_stream_url(video_info, url, audio_format)
+
+    with player_lock:
+        # A fresh list drops anything pre-rolled behind the failed stream; it gets pre-rolled again
+        media_list = vlc_instance.media_list_new()
+        media_list.add_media(create_media(url, track_gain_db(video_info)))
+        list_player.set_media_list(media_list)
+        preloaded_video = None
+        with queue_lock:
+            playback_event = None
+        list_player.play()
+
+    outcome = wait_for_playback_start()
+    if outcome == 'playing' and position > 0:
         with player_lock:
-            if player:
-                player.stop()
-                player.release()
-                player = None
-
-            # Create a new VLC instance with verbose logging and audio output configuration
-            vlc_args = [
-                '--verbose=3',                # More verbose logging for debugging
-                '--aout=alsa',                # Use ALSA audio output
-                '--alsa-audio-device=default', # Use default ALSA device (3.5mm jack if configured)
-                '--audio-filter=compressor',  # Add audio compression to normalize volume
-                '--file-caching=3000',        # Increase file cache
-                '--network-caching=3000',     # Increase network cache
-                '--sout-mux-caching=3000',    # Increase mux cache
-                '--no-video',                 # Disable video output since we only need audio
-                '--audio-replay-gain-mode=track' # Apply replay gain
-            ]
-            instance = vlc.Instance(' '.join(vlc_args))
-            player = instance.media_player_new()
-
-            # Set audio output volume to maximum
-            player.audio_set_volume(100)
-
-            # Try to set audio output device explicitly
-            try:
-                # Get list of audio output devices
-                audio_output = instance.audio_output_enumerate_devices()
-                if audio_output:
-                    print("Available audio output devices:")
-                    for device in audio_output:
-                        try:
-                            print(f"  - {device.description} ({device.device})")
-                        except:
-                            print(f"  - Device info unavailable")
-
-                    # First try to find and use the headphones/analog output
-                    headphones_device = None
-                    for device in audio_output:
-                        try:
-                            desc = str(device.description).lower()
-                            if "analog" in desc or "headphones" in desc or "3.5" in desc or "bcm2835" in desc:
-                                headphones_device = device
-                                print(f"Found headphones/analog device: {device.device}")
-                                break
-                        except:
-                            continue
-
-                    # If headphones device found, use it
-                    if headphones_device:
-                        try:
-                            print(f"Setting audio output to: {headphones_device.device}")
-                            player.audio_output_device_set(None, headphones_device.device)
-                        except Exception as e:
-                            print(f"Error setting headphones device: {e}")
-                    else:
-                        print("No headphones/analog device found, using default")
-            except Exception as e:
-                print(f"Error enumerating audio output devices: {e}")
-                print("Falling back to default audio device")
-
-            # Create media with proper options
-            media = instance.media_new(url)
-
-            # Add media options for better streaming
-            media.add_option(':network-caching=3000')  # Increase network buffer
-            media.add_option(':file-caching=3000')     # Increase file buffer
-            media.add_option(':sout-mux-caching=3000') # Increase mux buffer
-            media.add_option(':no-video')              # Disable video
-            media.add_option(':audio-filter=compressor') # Add audio compression
-
-            # Set up event manager to monitor playback
-            events = player.event_manager()
-
-            # Set media to player and start playback
-            player.set_media(media)
-            print("Starting playback...")
-            result = player.play()
-            print(f"Play command result: {result}")
-
-            # Wait for the player to start and check if it's actually playing
-            time.sleep(3)
-            state = player.get_state()
-            print(f"Player state after 3 seconds: {state}")
-
-            if state == vlc.State.Error:
-                print("VLC player reported an error state")
+            player.set_time(position)
+    return outcome
+
+def seconds_until_preroll():
+    """How long until the next track should be pre-rolled, or 0 if we're already inside that window"""
+    length = player.get_length()
+    position = player.get_time()
+    if length <= 0 or position < 0:
+        return 0
+    return max(0, (length - position) / 1000 - PREROLL_SECONDS)
+
+def download_and_play_video(video_info):
+    """Stream and play a YouTube video, returning once VLC reports the track finished or it is skipped"""
+    global current_video, media_list, preloaded_video, rolled_video, playback_event, playback_position, skip_requested, track_due
+
+    handed_off = False
+    outcome = None
+
+    try:
+        # If this video was pre-rolled behind the previous one, VLC has already moved on to it
+        with player_lock:
+            rolled_in = rolled_video is video_info
+            rolled_video = None
+            if not rolled_in and preloaded_video is not None:
+                # The queue changed under the pre-roll, so it no longer matches what's next
+                preloaded_video = None
+
+        if rolled_in:
+            log.info("Continuing with pre-rolled track")
+        else:
+            due_at = time.time()
+
+            # Play from the audio cache, or use the pre-resolved stream URL if the resolver got to it in time
+            with queue_lock:
+                url = playable_url(video_info)
+                if url and url != video_info.stream_url:
+                    video_info.audio_format = None  # Playing a cached file, not a stream
+
+            if url:
+                log.debug(f"Using ready audio source: {url}")
+                source = 'preresolved' if url.startswith('http') else 'audio_cache'
+            else:
+                url, audio_format = resolve_stream_url(video_info.url)
+                source = 'resolved'
+                if not url:
+                    log.error("All extraction methods failed, cannot play this video")
+                    PLAYBACK_FAILURES.inc(cause='resolve')
+                    return
+                with queue_lock:
+                    video_info.audio_format = audio_format
+
+            # Play the audio directly from the URL on the shared player
+            with player_lock:
+                get_vlc_player()
+                media_list = vlc_instance.media_list_new()
+                media_list.add_media(create_media(url, track_gain_db(video_info)))
+                list_player.set_media_list(media_list)
+
+                with queue_lock:
+                    playback_event = None
+                    playback_position = 0
+                    track_due = (due_at, source)
+
+                log.debug("Starting playback...")
+                list_player.play()
+
+            # Wait for VLC to report that it's actually playing
+            outcome = wait_for_playback_start()
+            log.debug(f"Playback start: {outcome}")
+
+            if outcome == 'error':
+                log.warning("VLC player reported an error state")
+                PLAYBACK_FAILURES.inc(cause='vlc_error')
                 return
 
-            if state != vlc.State.Playing:
-                print(f"VLC player is not in playing state, current state: {state}")
+            if outcome == 'skip':
+                log.info("Skipped before playback started")
+                with player_lock:
+                    list_player.stop()
+                return
+
+            if outcome != 'playing':
+                log.warning("VLC player did not start playing, retrying")
                 # Try to play again
-                player.stop()
-                player.play()
-                time.sleep(2)
-                state = player.get_state()
-                print(f"Player state after retry: {state}")
-
-                if state != vlc.State.Playing:
-                    print("Failed to start playback after retry")
+                with player_lock:
+                    list_player.stop()
+                    with queue_lock:
+                        playback_event = None
+                    list_player.play()
+                outcome = wait_for_playback_start()
+                log.info(f"Playback start after retry: {outcome}")
+
+                if outcome != 'playing':
+                    log.error("Failed to start playback after retry")
+                    PLAYBACK_FAILURES.inc(cause='vlc_error' if outcome == 'error' else 'start_timeout')
+                    with player_lock:
+                        list_player.stop()
                     return
 
-            # Get the duration and wait for it to finish
-            duration = player.get_length() / 1000  # Convert to seconds
-            print(f"Media duration from VLC: {duration} seconds")
-
-            # If duration is not available, use the one from video_info
-            if duration <= 0 and video_info.get('duration'):
-                duration = video_info['duration']
-                print(f"Using duration from video info: {duration} seconds")
-
-            if duration <= 0:
-                print("Warning: Could not determine media duration, using default")
-                duration = 300  # Default to 5 minutes if we can't determine duration
-
-            # Wait for the video to finish, checking periodically if it's still playing
-            elapsed = 0
-            check_interval = 5  # Check every 5 seconds
-            while elapsed < duration:
-                time.sleep(check_interval)
-                elapsed += check_interval
-
-                state = player.get_state()
-                if state != vlc.State.Playing:
-                    print(f"Player is no longer playing, state: {state}")
-                    break
-
-                print(f"Still playing... {elapsed}/{duration} seconds elapsed")
+        play_history.record(video_info)
+
+        # Sleep until VLC tells us the track ended, errored or was skipped. Besides those
+        # events we only wake for queue changes (to pre-roll the next track) and, every
+        # STALL_CHECK_INTERVAL, to let the stall watchdog and a sanity check look at the player.
+        resumes = 0
+        stall_watchdog.reset(video_info)
+        while True:
+            timeout = seconds_until_preroll() or None
+            with queue_changed:
+                outcome = take_track_outcome()
+                if outcome is None:
+                    queue_changed.wait(min(timeout or STALL_CHECK_INTERVAL, STALL_CHECK_INTERVAL))
+                    outcome = take_track_outcome()
+
+            if outcome is None and player.get_state() in (vlc.State.Ended, vlc.State.Stopped, vlc.State.Error):
+                log.warning(f"Player stopped without an event, state: {player.get_state()}")
+                outcome = 'ended'
+
+            if outcome is None and stall_watchdog.check():
+                outcome = 'stall'
+
+            # A stream that dies or stalls part way through (e.g. an expired URL answering 403) gets a new URL
+            if outcome in ('error', 'stall') and resumes < MID_TRACK_RESUME_ATTEMPTS:
+                resumes += 1
+                cause = outcome
+                started = time.perf_counter()
+                outcome = resume_stream(video_info, cause)
+                stall_watchdog.recovery_finished(cause, outcome == 'playing', time.perf_counter() - started)
+                if outcome == 'playing':
+                    stall_watchdog.reset(video_info)
+                    continue
+                outcome = outcome or cause
+
+            if outcome:
+                break
+
+            # A remove or reorder can leave the pre-rolled track no longer next in line
+            with queue_lock:
+                preroll_stale = preloaded_video is not None and video_queue.first() is not preloaded_video
+            if preroll_stale:
+                withdraw_preroll()
+
+            # Close to the end, line up the next track so there's no gap
+            if seconds_until_preroll() == 0:
+                preload_next_video()
+
+        log.info(f"Track finished: {outcome}")
+        if outcome == 'error':
+            PLAYBACK_FAILURES.inc(cause='vlc_error')
+        elif outcome == 'stall':
+            PLAYBACK_FAILURES.inc(cause='stall')
 
-            # Clean up
-            print("Stopping playback")
-            player.stop()
-            player.release()
+        with player_lock:
+            if outcome == 'skip' and preloaded_video is not None:
+                # Jump straight into the pre-rolled track
+                with queue_lock:
+                    mark_track_due('preroll')
+                list_player.next()
+                handed_off = True
+            elif outcome == 'ended' and preloaded_video is not None:
+                # The list player is already moving on to the pre-rolled track
+                handed_off = True
+
+            if handed_off:
+                rolled_video = preloaded_video
+            else:
+                log.info("Stopping playback")
+                list_player.stop()
+            preloaded_video = None
 
     except Exception as e:
-        print(f"Error playing video: {e}")
+        log.exception(f"Error playing video: {e}")
+        PLAYBACK_FAILURES.inc(cause='exception')
 
     finally:
         with queue_lock:
             current_video = None
+            skip_requested = False
+            # Only the details are kept; the stream URL would be stale by the time anyone looks
+            video_info.forget_stream()
+            recent_plays.append((time.time(), outcome or 'failed', video_info))
+            mark_queue_changed()
 
 def player_thread_function():
-    """Thread function to continuously play videos from the queue"""
+    """Thread function to play videos from the queue as soon as they are available"""
     global player_thread_running, current_video
 
     while player_thread_running:
-        # Check if there are videos in the queue and no video is currently playing
-        with queue_lock:
-            if video_queue and current_video is None:
-                current_video = video_queue.pop(0)
-
-        # If we have a video to play, play it
-        if current_video:
-            download_and_play_video(current_video)
-
-        # Sleep a bit to prevent high CPU usage
-        time.sleep(1)
+        # Sleep until there is something to play
+        with queue_changed:
+            while player_thread_running and not video_queue:
+                queue_changed.wait()
+            if not player_thread_running:
+                break
+            current_video = video_queue.popleft()
+            video_info = current_video
+
+            # A playlist entry can reach the front before its full lookup was started
+            lookup_now = video_info.status == 'lazy' and metadata_slots.acquire(blocking=False)
+            if lookup_now:
+                video_info.status = 'pending'
+            mark_queue_changed()
+
+        if lookup_now:
+            metadata_executor.submit(resolve_metadata, video_info, True)
+
+        # The window of upcoming videos moved, so top it up
+        schedule_preresolve()
+        audio_cache.schedule(video_info)
+        download_and_play_video(video_info)
 
 def start_player_thread():
     """Start the player thread if it's not already running"""
-    global player_thread, player_thread_running
+    global player_thread, player_thread_running, resolver_thread
+
+    # Concurrent /add requests must not race each other into starting a second player
+    with engine_start_lock:
+        if player_thread is None or not player_thread.is_alive():
+            player_thread_running = True
+            player_thread = threading.Thread(target=player_thread_function, name='player')
+            player_thread.daemon = True
+            player_thread.start()
+
+        # The resolver keeps stream URLs ready for the player thread
+        if resolver_thread is None or not resolver_thread.is_alive():
+            resolver_thread = threading.Thread(target=resolver_thread_function, name='resolver')
+            resolver_thread.daemon = True
+            resolver_thread.start()
+
+def process_start_time():
+    """Wall-clock time this process started (Linux), falling back to when this module loaded"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return MODULE_LOADED_AT
+
+def warm_vlc():
+    """Load libvlc and create the shared VLC instance and player"""
+    vlc.load()
+    with player_lock:
+        get_vlc_player()
+
+def warm_yt_dlp():
+    """Load yt-dlp and its YouTube extractor so the first lookup doesn't pay for it"""
+    with yt_dlp.YoutubeDL(dict(YDL_ANDROID_OPTS)) as ydl:
+        ydl.get_info_extractor('Youtube')
+
+def warmup_thread_function():
+    """Do the slow start-up work after the web server is already answering"""
+    global cold_start_seconds
 
-    if player_thread is None or not player_thread.is_alive():
-        player_thread_running = True
-        player_thread = threading.Thread(target=player_thread_function)
-        player_thread.daemon = True
-        player_thread.start()
+    # Audio routing goes first so the VLC instance picks up the right output
+    for name, step in (('audio_output', configure_audio_output), ('vlc', warm_vlc), ('yt_dlp', warm_yt_dlp),
+                       ('extraction_pool', extraction_service.warm), ('http', get_http_session)):
+        started = time.perf_counter()
+        try:
+            step()
+            ok = True
+        except Exception as e:
+            log.warning(f"Warm-up step {name} failed: {e}")
+            ok = False
+        warmup_steps[name] = {'seconds': round(time.perf_counter() - started, 3), 'ok': ok}
+
+    cold_start_seconds = round(time.time() - process_start_time(), 3)
+    warmup_done.set()
+    log.info(f"Warm-up finished {cold_start_seconds:.2f}s after process start")
+
+def create_app():
+    """Application factory: starts the player engine and background warm-up once per process"""
+    global app_initialized, app_ready_seconds, warmup_thread
+
+    with engine_start_lock:
+        first_call = not app_initialized
+        app_initialized = True
+
+    if first_call:
+        warmup_thread = threading.Thread(target=warmup_thread_function, name='warmup')
+        warmup_thread.daemon = True
+        warmup_thread.start()
+        start_player_thread()
+        app_ready_seconds = round(time.time() - process_start_time(), 3)
+        log.info(f"App ready to serve {app_ready_seconds:.2f}s after process start")
+    return app
+
+index_page = None  # (body, gzipped body, etag) of the rendered page, which only changes with the template
 
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    global index_page
+
+    if index_page is None or app.debug:
+        body = render_template('index.html').encode('utf-8')
+        index_page = (body, gzip.compress(body, 9), hashlib.sha1(body).hexdigest()[:12])
+
+    body, gzipped, etag = index_page
+    response = compressible_response(body, gzipped, 'text/html', etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/static/<path:filename>')
+def static(filename):
+    """Bundled CSS and JavaScript"""
+    asset = load_static_asset(filename)
+    if asset is None:
+        return Response(status=404)
+
+    _, version, mimetype, body, gzipped = asset
+    response = compressible_response(body, gzipped, mimetype, version)
+    # Only URLs carrying the current version may be cached for good
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/thumb/<video_id>')
+def thumbnail(video_id):
+    """A video's thumbnail, downsized and cached on the Pi"""
+    if not VIDEO_ID_PATTERN.match(video_id):
+        return Response(status=404)
+
+    cached = metadata_cache.peek(video_id)
+    path = thumbnail_cache.get(video_id, cached.get('thumbnail') if cached else None)
+    if path is None:
+        response = Response(status=404)
+        response.headers['Cache-Control'] = f'max-age={THUMB_RETRY_AFTER}'
+        return response
+
+    with open(path, 'rb') as f:
+        header = f.read(12)
+    response = send_file(path, mimetype=image_mimetype(header), conditional=True, etag=True)
+    response.headers['Cache-Control'] = f'public, max-age={THUMB_MAX_AGE}'
+    return response
+
+def resolve_metadata(track, check_cache=False):
+    """Fill in a pending track with extracted video information"""
+    try:
+        info = extract_video_info(track.url, check_cache=check_cache)
+
+        with queue_lock:
+            # A failed lookup keeps whatever we had, e.g. the title from a playlist listing
+            if info:
+                track.fill(info)
+            track.status = 'ready' if info else 'failed'
+            mark_queue_changed()
+
+    except Exception as e:
+        log.warning(f"Error resolving metadata for {track.url}: {e}")
+        with queue_lock:
+            track.status = 'failed'
+            mark_queue_changed()
+
+    finally:
+        metadata_slots.release()
+
+def playlist_id_from_url(url):
+    """Return the playlist or mix ID of a URL whose whole list should be queued, or None.
+
+    Only playlist pages, mixes (RD... IDs) and list links without a video are imported; a video shared from
+    inside a playlist (watch?v=...&list=...) queues just that video.
+    """
+    if not url:
+        return None
+    if '://' not in url:
+        url = 'https://' + url.strip()
+
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+
+    host = (parsed.hostname or '').lower()
+    if not (host == 'youtu.be' or host.endswith('youtube.com')):
+        return None
+    playlist_id = parse_qs(parsed.query).get('list', [None])[0]
+    if not playlist_id:
+        return None
+    if parsed.path.rstrip('/') == '/playlist' or playlist_id.startswith('RD') or not normalize_video_id(url):
+        return playlist_id
+    return None
+
+def playlist_entry_info(entry):
+    """Build a lightweight track from a flat playlist entry, or None for private/deleted videos"""
+    video_id = entry.get('id')
+    title = entry.get('title') or ''
+    if not video_id or not VIDEO_ID_PATTERN.match(video_id) or title in ('[Private video]', '[Deleted video]'):
+        return None
+
+    url = f"https://www.youtube.com/watch?v={video_id}"
+
+    # Reuse what we already know about this video; otherwise keep the flat details until it nears the front
+    cached = cached_video_info(url)
+    if cached:
+        return Track.from_info(url, cached)
+
+    thumbnails = entry.get('thumbnails') or []
+    return Track(url, video_id, title, thumbnails[-1].get('url', '') if thumbnails else '',
+                 entry.get('duration'), status='lazy')
+
+def import_playlist(url):
+    """Stream a playlist's entries into the queue as yt-dlp pages through it"""
+    ydl_opts = {
+        'extract_flat': 'in_playlist',  # Only the light per-entry details; full lookups happen later
+        'lazy_playlist': True,
+        'noplaylist': False,
+        'playlistend': PLAYLIST_MAX_ENTRIES,
+        'quiet': True,
+        'logger': ydl_logger,
+        'nocheckcertificate': True,
+        'http_headers': YDL_ANDROID_OPTS['http_headers'],
+    }
+
+    added = 0
+    batch = []
+    last_flush = time.time()
+
+    def flush():
+        nonlocal batch, last_flush
+        if batch:
+            with queue_lock:
+                video_queue.extend(batch)
+                mark_queue_changed()
+            schedule_preresolve()
+            batch = []
+        last_flush = time.time()
+
+    try:
+        log.info(f"Importing playlist: {url}")
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+
+            # Watch pages with a list parameter point on to the playlist itself
+            for _ in range(3):
+                if info.get('_type') not in ('url', 'url_transparent'):
+                    break
+                info = ydl.extract_info(info['url'], download=False, process=False)
+
+            for entry in info.get('entries') or []:
+                video_info = playlist_entry_info(entry)
+                if video_info is None:
+                    continue
+
+                batch.append(video_info)
+                added += 1
+
+                # Publish in small batches so clients see the import grow without a flood of updates
+                if len(batch) >= PLAYLIST_BATCH_SIZE or time.time() - last_flush >= 1:
+                    flush()
+                if added >= PLAYLIST_MAX_ENTRIES:
+                    break
+
+        flush()
+        log.info(f"Imported {added} video(s) from playlist {info.get('title', url)}")
+
+    except Exception as e:
+        flush()
+        log.warning(f"Playlist import failed after {added} video(s): {e}")
+
+    finally:
+        playlist_import_slots.release()
 
 @app.route('/add', methods=['POST'])
 def add_video():
-    """Add a video to the queue"""
+    """Add a video to the queue and look up its details in the background"""
     url = request.form.get('url')
 
     if not url:
         return jsonify({'error': 'No URL provided'}), 400
 
     try:
-        # Extract video information
-        video_info = extract_video_info(url)
+        # Playlists and mixes are expanded in the background
+        playlist_id = playlist_id_from_url(url)
+        if playlist_id:
+            if not playlist_import_slots.acquire(blocking=False):
+                return jsonify({'error': 'Another playlist is still being imported, try again shortly'}), 429
+
+            threading.Thread(target=import_playlist, args=(url,), name='playlist-import', daemon=True).start()
+            start_player_thread()
+            return jsonify({'playlist': playlist_id, 'status': 'importing'}), 202
+
+        # Already queued: depending on the policy, refuse it or count it as a vote
+        key = duplicate_key(url)
+        with queue_lock:
+            duplicate = handle_duplicate(key)
+        if duplicate:
+            schedule_preresolve()
+            return duplicate
+
+        cached = cached_video_info(url)
+        if cached:
+            video_info = Track.from_info(url, cached)
+        else:
+            # Don't let a flood of adds pile up unbounded extraction work
+            if not metadata_slots.acquire(blocking=False):
+                return jsonify({'error': 'Too many videos are being looked up, try again shortly'}), 429
+
+            # Placeholder, filled in once extraction finishes
+            video_info = Track(url, normalize_video_id(url))
 
-        # Add to queue
+        # Add to queue, unless the same video got there while we were looking it up
         with queue_lock:
-            video_queue.append(video_info)
+            duplicate = handle_duplicate(key)
+            if duplicate is None:
+                video_queue.append(video_info)
+                mark_queue_changed()
+        schedule_preresolve()
+
+        if duplicate:
+            if video_info.status == 'pending':
+                metadata_slots.release()
+            return duplicate
+
+        if video_info.status == 'pending':
+            try:
+                metadata_executor.submit(resolve_metadata, video_info)
+            except Exception as e:
+                log.warning(f"Could not schedule metadata lookup: {e}")
+                metadata_slots.release()
+                with queue_lock:
+                    video_info.status = 'failed'
+                    mark_queue_changed()
 
         # Make sure the player thread is running
         start_player_thread()
 
-        return redirect(url_for('index'))
+        return jsonify({'id': video_info.entry_id, 'status': video_info.status}), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def handle_duplicate(key):
+    """Apply DUPLICATE_POLICY if the video is already queued; returns the response, or None to queue it (call with queue_lock held)"""
+    if DUPLICATE_POLICY == 'allow':
+        return None
+    existing = video_queue.find(key)
+    if existing is None:
+        return None
+
+    if DUPLICATE_POLICY == 'reject':
+        return jsonify({'error': 'That video is already in the queue', 'id': existing.entry_id}), 409
+
+    # Each vote moves the entry ahead of everything with fewer votes
+    existing.votes += 1
+    position = video_queue.promote(existing.entry_id)
+    mark_queue_changed()
+    return jsonify({'id': existing.entry_id, 'status': existing.status,
+                    'votes': existing.votes, 'position': position}), 200
+
+def mark_queue_changed():
+    """Bump the state version and wake everyone waiting on the queue (call with queue_lock held)"""
+    global state_version
+
+    state_version += 1
+    queue_changed.notify_all()
+
+def queue_snapshot():
+    """Return (version, JSON body) for the current queue, serializing at most once per version"""
+    global snapshot_cache
+
+    # The cached tuple is swapped atomically, so unchanged queues are served without the lock
+    snapshot = snapshot_cache
+    if snapshot[0] == state_version:
+        return snapshot
+
+    with queue_lock:
+        if snapshot_cache[0] != state_version:
+            snapshot = {
+                'version': state_version,
+                'current': current_video.to_dict() if current_video else None,
+                'queue': [track.to_dict() for track in video_queue]
+            }
+            snapshot_cache = (state_version, json.dumps(snapshot))
+        return snapshot_cache
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    """Recently finished tracks, newest first, a page at a time: ?offset=0&limit=20"""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = max(1, min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), RECENT_PLAYS))
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be whole numbers'}), 400
+
+    with queue_lock:
+        total = len(recent_plays)
+        page = list(islice(reversed(recent_plays), offset, offset + limit))
+        tracks = [dict(track.to_dict(), finished_at=finished_at, outcome=outcome) for finished_at, outcome, track in page]
+
+    return jsonify({
+        'tracks': tracks,
+        'offset': offset,
+        'total': total,
+        'next_offset': offset + len(tracks) if offset + len(tracks) < total else None,
+    })
+
 @app.route('/queue', methods=['GET'])
 def get_queue():
-    """Get the current queue"""
+    """Get the current queue, answering 304 if the client's copy is still current"""
+    version, body = queue_snapshot()
+    etag = f'{BOOT_ID}-{version}'
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/events', methods=['GET'])
+def queue_events():
+    """Server-Sent Events stream that pushes a queue snapshot whenever it changes"""
+    # Every stream holds a server thread, so past the cap pages poll /queue (with its ETag) instead
+    if not event_stream_slots.acquire(blocking=False):
+        response = Response(f'retry: {EVENTS_RETRY_SECONDS * 1000}\n\n', status=503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(EVENTS_RETRY_SECONDS)
+        return response
+
+    last_seen = request.headers.get('Last-Event-ID', '')
+    # Only set by waitress (with channel_request_lookahead); otherwise a dead client shows when a write fails
+    client_disconnected = request.environ.get('waitress.client_disconnected') or (lambda: False)
+
+    def generate():
+        nonlocal last_seen
+        while not client_disconnected():
+            version, body = queue_snapshot()
+            event_id = f'{BOOT_ID}-{version}'
+            if event_id != last_seen:
+                last_seen = event_id
+                yield f'id: {event_id}\nevent: queue\ndata: {body}\n\n'
+
+            # Sleep until the version moves on, looking in on the client now and then; send a
+            # comment every EVENTS_KEEPALIVE_INTERVAL so proxies keep the connection
+            keepalive_at = time.monotonic() + EVENTS_KEEPALIVE_INTERVAL
+            changed = False
+            while not changed and not client_disconnected():
+                remaining = keepalive_at - time.monotonic()
+                if remaining <= 0:
+                    yield ': keep-alive\n\n'
+                    break
+                with queue_changed:
+                    changed = queue_changed.wait_for(lambda: state_version != version,
+                                                     timeout=min(remaining, EVENTS_DISCONNECT_CHECK_INTERVAL))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # The server closes the response however the stream ends, even if it never started
+    response.call_on_close(event_stream_slots.release)
+    return response
+
+def queue_position_from_request():
+    """0-based target position from a form field or JSON body, or None if missing or invalid"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = request.form
+    try:
+        return int(data.get('position'))
+    except (TypeError, ValueError):
+        return None
+
+def move_queue_entry(entry_id, position):
+    """Move an entry and publish the change; returns the JSON response"""
+    with queue_lock:
+        position = video_queue.move(entry_id, position)
+        if position is None:
+            return jsonify({'error': 'No such queue entry'}), 404
+        mark_queue_changed()
+
+    schedule_preresolve()
+    return jsonify({'id': entry_id, 'position': position})
+
+@app.route('/queue/<entry_id>', methods=['DELETE'])
+def remove_from_queue(entry_id):
+    """Remove a queued video"""
     with queue_lock:
-        queue_copy = video_queue.copy()
+        removed = video_queue.remove(entry_id)
+        if removed is None:
+            return jsonify({'error': 'No such queue entry'}), 404
+        mark_queue_changed()
+
+    schedule_preresolve()
+    return jsonify({'id': entry_id, 'removed': True})
+
+@app.route('/queue/<entry_id>/move', methods=['POST'])
+def move_in_queue(entry_id):
+    """Move a queued video to another position (0 plays next)"""
+    position = queue_position_from_request()
+    if position is None:
+        return jsonify({'error': 'Position must be a whole number'}), 400
+
+    return move_queue_entry(entry_id, position)
+
+@app.route('/queue/<entry_id>/next', methods=['POST'])
+def play_next(entry_id):
+    """Move a queued video to the front so it plays after the current one"""
+    return move_queue_entry(entry_id, 0)
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Readiness check: 200 once warm-up succeeded and the player is running, 503 until then"""
+    ready = (warmup_done.is_set() and all(step['ok'] for step in warmup_steps.values())
+             and player_thread is not None and player_thread.is_alive())
+    body = {
+        'ready': ready,
+        'app_ready_seconds': app_ready_seconds,
+        'cold_start_seconds': cold_start_seconds,
+        'warmup': dict(warmup_steps),
+        'imports': {module.name: module.import_seconds for module in (yt_dlp, vlc)},
+    }
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/search', methods=['GET'])
+def search_history():
+    """Title autocomplete over everything that has played"""
+    try:
+        limit = max(1, min(int(request.args.get('limit', HISTORY_SEARCH_LIMIT)), 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be a whole number'}), 400
+
+    started = time.perf_counter()
+    results = play_history.search(request.args.get('q', ''), limit)
+    return jsonify({'results': results, 'took_ms': round((time.perf_counter() - started) * 1000, 2)})
 
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    """Cache counters and other runtime statistics"""
     return jsonify({
-        'current': current_video,
-        'queue': queue_copy
+        'metadata_cache': metadata_cache.stats(),
+        'audio_cache': audio_cache.stats(),
+        'extraction_strategies': strategy_stats_snapshot(),
+        'extraction_pool': extraction_service.stats(),
+        'watchdog': stall_watchdog.stats(),
+        'throughput': link_throughput.stats(),
+        'invidious_instances': invidious_pool.stats(),
+        'loudness': loudness_analyzer.stats(),
+        'play_history': play_history.stats(),
+        'thumbnail_cache': thumbnail_cache.stats()
     })
 
+LOGS_DEFAULT_LIMIT = 200  # Records returned by /logs unless asked for more
+
+@app.route('/logs', methods=['GET'])
+def get_logs():
+    """Recent log records from memory; pass `since` (a seq number) to get only newer ones"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = max(1, min(int(request.args.get('limit', LOGS_DEFAULT_LIMIT)), LOG_BUFFER_SIZE))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be whole numbers'}), 400
+    level = log_level(request.args.get('level', 'NOTSET'), None)
+    if level is None:
+        return jsonify({'error': f"Unknown log level '{request.args['level']}'"}), 400
+
+    records, sequence = log_buffer.snapshot(since, level, limit)
+    return jsonify({
+        'records': records,
+        'next': sequence,  # Pass as `since` to continue from here
+        'level': logging.getLevelName(log.level),
+        'vlc_level': vlc_log_level_name(),
+    })
+
+@app.route('/logs/level', methods=['POST'])
+def set_log_levels():
+    """Change what gets recorded at runtime: {"level": "debug"} for the app, {"vlc": "debug"} or "off" for libvlc"""
+    data = request.get_json(silent=True) or {}
+
+    if 'level' in data:
+        level = log_level(data['level'], None)
+        if level is None:
+            return jsonify({'error': f"Unknown log level '{data['level']}'"}), 400
+        log.setLevel(level)
+    if 'vlc' in data:
+        try:
+            set_vlc_log_level(data['vlc'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    elif 'level' in data:
+        set_vlc_log_level(vlc_log_level_name())
+
+    log.info(f"Log levels now {logging.getLevelName(log.level)}, VLC {vlc_log_level_name()}")
+    return jsonify({
+        'level': logging.getLevelName(log.level),
+        'vlc_level': vlc_log_level_name(),
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for extraction, playback and lock contention"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/skip', methods=['POST'])
 def skip_video():
     """Skip the current video"""
-    global player, current_video
-
-    with player_lock:
-        if player:
-            player.stop()
+    global skip_requested
 
-    # Reset current_video so the player thread picks up the next video
-    with queue_lock:
-        current_video = None
+    # The player thread acts on this straight away and moves to the next video
+    with queue_changed:
+        if current_video is not None:
+            skip_requested = True
+            queue_changed.notify_all()
 
     return redirect(url_for('index'))
 
@@ -678,48 +3565,85 @@ def configure_audio_output():
         # This is specific to Raspberry Pi
         import subprocess
 
-        print("Configuring audio output to 3.5mm jack...")
+        log.info("Configuring audio output to 3.5mm jack...")
 
         # Check if we're running on a Raspberry Pi
         try:
             with open('/proc/device-tree/model', 'r') as f:
                 model = f.read()
                 if 'Raspberry Pi' in model:
-                    print(f"Detected Raspberry Pi: {model}")
+                    log.info(f"Detected Raspberry Pi: {model}")
                 else:
-                    print(f"Not running on a Raspberry Pi: {model}")
+                    log.info(f"Not running on a Raspberry Pi: {model}")
                     return
         except:
-            print("Could not determine if running on Raspberry Pi, skipping audio configuration")
+            log.info("Could not determine if running on Raspberry Pi, skipping audio configuration")
             return
 
         # Set audio output to 3.5mm jack
         subprocess.run(['amixer', 'cset', 'numid=3', '1'], check=True)
-        print("Audio output set to 3.5mm jack")
+        log.info("Audio output set to 3.5mm jack")
 
         # Set volume to 100%
         subprocess.run(['amixer', 'set', 'Master', '100%'], check=True)
-        print("Volume set to 100%")
+        log.info("Volume set to 100%")
 
         # Test audio output
-        print("Testing audio output...")
+        log.info("Testing audio output...")
         test_file = '/usr/share/sounds/alsa/Front_Center.wav'
         if os.path.exists(test_file):
             subprocess.run(['aplay', test_file], check=False)
-            print("Audio test complete")
+            log.info("Audio test complete")
         else:
-            print(f"Audio test file not found: {test_file}")
+            log.warning(f"Audio test file not found: {test_file}")
 
     except Exception as e:
-        print(f"Error configuring audio output: {e}")
-        print("Audio configuration failed, but continuing anyway")
+        log.warning(f"Error configuring audio output: {e}")
+        log.info("Audio configuration failed, but continuing anyway")
 
-if __name__ == '__main__':
-    # Configure audio output
-    configure_audio_output()
+def run_server(host, port, threads, connection_limit, channel_timeout):
+    """Serve the app with waitress, falling back to Flask's server if waitress isn't installed"""
+    application = create_app()
 
-    # Start the player thread
-    start_player_thread()
+    try:
+        from waitress import serve
+    except ImportError:
+        log.warning("waitress is not installed (pip install waitress), falling back to the Flask development server")
+        application.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+        return
+
+    log.info(f"Serving on http://{host}:{port} with {threads} threads")
+    serve(application,
+          host=host,
+          port=port,
+          threads=threads,                    # Each open /events stream holds one of these
+          connection_limit=connection_limit,  # Connections accepted before new ones wait
+          channel_timeout=channel_timeout,    # Seconds an idle keep-alive connection stays open
+          cleanup_interval=min(30, channel_timeout),
+          channel_request_lookahead=1,        # Lets /events streams see waitress.client_disconnected
+          ident='Junie-Pie')
 
-    # Run the Flask app
-    app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Junie-Pie YouTube queue player')
+    parser.add_argument('--host', default=os.environ.get('JUNIE_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('JUNIE_PORT', '5000')))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('JUNIE_THREADS', '48')),
+                        help='Request threads; leave headroom above the number of open pages')
+    parser.add_argument('--connection-limit', type=int, default=int(os.environ.get('JUNIE_CONNECTION_LIMIT', '200')),
+                        help='Maximum simultaneous connections')
+    parser.add_argument('--channel-timeout', type=int, default=int(os.environ.get('JUNIE_CHANNEL_TIMEOUT', '60')),
+                        help='Seconds before an idle connection is closed')
+    parser.add_argument('--dev', action='store_true',
+                        help='Use the Flask development server with debug mode (no reloader)')
+    args = parser.parse_args()
+
+    if args.dev:
+        # Everything recorded goes to the console while developing
+        for handler in persistent_handlers:
+            handler.setLevel(logging.NOTSET)
+        # The reloader would import the app twice and start a second player thread
+        create_app().run(host=args.host, port=args.port, debug=True, use_reloader=False, threaded=True)
+    else:
+        run_server(args.host, args.port, args.threads, args.connection_limit, args.channel_timeout)
@@ -0,0 +1,531 @@
+"""
+Offline performance benchmarks for Junie-Pie.
+
+Runs app.py against the fake yt-dlp and VLC backends in fakes.py, driving it through the Flask
+test client, and reports:
+
+  * /add latency percentiles (cold and metadata-cache-warm) and time until an entry is ready
+  * /queue throughput with N concurrent pollers, plain and with ETag revalidation
+  * gap between one track ending and the next one playing
+  * time from POST /skip until the next track is playing
+  * /queue throughput and latency over real sockets, Flask's development server vs waitress
+
+Usage:
+    python benchmarks/bench.py [--json results.json] [--compare baseline.json] [options]
+
+Runs are seeded, so two runs on the same machine with the same options are comparable across
+commits; --compare prints the change for every figure against an earlier --json file.
+"""
+import argparse
+import contextlib
+import functools
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fakes
+
+app_module = None  # app.py, imported once the fakes are installed
+
+
+def percentiles(samples):
+    """p50/p90/p99/max/mean of a list of seconds, reported in milliseconds"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(p):
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'p50_ms': pick(50),
+        'p90_ms': pick(90),
+        'p99_ms': pick(99),
+        'max_ms': round(ordered[-1] * 1000, 2),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Hide the app's console output while a scenario runs"""
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def wait_until(predicate, timeout, interval=0.005):
+    """Poll a condition from the harness side; returns whether it became true in time"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def app_hook(name):
+    """An app.py internal the harness reads, or None when running against a commit that predates it"""
+    return getattr(app_module, name, None)
+
+
+def post_skip(client, timeout=2):
+    """POST /skip; returns False when the app held it up until playback was ended from the fake side"""
+    # Players that keep player_lock for the whole track (bc44a20 and earlier) only see a skip once the track is over
+    done = threading.Event()
+
+    def post():
+        client.post('/skip')
+        done.set()
+
+    threading.Thread(target=post, daemon=True).start()
+    if done.wait(timeout):
+        return True
+    fakes.stop_all_players()
+    done.wait(30)
+    return False
+
+
+def reset_app(client):
+    """Empty the queue and stop whatever is playing so each scenario starts clean"""
+    app = app_module
+    with app.queue_lock:
+        app.video_queue.clear()
+        if app_hook('mark_queue_changed'):
+            app.mark_queue_changed()
+    post_skip(client)
+    wait_until(lambda: app.current_video is None, timeout=10)
+
+
+def video_url(prefix, index):
+    """Unique, valid-looking watch URL (11 character IDs) for a scenario"""
+    video_id = f'{prefix}{index:0{11 - len(prefix)}d}'
+    return f'https://www.youtube.com/watch?v={video_id}'
+
+
+def queue_snapshot(client):
+    return client.get('/queue').get_json()
+
+
+def bench_add(client, args):
+    """Latency of POST /add and the time until each entry's metadata is ready"""
+    fakes.CONFIG.track_seconds = 3600  # Keep the first track playing so entries stay queued
+    reset_app(client)
+
+    results = {}
+    for phase in ('cold', 'warm'):
+        latencies = []
+        added_at = {}
+        for index in range(args.adds):
+            started = time.perf_counter()
+            response = client.post('/add', data={'url': video_url('add', index)})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code == 202:
+                added_at[response.get_json()['id']] = started
+
+        # Watch /queue until every entry we added has its details
+        ready_after = {}
+        poll_latencies = []  # /queue while the lookups are running
+
+        def all_ready():
+            started = time.perf_counter()
+            snapshot = queue_snapshot(client)
+            poll_latencies.append(time.perf_counter() - started)
+            entries = snapshot['queue'] + ([snapshot['current']] if snapshot['current'] else [])
+            now = time.perf_counter()
+            for entry in entries:
+                entry_id = entry.get('entry_id')
+                if entry_id in added_at and entry_id not in ready_after and entry.get('status') in ('ready', 'failed'):
+                    ready_after[entry_id] = now - added_at[entry_id]
+            return len(ready_after) == len(added_at)
+
+        wait_until(all_ready, timeout=args.adds * (fakes.CONFIG.extract_latency + 1) + 10, interval=0.01)
+
+        results[f'{phase}_add_latency'] = percentiles(latencies)
+        results[f'{phase}_time_to_ready'] = percentiles(list(ready_after.values()))
+        results[f'{phase}_queue_latency_during_lookups'] = percentiles(poll_latencies)
+        reset_app(client)
+
+    return results
+
+
+def bench_queue(client, args):
+    """Requests per second for GET /queue with concurrent pollers"""
+    fakes.CONFIG.track_seconds = 3600
+    reset_app(client)
+
+    # Fill the queue from the metadata cache warmed by bench_add, then wait for it to settle
+    for index in range(args.queue_length):
+        client.post('/add', data={'url': video_url('add', index % max(1, args.adds))})
+    wait_until(lambda: all(entry.get('status') != 'pending' for entry in queue_snapshot(client)['queue']), timeout=30)
+
+    results = {}
+    for mode in ('plain', 'etag'):
+        counts = [0] * args.pollers
+        stop = threading.Event()
+
+        def poll(slot):
+            poller = app_module.app.test_client()
+            etag = poller.get('/queue').headers.get('ETag') if mode == 'etag' else None
+            headers = {'If-None-Match': etag} if etag else {}
+            while not stop.is_set():
+                poller.get('/queue', headers=headers)
+                counts[slot] += 1
+
+        threads = [threading.Thread(target=poll, args=(slot,), daemon=True) for slot in range(args.pollers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.poll_seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        results[f'queue_{mode}_requests_per_second'] = round(sum(counts) / elapsed, 1)
+
+    results['queue_length'] = len(queue_snapshot(client)['queue'])
+    results['pollers'] = args.pollers
+    reset_app(client)
+    return results
+
+
+def bench_gaps(client, args):
+    """Silence between EndReached of one track and Playing of the next"""
+    fakes.CONFIG.track_seconds = args.track_seconds
+    reset_app(client)
+
+    with fakes.event_log_lock:
+        fakes.event_log.clear()
+
+    for index in range(args.tracks):
+        client.post('/add', data={'url': video_url('gap', index)})
+
+    finished = wait_until(lambda: app_module.current_video is None and not queue_snapshot(client)['queue'],
+                          timeout=args.tracks * (args.track_seconds + 10) + 10, interval=0.05)
+
+    with fakes.event_log_lock:
+        log = list(fakes.event_log)
+
+    gaps = []
+    last_end = None
+    for timestamp, name, _ in log:
+        if name == fakes.EventType.MediaPlayerEndReached:
+            last_end = timestamp
+        elif name == fakes.EventType.MediaPlayerPlaying and last_end is not None:
+            gaps.append(timestamp - last_end)
+            last_end = None
+
+    # Resumed streams report Playing again and a replayed stream ends twice, so count distinct streams that ended
+    played = len({mrl for _, name, mrl in log if name == fakes.EventType.MediaPlayerEndReached})
+    results = {'inter_track_gap': percentiles(gaps), 'tracks_played': played, 'completed': finished}
+
+    # Figures that only exist from the commit that added them on
+    if app_hook('stall_watchdog'):
+        results['stream_recoveries'] = app_module.stall_watchdog.stats()['recoveries']
+    if app_hook('recent_plays') is not None:
+        audio_kbps = [track.audio_format['kbps'] for _, _, track in list(app_module.recent_plays)[-args.tracks:]
+                      if getattr(track, 'audio_format', None)]
+        results['audio_kbps'] = {'first': audio_kbps[0], 'last': audio_kbps[-1]} if audio_kbps else None
+    if app_hook('link_throughput'):
+        results['throughput_kbps'] = app_module.link_throughput.stats()['estimate_kbps']
+    return results
+
+
+def bench_skip(client, args):
+    """Time from POST /skip until a different track reports Playing"""
+    fakes.CONFIG.track_seconds = 3600
+    reset_app(client)
+
+    for index in range(args.skips + 1):
+        client.post('/add', data={'url': video_url('skp', index)})
+
+    latencies = []
+    blocked = 0
+    for _ in range(args.skips):
+        # Start each skip from a steady state: something playing and the next stream resolved
+        wait_until(lambda: app_module.player is not None and app_module.player.get_state() == fakes.State.Playing, timeout=30)
+        time.sleep(args.skip_settle)
+        current_mrl = app_module.player.get_media().get_mrl()
+
+        started = time.perf_counter()
+        if not post_skip(client):
+            blocked += 1
+            continue
+
+        def moved_on():
+            with fakes.event_log_lock:
+                return any(timestamp >= started and name == fakes.EventType.MediaPlayerPlaying and mrl != current_mrl
+                           for timestamp, name, mrl in fakes.event_log[-20:])
+
+        if wait_until(moved_on, timeout=30, interval=0.001):
+            latencies.append(time.perf_counter() - started)
+
+    reset_app(client)
+    return {'skip_to_next': percentiles(latencies), 'skips_blocked': blocked}
+
+
+def serve_in_background(kind, threads):
+    """Start the app on a free local port; returns (port, shutdown function)"""
+    if kind == 'waitress':
+        from waitress.server import create_server
+        server = create_server(app_module.app, host='127.0.0.1', port=0, threads=threads,
+                               connection_limit=threads * 4, channel_timeout=30)
+        port = server.effective_port
+
+        def run():
+            try:
+                server.run()
+            except OSError:
+                pass  # close() pulls the socket out from under the select loop
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return port, server.close
+
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # One access log line per request otherwise
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server.server_port, server.shutdown
+
+
+def bench_server(client, args):
+    """GET /queue over real sockets with open /events streams: dev server vs waitress"""
+    if importlib.util.find_spec('waitress') is None:
+        return {'skipped': 'waitress is not installed'}
+
+    fakes.CONFIG.track_seconds = 3600
+    reset_app(client)
+    for index in range(args.queue_length):
+        client.post('/add', data={'url': video_url('add', index % max(1, args.adds))})
+    wait_until(lambda: all(entry.get('status') != 'pending' for entry in queue_snapshot(client)['queue']), timeout=30)
+
+    results = {}
+    for kind in ('werkzeug', 'waitress'):
+        port, shutdown = serve_in_background(kind, args.server_threads)
+
+        # Idle pages: each one keeps an /events stream open for the whole run
+        streams = []
+        for _ in range(args.sse_clients):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.request('GET', '/events')
+            streams.append((connection, connection.getresponse()))
+
+        latencies = [[] for _ in range(args.pollers)]
+        errors = [0] * args.pollers
+        stop = threading.Event()
+
+        def poll(slot):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', '/queue')
+                    connection.getresponse().read()
+                    latencies[slot].append(time.perf_counter() - started)
+                except Exception:
+                    errors[slot] += 1
+                    connection.close()
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.close()
+
+        threads = [threading.Thread(target=poll, args=(slot,), daemon=True) for slot in range(args.pollers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.poll_seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        samples = [sample for slot in latencies for sample in slot]
+        results[kind] = {
+            'requests_per_second': round(len(samples) / elapsed, 1),
+            'latency': percentiles(samples),
+            'errors': sum(errors),
+        }
+
+        for connection, _ in streams:
+            connection.close()
+        shutdown()
+
+    results['sse_clients'] = args.sse_clients
+    results['server_threads'] = args.server_threads
+    reset_app(client)
+    return results
+
+
+SCENARIOS = [
+    ('add', bench_add),
+    ('queue', bench_queue),
+    ('gaps', bench_gaps),
+    ('skip', bench_skip),
+    ('server', bench_server),
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def flatten(results, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1}, for printing and comparing"""
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        else:
+            flat[name] = value
+    return flat
+
+
+def print_report(report, baseline=None):
+    print(f"Junie-Pie benchmark @ {report['commit']} ({report['python']}, seed {report['config']['seed']})")
+    current = flatten(report['results'])
+    previous = flatten(baseline['results']) if baseline else {}
+
+    width = max(len(name) for name in current) if current else 0
+    for name, value in current.items():
+        line = f'  {name:<{width}}  {value}'
+        old = previous.get(name)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and isinstance(old, (int, float)) and old:
+            line += f'   (was {old}, {(value - old) / old * 100:+.1f}%)'
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Offline Junie-Pie benchmarks with fake yt-dlp and VLC backends')
+    parser.add_argument('--scenarios', default=','.join(name for name, _ in SCENARIOS),
+                        help='Comma-separated scenarios to run (default: all)')
+    parser.add_argument('--adds', type=int, default=50, help='Videos added in the /add scenario')
+    parser.add_argument('--queue-length', type=int, default=100, help='Queue length for the /queue scenario')
+    parser.add_argument('--pollers', type=int, default=30, help='Concurrent /queue pollers')
+    parser.add_argument('--poll-seconds', type=float, default=3.0, help='How long the pollers run')
+    parser.add_argument('--tracks', type=int, default=6, help='Tracks played in the gap scenario')
+    parser.add_argument('--track-seconds', type=float, default=2.0, help='Length of each fake track in the gap scenario')
+    parser.add_argument('--skips', type=int, default=10, help='Skips measured in the skip scenario')
+    parser.add_argument('--skip-settle', type=float, default=0.5, help='Seconds to let the resolver catch up before each skip')
+    parser.add_argument('--sse-clients', type=int, default=10, help='Open /events streams in the server scenario')
+    parser.add_argument('--server-threads', type=int, default=48, help='waitress threads in the server scenario')
+    parser.add_argument('--extract-latency', type=float, default=0.2, help='Mean fake yt-dlp extraction time (seconds)')
+    parser.add_argument('--extract-jitter', type=float, default=0.05, help='Uniform jitter on extraction time (seconds)')
+    parser.add_argument('--extract-cpu', type=float, default=0.0,
+                        help='CPU seconds of pure-Python work per fake extraction, to model GIL contention')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Chance any fake extraction fails')
+    parser.add_argument('--client-failure', action='append', default=[], metavar='CLIENT=RATE',
+                        help='Failure chance for one yt-dlp player client, e.g. android=1.0 (repeatable)')
+    parser.add_argument('--vlc-open-latency', type=float, default=0.05, help='Fake VLC time from play() to Playing (seconds)')
+    parser.add_argument('--mid-track-error-after', type=float, default=None,
+                        help='Fail every fake stream once this many seconds in, to exercise resuming')
+    parser.add_argument('--stall-after', type=float, default=None,
+                        help='Freeze every fake stream once this many seconds in, to exercise the stall watchdog')
+    parser.add_argument('--link-kbps', type=float, default=None,
+                        help='Download rate the fake VLC reports, to exercise audio format selection')
+    parser.add_argument('--stall-seconds', type=float, default=None,
+                        help="Override the app's stall threshold (JUNIE_STALL_SECONDS)")
+    parser.add_argument('--seed', type=int, default=1234, help='Random seed for injected latency and failures')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--compare', help='Show changes against a results file from an earlier run')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own console output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    global app_module
+
+    args = parse_args(argv)
+
+    config = fakes.CONFIG
+    config.extract_latency = args.extract_latency
+    config.extract_jitter = args.extract_jitter
+    config.extract_cpu = args.extract_cpu
+    config.failure_rate = args.failure_rate
+    config.client_failure_rates = {client: float(rate) for client, rate in
+                                   (item.split('=', 1) for item in args.client_failure)}
+    config.vlc_open_latency = args.vlc_open_latency
+    config.mid_track_error_after = args.mid_track_error_after
+    config.stall_after = args.stall_after
+    config.link_kbps = args.link_kbps
+    fakes.reseed(args.seed)
+
+    # Keep the benchmark's caches away from the real ones
+    os.environ['JUNIE_CACHE_DIR'] = tempfile.mkdtemp(prefix='junie-bench-cache-')
+    if args.stall_seconds is not None:
+        os.environ['JUNIE_STALL_SECONDS'] = str(args.stall_seconds)
+    fakes.install()
+
+    with quiet(not args.verbose):
+        import app
+        app_module = app
+
+        # Stay offline: the Invidious strategy would otherwise reach out to the internet
+        def offline_invidious(video_url, purpose=None):
+            time.sleep(config.extract_latency)
+            raise Exception('Invidious is disabled in benchmarks')
+        if app_hook('EXTRACTION_STRATEGIES'):
+            app.EXTRACTION_STRATEGIES['invidious'] = offline_invidious
+
+        # Extraction workers don't inherit the fakes, so have each one install its own
+        if app_hook('extraction_service'):
+            app.extraction_service.worker_prepare = functools.partial(fakes.install_worker, vars(config))
+
+    client = app.app.test_client()
+    wanted = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+
+    results = {}
+    for name, scenario in SCENARIOS:
+        if name not in wanted:
+            continue
+        print(f'Running {name} scenario...', file=sys.stderr)
+        with quiet(not args.verbose):
+            results[name] = scenario(client, args)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': dict(vars(args), seed=args.seed),
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
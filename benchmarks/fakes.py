@@ -0,0 +1,488 @@
+"""
+Local stand-ins for yt_dlp and vlc so app.py can be exercised without YouTube, a Pi or speakers.
+
+install() registers fake 'yt_dlp' and 'vlc' modules in sys.modules; it has to run before app.py
+is imported. Latency, failures and track lengths are read from the shared CONFIG object, which
+the benchmark harness fills in from its command line.
+"""
+import enum
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import types
+import weakref
+
+
+class FakeConfig:
+    """Knobs for the fake backends; times are in seconds"""
+
+    def __init__(self):
+        self.extract_latency = 0.2          # Mean yt-dlp extract_info time
+        self.extract_jitter = 0.05          # +/- uniform jitter on extraction time
+        self.extract_cpu = 0.0              # Pure-Python work per extraction, like deciphering the player JS
+        self.failure_rate = 0.0             # Chance any extraction raises
+        self.client_failure_rates = {}      # player_client -> failure chance, e.g. {'android': 1.0}
+        self.playlist_length = 50           # Entries returned for URLs with list=
+        self.track_seconds = 2.0            # Length of every fake track
+        self.vlc_open_latency = 0.05        # Time from play() to the Playing event
+        self.mid_track_error_after = None   # Fail each stream once this far into the track, like an expired URL
+        self.stall_after = None             # Freeze each stream once this far into the track, like a hung connection
+        self.link_kbps = None               # Download rate the fake media statistics report (None: as fast as played)
+        self.seed = 1234
+        self.media_dir = tempfile.mkdtemp(prefix='junie-bench-media-')
+
+
+CONFIG = FakeConfig()
+_rng = random.Random(CONFIG.seed)
+_rng_lock = threading.Lock()
+
+
+def reseed(seed):
+    """Reset the shared random generator so runs are repeatable"""
+    CONFIG.seed = seed
+    with _rng_lock:
+        _rng.seed(seed)
+
+
+def _random():
+    with _rng_lock:
+        return _rng.random()
+
+
+# ---------------------------------------------------------------------------
+# yt_dlp
+# ---------------------------------------------------------------------------
+
+class DownloadError(Exception):
+    pass
+
+
+def _video_id(url):
+    """Pull a video ID out of a fake or real YouTube URL, inventing a stable one otherwise"""
+    match = re.search(r'(?:v=|youtu\.be/|shorts/|embed/)([A-Za-z0-9_-]{11})', url)
+    if match:
+        return match.group(1)
+    return ('%011d' % (abs(hash(url)) % 10 ** 11))[:11]
+
+
+def _media_file(name):
+    """A tiny local file standing in for the googlevideo stream, so URL probes succeed offline"""
+    path = os.path.join(CONFIG.media_dir, f'{name}.m4a')
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 2048)
+    return path
+
+
+# (format_id, ext, acodec, abr) of the audio formats YouTube usually offers
+AUDIO_FORMATS = [
+    ('139', 'm4a', 'mp4a.40.5', 48),
+    ('249', 'webm', 'opus', 50),
+    ('250', 'webm', 'opus', 70),
+    ('140', 'm4a', 'mp4a.40.2', 128),
+    ('251', 'webm', 'opus', 160),
+]
+AUDIO_FORMAT_KBPS = {format_id: abr for format_id, _, _, abr in AUDIO_FORMATS}
+
+
+def _stream_kbps(mrl):
+    """Bitrate of the fake format a media file stands in for"""
+    match = re.search(r'-(\d+)\.m4a$', mrl)
+    return AUDIO_FORMAT_KBPS.get(match.group(1), 128) if match else 128
+
+
+class YoutubeDL:
+    """Mimics the parts of yt_dlp.YoutubeDL that app.py uses"""
+
+    def __init__(self, params=None):
+        self.params = params or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get_info_extractor(self, ie_key):
+        return object()
+
+    def _player_client(self):
+        clients = self.params.get('extractor_args', {}).get('youtube', {}).get('player_client') or ['default']
+        return clients[0]
+
+    def _simulate_request(self):
+        delay = CONFIG.extract_latency + (_random() * 2 - 1) * CONFIG.extract_jitter
+        time.sleep(max(0.0, delay))
+
+        # Busy work that holds the GIL, as yt-dlp's parsing does
+        busy_until = time.thread_time() + CONFIG.extract_cpu
+        while time.thread_time() < busy_until:
+            sum(range(1000))
+
+        failure_rate = CONFIG.client_failure_rates.get(self._player_client(), CONFIG.failure_rate)
+        if _random() < failure_rate:
+            raise DownloadError(f"Injected failure for player client '{self._player_client()}'")
+
+    def _video_info(self, url):
+        video_id = _video_id(url)
+        formats = [{'format_id': format_id, 'ext': ext, 'acodec': acodec, 'vcodec': 'none', 'abr': abr,
+                    'url': 'file://' + _media_file(f'{video_id}-{format_id}'), 'protocol': 'https'}
+                   for format_id, ext, acodec, abr in AUDIO_FORMATS]
+        picked = formats[3]  # What 'bestaudio[ext=m4a]' picks
+        return {
+            'id': video_id,
+            'title': f'Fake track {video_id}',
+            'duration': CONFIG.track_seconds,
+            'thumbnail': '',
+            'url': picked['url'],
+            'format_id': picked['format_id'],
+            'formats': formats,
+        }
+
+    def extract_info(self, url, download=False, process=True):
+        self._simulate_request()
+
+        if 'list=' in url and not self.params.get('noplaylist', False):
+            def entries():
+                for index in range(CONFIG.playlist_length):
+                    video_id = 'pl%09d' % index
+                    yield {'_type': 'url', 'id': video_id, 'title': f'Fake playlist track {index}',
+                           'url': f'https://www.youtube.com/watch?v={video_id}',
+                           'duration': CONFIG.track_seconds, 'thumbnails': []}
+            return {'_type': 'playlist', 'title': 'Fake playlist', 'entries': entries()}
+
+        return self._video_info(url)
+
+    def download(self, urls):
+        for url in urls:
+            self._simulate_request()
+            video_id = _video_id(url)
+            template = self.params.get('outtmpl', '%(id)s.%(ext)s')
+            if isinstance(template, dict):
+                template = template.get('default', '%(id)s.%(ext)s')
+            path = template.replace('%(id)s', video_id).replace('%(ext)s', 'm4a')
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 64 * 1024)
+        return 0
+
+
+# ---------------------------------------------------------------------------
+# vlc
+# ---------------------------------------------------------------------------
+
+class State(enum.IntEnum):
+    NothingSpecial = 0
+    Opening = 1
+    Buffering = 2
+    Playing = 3
+    Paused = 4
+    Stopped = 5
+    Ended = 6
+    Error = 7
+
+
+class EventType:
+    MediaPlayerPlaying = 'MediaPlayerPlaying'
+    MediaPlayerEndReached = 'MediaPlayerEndReached'
+    MediaPlayerEncounteredError = 'MediaPlayerEncounteredError'
+    MediaPlayerTimeChanged = 'MediaPlayerTimeChanged'
+
+
+# (time.perf_counter(), event name, mrl) for every event the fake player emits
+event_log = []
+event_log_lock = threading.Lock()
+
+
+def _log_event(name, mrl):
+    with event_log_lock:
+        event_log.append((time.perf_counter(), name, mrl))
+
+
+class EventManager:
+    def __init__(self):
+        self.callbacks = {}
+
+    def event_attach(self, event_type, callback, *args):
+        self.callbacks.setdefault(event_type, []).append((callback, args))
+
+    def event_detach(self, event_type):
+        self.callbacks.pop(event_type, None)
+
+    def fire(self, event_type, mrl, **fields):
+        if event_type != EventType.MediaPlayerTimeChanged:
+            _log_event(event_type, mrl)
+        event = types.SimpleNamespace(type=event_type, u=types.SimpleNamespace(**fields))
+        for callback, args in list(self.callbacks.get(event_type, [])):
+            callback(event, *args)
+
+
+class MediaStats:
+    def __init__(self):
+        self.read_bytes = 0
+        self.input_bitrate = 0.0
+        self.demux_read_bytes = 0
+        self.lost_abuffers = 0
+
+
+class Media:
+    def __init__(self, mrl):
+        self.mrl = mrl
+        self.options = []
+        self.read_bytes = 0
+
+    def get_stats(self, stats):
+        stats.read_bytes = stats.demux_read_bytes = self.read_bytes
+        return True
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    def get_mrl(self):
+        return self.mrl
+
+    def release(self):
+        pass
+
+
+class MediaList:
+    def __init__(self):
+        self.items = []
+        self._lock = threading.RLock()
+
+    def add_media(self, media):
+        self.items.append(media)
+
+    def lock(self):
+        self._lock.acquire()
+
+    def unlock(self):
+        self._lock.release()
+
+    def count(self):
+        return len(self.items)
+
+    def remove_index(self, index):
+        del self.items[index]
+        return 0
+
+    def release(self):
+        pass
+
+
+_players = weakref.WeakSet()
+
+
+def stop_all_players():
+    """Stop every fake player from outside the app, as if the audio device went away"""
+    for player in list(_players):
+        player.stop()
+
+
+class MediaPlayer:
+    """Plays nothing; just walks through Opening -> Playing -> Ended on a timer thread"""
+
+    def __init__(self):
+        _players.add(self)
+        self.media = None
+        self.state = State.NothingSpecial
+        self.started_at = None
+        self.generation = 0
+        self.events = EventManager()
+        self.list_player = None
+        self.volume = 100
+        self.failed_mrls = set()  # Streams that already hit their injected mid-track error
+        self.stalled_mrls = set()  # ... or their injected stall
+        self.frozen_ms = None      # Position of a stalled stream
+
+    def event_manager(self):
+        return self.events
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+        return 0
+
+    def audio_output_device_set(self, module, device):
+        pass
+
+    def get_media(self):
+        return self.media
+
+    def set_media(self, media):
+        self.media = media
+
+    def play(self):
+        # Single-media playback, as app.py drove VLC before the media list player
+        if self.media is None:
+            return -1
+        self._begin(self.media)
+        return 0
+
+    def get_state(self):
+        return self.state
+
+    def get_length(self):
+        return int(CONFIG.track_seconds * 1000) if self.media else -1
+
+    def get_time(self):
+        if self.started_at is None:
+            return -1
+        if self.frozen_ms is not None:
+            return self.frozen_ms
+        return int((time.perf_counter() - self.started_at) * 1000)
+
+    def set_time(self, ms):
+        if self.started_at is not None:
+            self.started_at = time.perf_counter() - ms / 1000
+
+    def stop(self):
+        self.generation += 1
+        self.state = State.Stopped
+        self.started_at = None
+        self.frozen_ms = None
+
+    def release(self):
+        self.stop()
+
+    def _begin(self, media, start_ms=0):
+        self.generation += 1
+        generation = self.generation
+        self.media = media
+        self.state = State.Opening
+        self.started_at = None
+        self.frozen_ms = None
+
+        def run():
+            time.sleep(CONFIG.vlc_open_latency)
+            if generation != self.generation:
+                return
+            self.started_at = time.perf_counter() - start_ms / 1000
+            self.state = State.Playing
+            self.events.fire(EventType.MediaPlayerPlaying, media.mrl)
+
+            while generation == self.generation:
+                position = time.perf_counter() - self.started_at
+                remaining = CONFIG.track_seconds - position
+                if remaining <= 0:
+                    break
+                if (CONFIG.mid_track_error_after is not None and position >= CONFIG.mid_track_error_after
+                        and media.mrl not in self.failed_mrls):
+                    self.failed_mrls.add(media.mrl)
+                    self.state = State.Error
+                    self.events.fire(EventType.MediaPlayerEncounteredError, media.mrl)
+                    return
+                if (CONFIG.stall_after is not None and position >= CONFIG.stall_after
+                        and media.mrl not in self.stalled_mrls):
+                    # Nothing more arrives: no position updates, no bytes, until someone stops or replaces the stream
+                    self.stalled_mrls.add(media.mrl)
+                    self.frozen_ms = int(position * 1000)
+                    return
+                media.read_bytes = int(position * min(CONFIG.link_kbps or float('inf'), _stream_kbps(media.mrl)) * 125)
+                self.events.fire(EventType.MediaPlayerTimeChanged, media.mrl, new_time=int(position * 1000))
+                time.sleep(min(remaining, 0.05))
+            if generation != self.generation:
+                return
+
+            self.state = State.Ended
+            self.events.fire(EventType.MediaPlayerEndReached, media.mrl)
+            if self.list_player is not None:
+                self.list_player._advance()
+
+        threading.Thread(target=run, name='fake-vlc', daemon=True).start()
+
+
+class MediaListPlayer:
+    def __init__(self):
+        self.player = None
+        self.media_list = None
+        self.index = 0
+
+    def set_media_player(self, player):
+        self.player = player
+        player.list_player = self
+
+    def set_media_list(self, media_list):
+        self.media_list = media_list
+        self.index = 0
+
+    def play(self):
+        if self.media_list and self.media_list.items:
+            self.index = 0
+            self.player._begin(self.media_list.items[0])
+
+    def stop(self):
+        self.player.stop()
+
+    def _advance(self):
+        if self.media_list and self.index + 1 < len(self.media_list.items):
+            self.index += 1
+            self.player._begin(self.media_list.items[self.index])
+            return True
+        return False
+
+    def next(self):
+        self.player.generation += 1
+        if not self._advance():
+            self.player.state = State.Ended
+            return -1
+        return 0
+
+    def release(self):
+        pass
+
+
+class Instance:
+    def __init__(self, *args):
+        self.args = args
+
+    def media_player_new(self):
+        return MediaPlayer()
+
+    def media_list_player_new(self):
+        return MediaListPlayer()
+
+    def media_list_new(self):
+        return MediaList()
+
+    def media_new(self, mrl, *options):
+        media = Media(mrl)
+        for option in options:
+            media.add_option(option)
+        return media
+
+    def audio_output_enumerate_devices(self):
+        return []
+
+    def release(self):
+        pass
+
+
+def install():
+    """Register the fake modules; must run before app.py is imported"""
+    yt_dlp = types.ModuleType('yt_dlp')
+    yt_dlp.YoutubeDL = YoutubeDL
+    yt_dlp.utils = types.SimpleNamespace(DownloadError=DownloadError)
+    yt_dlp.__fake__ = True
+
+    vlc = types.ModuleType('vlc')
+    vlc.State = State
+    vlc.EventType = EventType
+    vlc.Instance = Instance
+    vlc.MediaPlayer = MediaPlayer
+    vlc.MediaListPlayer = MediaListPlayer
+    vlc.MediaStats = MediaStats
+    vlc.__fake__ = True
+
+    sys.modules['yt_dlp'] = yt_dlp
+    sys.modules['vlc'] = vlc
+
+
+def install_worker(settings):
+    """install() for an extraction worker process, which starts fresh rather than as a fork of the harness"""
+    CONFIG.__dict__.update(settings)
+    reseed(CONFIG.seed)
+    install()
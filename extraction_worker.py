@@ -0,0 +1,102 @@
+"""
+yt-dlp extraction, run in Junie-Pie's pool of worker processes.
+
+Deciphering YouTube's player JavaScript and parsing its large JSON responses is CPU-bound Python,
+so app.py hands extractions to processes that each keep warm YoutubeDL instances between jobs.
+This module only depends on yt-dlp; the workers never touch the web app, the queue or VLC.
+"""
+
+ydl_instances = {}  # Strategy name -> YoutubeDL reused for every job in this process
+job_logger = None
+
+
+class ExtractionError(Exception):
+    """A failed extraction, reduced to its message so it always unpickles in the web process"""
+
+
+class JobLogger:
+    """Collects yt-dlp's warnings during a job so the web process can log them"""
+
+    def __init__(self):
+        self.warnings = []
+
+    def debug(self, message):
+        pass
+
+    def info(self, message):
+        pass
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def error(self, message):
+        pass  # Raised as an exception as well
+
+
+def audio_formats(info):
+    """The audio-only formats yt-dlp found that can be streamed over plain HTTP, with their bitrates"""
+    formats = []
+    for f in info.get('formats') or ():
+        kbps = f.get('abr') or f.get('tbr')
+        if f.get('vcodec') != 'none' or f.get('acodec') in (None, 'none') or not f.get('url') or not kbps:
+            continue
+        if f.get('protocol', 'https') not in ('http', 'https'):
+            continue
+        formats.append({'id': f.get('format_id'), 'url': f['url'], 'kbps': round(kbps),
+                        'ext': f.get('ext'), 'codec': f.get('acodec')})
+    return formats
+
+
+def ytdlp_result(info):
+    """The fields of a yt-dlp info dict that the app uses"""
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'thumbnail': info.get('thumbnail', ''),
+        'duration': info.get('duration', 0),
+        'stream_url': info.get('url'),
+        'format_id': info.get('format_id'),
+        'audio_formats': audio_formats(info),
+    }
+
+
+def init(option_sets, prepare=None):
+    """Process initializer: build one YoutubeDL per strategy and load the YouTube extractor"""
+    global job_logger
+    if prepare is not None:
+        prepare()
+    import yt_dlp
+
+    job_logger = JobLogger()
+    for name, options in option_sets.items():
+        ydl = yt_dlp.YoutubeDL(dict(options, logger=job_logger))
+        ydl.get_info_extractor('Youtube')
+        ydl_instances[name] = ydl
+
+
+def ping():
+    """Does nothing; submitted at start-up so the worker processes are started and initialized early"""
+    return True
+
+
+def extract(strategy, video_url):
+    """Run one strategy's extraction; returns (result, yt-dlp warnings)"""
+    del job_logger.warnings[:]
+    try:
+        info = ydl_instances[strategy].extract_info(video_url, download=False)
+    except Exception as e:
+        raise ExtractionError(f"{type(e).__name__}: {e}") from None
+    return ytdlp_result(info), list(job_logger.warnings)
+
+
+def download(options, url):
+    """Download one URL with a YoutubeDL built from options, e.g. into the audio cache; returns (None, yt-dlp warnings)"""
+    import yt_dlp
+
+    del job_logger.warnings[:]
+    try:
+        with yt_dlp.YoutubeDL(dict(options, logger=job_logger)) as ydl:
+            ydl.download([url])
+    except Exception as e:
+        raise ExtractionError(f"{type(e).__name__}: {e}") from None
+    return None, list(job_logger.warnings)
@@ -0,0 +1,37 @@
+"""
+Shared set-up for the tests: app.py is imported once, against the fake yt-dlp and VLC from benchmarks/fakes.py.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+sys.path.insert(0, REPO_DIR)
+
+import fakes  # noqa: E402
+
+# Keep the tests' caches away from the real ones, and yt-dlp on threads rather than worker processes
+os.environ['JUNIE_CACHE_DIR'] = tempfile.mkdtemp(prefix='junie-test-cache-')
+os.environ['JUNIE_EXTRACTION_PROCESSES'] = '0'
+fakes.install()
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """app.py with an empty queue"""
+    with app_module.queue_lock:
+        app_module.video_queue.clear()
+    yield app_module
+    with app_module.queue_lock:
+        app_module.video_queue.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
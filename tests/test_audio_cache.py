@@ -0,0 +1,52 @@
+import pytest
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, function, *args):
+        self.jobs.append(args)
+
+
+@pytest.fixture
+def cache(app, tmp_path):
+    """An enabled AudioCache in a temporary directory that records the downloads it would start"""
+    cache = app.AudioCache(str(tmp_path), 10 * 1024 * 1024)
+    cache.executor = RecordingExecutor()
+    return cache
+
+
+def make_track(app, kbps=None):
+    track = app.Track('https://www.youtube.com/watch?v=abcdefghijk', 'abcdefghijk', status='ready')
+    if kbps:
+        track.audio_format = {'id': '140', 'ext': 'm4a', 'codec': 'mp4a.40.2', 'kbps': kbps, 'ceiling_kbps': None}
+    return track
+
+
+def test_downloads_while_link_has_room(app, cache, monkeypatch):
+    monkeypatch.setattr(app.link_throughput, 'has_room', lambda kbps: kbps <= 300)
+    cache.schedule(make_track(app, kbps=128))
+    assert cache.executor.jobs == [('abcdefghijk', 'https://www.youtube.com/watch?v=abcdefghijk', 128)]
+
+
+def test_defers_download_when_link_is_busy(app, cache, monkeypatch):
+    asked = []
+    monkeypatch.setattr(app.link_throughput, 'has_room', lambda kbps: asked.append(kbps) or False)
+    cache.schedule(make_track(app, kbps=128))
+    cache.schedule(make_track(app))
+
+    assert cache.executor.jobs == []
+    assert asked == [app.AUDIO_CACHE_SPARE * 128, app.AUDIO_CACHE_SPARE * app.AUDIO_CACHE_TRACK_KBPS]
+    assert cache.stats()['deferred'] == 2
+    assert cache.stats()['downloading'] == 0
+
+
+def test_format_selector_without_ceiling(app):
+    assert app.AudioCache.format_selector(None) == 'bestaudio[ext=m4a]/bestaudio[ext=webm]/bestaudio/best'
+
+
+def test_format_selector_caps_bitrate(app):
+    selector = app.AudioCache.format_selector(96.4)
+    assert selector.split('/') == ['bestaudio[ext=m4a][abr<=96]', 'bestaudio[ext=webm][abr<=96]',
+                                   'bestaudio[abr<=96]', 'worstaudio', 'worst']
@@ -0,0 +1,50 @@
+import pytest
+
+SAMPLED = {'lufs': -12.0, 'peak': -1.5, 'sampled': True}
+MEASURED = {'lufs': -12.0, 'peak': -1.5}
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, function, *args):
+        self.jobs.append(args)
+
+
+@pytest.fixture
+def analyzer(app, monkeypatch):
+    """A LoudnessAnalyzer that records the measurements it would start, over a link with room and an empty cache"""
+    analyzer = app.LoudnessAnalyzer(False)
+    analyzer.ffmpeg = 'ffmpeg'
+    analyzer.executor = RecordingExecutor()
+    monkeypatch.setattr(app.link_throughput, 'has_room', lambda kbps: True)
+    monkeypatch.setattr(app.metadata_cache, 'peek', lambda video_id: None)
+    return analyzer
+
+
+def test_samples_stream_without_known_loudness(analyzer):
+    analyzer.schedule('abcdefghijk', 'https://example.com/stream', 128)
+    assert analyzer.executor.jobs == [('abcdefghijk', 'https://example.com/stream', True)]
+
+
+def test_sampled_track_is_not_sampled_again_without_cache_entry(analyzer):
+    for _ in range(3):
+        analyzer.schedule('abcdefghijk', 'https://example.com/stream', 128, known=SAMPLED)
+    assert analyzer.executor.jobs == []
+
+
+def test_sampled_track_is_measured_again_from_file(analyzer):
+    analyzer.schedule('abcdefghijk', '/cache/audio/abcdefghijk.m4a', known=SAMPLED)
+    assert analyzer.executor.jobs == [('abcdefghijk', '/cache/audio/abcdefghijk.m4a', False)]
+
+
+def test_measured_track_is_left_alone(analyzer):
+    analyzer.schedule('abcdefghijk', '/cache/audio/abcdefghijk.m4a', known=MEASURED)
+    assert analyzer.executor.jobs == []
+
+
+def test_stream_is_not_sampled_without_link_room(app, analyzer, monkeypatch):
+    monkeypatch.setattr(app.link_throughput, 'has_room', lambda kbps: False)
+    analyzer.schedule('abcdefghijk', 'https://example.com/stream', 128)
+    assert analyzer.executor.jobs == []
@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+
+class Clock:
+    """Stands in for time.time so last_used values are predictable"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(app.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'metadata.sqlite3')
+
+
+@pytest.fixture
+def cache(app, cache_path, clock):
+    """Three videos, stored a second apart in the three seconds before the clock's now"""
+    cache = app.MetadataCache(cache_path, 100, 3600)
+    for index in range(3):
+        clock.now = 999_997.0 + index
+        cache.put(f'video{index:06d}', {'id': f'video{index:06d}', 'title': f'Video {index}'})
+    clock.now = 1_000_000.0
+    return cache
+
+
+def last_used(path):
+    """last_used as committed to disk, read through a connection of its own"""
+    with sqlite3.connect(path) as db:
+        return dict(db.execute('SELECT video_id, last_used FROM metadata'))
+
+
+def test_hits_are_not_written_one_by_one(cache, cache_path, clock):
+    clock.now += 10
+    assert cache.get('video000000')['title'] == 'Video 0'
+    assert last_used(cache_path)['video000000'] == 999_997.0
+    assert cache.touched == {'video000000': 1_000_010.0}
+
+
+def test_batch_of_hits_is_written_together(app, cache, cache_path, clock, monkeypatch):
+    monkeypatch.setattr(app, 'METADATA_TOUCH_BATCH', 2)
+    clock.now += 10
+    cache.get('video000000')
+    cache.get('video000001')
+    assert last_used(cache_path) == {'video000000': 1_000_010.0, 'video000001': 1_000_010.0,
+                                     'video000002': 999_999.0}
+    assert cache.touched == {}
+
+
+def test_hits_are_written_after_flush_interval(app, cache, cache_path, clock):
+    clock.now += app.METADATA_TOUCH_FLUSH_INTERVAL + 1
+    cache.get('video000002')
+    assert last_used(cache_path)['video000002'] == clock.now
+
+
+def test_put_writes_pending_hits(cache, cache_path, clock):
+    clock.now += 10
+    cache.get('video000000')
+    clock.now += 10
+    cache.put('video000003', {'id': 'video000003', 'title': 'Video 3'})
+    assert last_used(cache_path)['video000000'] == 1_000_010.0
+    assert last_used(cache_path)['video000003'] == 1_000_020.0
+
+
+def test_flush_writes_pending_hits(cache, cache_path, clock):
+    clock.now += 10
+    cache.get('video000001')
+    cache.flush()
+    assert last_used(cache_path)['video000001'] == 1_000_010.0
+    assert cache.touched == {}
+
+
+def test_flushed_hits_decide_what_survives_a_restart(app, cache, cache_path, clock):
+    clock.now += 10
+    cache.get('video000000')
+    cache.flush()
+
+    reloaded = app.MetadataCache(cache_path, 2, 3600)
+    assert list(reloaded.entries) == ['video000002', 'video000000']
+
+
+def test_expired_entry_drops_pending_hit(cache, cache_path, clock):
+    clock.now += 10
+    cache.get('video000000')
+    clock.now += 3600
+    assert cache.get('video000000') is None
+    assert 'video000000' not in cache.touched
+    assert 'video000000' not in last_used(cache_path)
@@ -0,0 +1,56 @@
+import pytest
+
+
+def queue_tracks(app, count):
+    """Put ready tracks straight into the queue; returns their entry IDs in play order"""
+    tracks = [app.Track(f'https://www.youtube.com/watch?v=test{index:07d}', f'test{index:07d}', status='ready')
+              for index in range(count)]
+    with app.queue_lock:
+        app.video_queue.extend(tracks)
+    return [track.entry_id for track in tracks]
+
+
+def queue_order(app):
+    with app.queue_lock:
+        return [track.entry_id for track in app.video_queue]
+
+
+def test_move_with_form_field(app, client):
+    first, second, third = queue_tracks(app, 3)
+    response = client.post(f'/queue/{third}/move', data={'position': '0'})
+    assert response.status_code == 200
+    assert response.get_json() == {'id': third, 'position': 0}
+    assert queue_order(app) == [third, first, second]
+
+
+def test_move_with_json_body(app, client):
+    first, second, third = queue_tracks(app, 3)
+    response = client.post(f'/queue/{first}/move', json={'position': 1})
+    assert response.status_code == 200
+    assert queue_order(app) == [second, first, third]
+
+
+def test_move_clamps_position_to_queue(app, client):
+    first, second, third = queue_tracks(app, 3)
+    response = client.post(f'/queue/{first}/move', json={'position': 99})
+    assert response.get_json()['position'] == 2
+    assert queue_order(app) == [second, third, first]
+
+
+@pytest.mark.parametrize('body', [[1], 3, 'first', None, {'position': 'soon'}, {}])
+def test_move_rejects_body_without_whole_number_position(app, client, body):
+    entry_id, _ = queue_tracks(app, 2)
+    response = client.post(f'/queue/{entry_id}/move', json=body)
+    assert response.status_code == 400
+
+
+def test_move_rejects_malformed_json(app, client):
+    entry_id, _ = queue_tracks(app, 2)
+    response = client.post(f'/queue/{entry_id}/move', data='{"position":', content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_move_unknown_entry(app, client):
+    queue_tracks(app, 2)
+    response = client.post('/queue/nosuchentry/move', json={'position': 0})
+    assert response.status_code == 404
@@ -0,0 +1,129 @@
+import pytest
+
+FORMATS = [
+    {'id': '249', 'url': 'https://example.com/249', 'kbps': 48, 'ext': 'webm', 'codec': 'opus'},
+    {'id': '140', 'url': 'https://example.com/140', 'kbps': 128, 'ext': 'm4a', 'codec': 'mp4a.40.2'},
+    {'id': '251', 'url': 'https://example.com/251', 'kbps': 160, 'ext': 'webm', 'codec': 'opus'},
+]
+RESULT = {'stream_url': 'https://example.com/251', 'format_id': '251', 'audio_formats': FORMATS}
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://rr1.googlevideo.com/videoplayback?expire=1700000000&ei=abc', 1700000000),
+    ('https://rr1.googlevideo.com/videoplayback?ei=abc&expire=1700000000', 1700000000),
+    ('https://manifest.googlevideo.com/api/manifest/dash/expire/1700000000/ei/abc', 1700000000),
+    ('https://example.com/audio.m4a', 1000 + 3600),
+    ('https://example.com/audio.m4a?noexpire=5', 1000 + 3600),
+    (None, 1000 + 3600),
+])
+def test_stream_url_expiry(app, monkeypatch, url, expected):
+    monkeypatch.setattr(app, 'STREAM_URL_MAX_AGE', 3600)
+    assert app.stream_url_expiry(url, 1000) == expected
+
+
+@pytest.fixture
+def link(app, monkeypatch):
+    """A fresh LinkThroughput without a configured maximum, in place of the app's"""
+    link = app.LinkThroughput(0)
+    monkeypatch.setattr(app, 'link_throughput', link)
+    return link
+
+
+def test_no_ceiling_until_measured(link):
+    assert link.ceiling() is None
+    assert link.has_room(10_000)
+
+
+def test_first_sample_sets_ceiling_with_headroom(app, link):
+    link.observe(200, 'probe')
+    assert link.estimate_kbps == 200
+    assert link.ceiling() == pytest.approx(200 * app.AUDIO_THROUGHPUT_HEADROOM)
+    assert link.has_room(150)
+    assert not link.has_room(151)
+
+
+def test_samples_are_smoothed(app, link):
+    link.observe(200, 'probe')
+    link.observe(100, 'probe')
+    assert link.estimate_kbps == pytest.approx(200 + app.THROUGHPUT_SMOOTHING * (100 - 200))
+    assert link.stats()['samples'] == {'probe': 2}
+
+
+def test_configured_maximum_caps_ceiling(app):
+    link = app.LinkThroughput(96)
+    assert link.ceiling() == 96
+    link.observe(1000, 'probe')
+    assert link.ceiling() == 96
+    assert link.has_room(500)  # Room is about the link itself, not the user's cap
+
+
+def test_lower_bound_needs_an_estimate(link):
+    link.observe(128, 'playback', lower_bound=True)
+    assert link.estimate_kbps is None
+    assert link.ceiling() is None
+
+
+def test_lower_bound_never_lowers_estimate(app, link):
+    link.observe(400, 'probe')
+    link.observe(128, 'playback', lower_bound=True)
+    assert link.estimate_kbps == 400
+    link.observe(400, 'playback', lower_bound=True)
+    assert link.estimate_kbps > 400
+
+
+def test_ceiling_drops_at_once_but_rises_only_past_margin(app, link):
+    link.observe(200, 'probe')
+    ceiling = link.ceiling()
+
+    # Clearly more throughput, but not yet by the upswitch margin: the ceiling holds
+    link.observe(300, 'probe')
+    assert link.estimate_kbps * app.AUDIO_THROUGHPUT_HEADROOM < ceiling * app.AUDIO_UPSWITCH_MARGIN
+    assert link.ceiling() == ceiling
+
+    link.observe(300, 'probe')
+    assert link.ceiling() == pytest.approx(link.estimate_kbps * app.AUDIO_THROUGHPUT_HEADROOM)
+    assert link.stats()['ceiling_raised'] == 1
+
+    link.observe(50, 'probe')
+    assert link.ceiling() == pytest.approx(link.estimate_kbps * app.AUDIO_THROUGHPUT_HEADROOM)
+    assert link.stats()['ceiling_lowered'] == 1
+
+
+def test_choose_audio_format_keeps_strategy_pick_without_ceiling(app, link):
+    url, details = app.choose_audio_format(RESULT)
+    assert url == 'https://example.com/251'
+    assert details['id'] == '251' and details['ceiling_kbps'] is None
+
+
+def test_choose_audio_format_follows_ceiling_with_hysteresis(app, link):
+    link.observe(200, 'probe')                      # Ceiling 150
+    assert app.choose_audio_format(RESULT)[1]['id'] == '140'
+
+    link.observe(300, 'probe')                      # Would allow 160, but not by the upswitch margin
+    assert link.estimate_kbps * app.AUDIO_THROUGHPUT_HEADROOM > 160
+    assert app.choose_audio_format(RESULT)[1]['id'] == '140'
+
+    link.observe(300, 'probe')                      # Past the margin
+    assert app.choose_audio_format(RESULT)[1]['id'] == '251'
+
+    link.observe(50, 'probe')
+    link.observe(50, 'probe')
+    link.observe(50, 'probe')                       # Ceiling below every format
+    url, details = app.choose_audio_format(RESULT)
+    assert (url, details['id']) == ('https://example.com/249', '249')
+
+
+def test_choose_audio_format_without_format_list(app, link):
+    link.observe(50, 'probe')
+    result = {'stream_url': 'https://example.com/only', 'format_id': None, 'audio_formats': []}
+    assert app.choose_audio_format(result) == ('https://example.com/only', None)
+
+
+def test_exceeds_ceiling_only_after_it_drops(app, link):
+    link.observe(200, 'probe')
+    _, details = app.choose_audio_format(RESULT)
+    assert not app.exceeds_ceiling(details)
+    assert not app.exceeds_ceiling(None)
+
+    link.observe(50, 'probe')
+    assert app.exceeds_ceiling(details)
@@ -0,0 +1,92 @@
+import pytest
+
+
+@pytest.mark.parametrize('url, playlist_id', [
+    ('https://www.youtube.com/playlist?list=PLabc123', 'PLabc123'),
+    ('youtube.com/playlist/?list=PLabc123', 'PLabc123'),
+    ('https://music.youtube.com/playlist?list=OLAK5uy_abc', 'OLAK5uy_abc'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=RDdQw4w9WgXcQ', 'RDdQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?list=PLabc123', 'PLabc123'),
+])
+def test_whole_list_is_imported(app, url, playlist_id):
+    assert app.playlist_id_from_url(url) == playlist_id
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc123&index=4',
+    'https://youtu.be/dQw4w9WgXcQ?list=PLabc123',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://www.youtube.com/playlist',
+    'https://example.com/playlist?list=PLabc123',
+    '',
+    None,
+])
+def test_single_video_or_not_a_list(app, url):
+    assert app.playlist_id_from_url(url) is None
+
+
+class SkippedLookups:
+    """Stands in for the metadata executor: the lookup never runs, but its slot is handed back"""
+
+    def __init__(self, app):
+        self.app = app
+        self.tracks = []
+
+    def submit(self, function, track, *args):
+        self.tracks.append(track)
+        self.app.metadata_slots.release()
+
+
+def test_video_from_inside_playlist_queues_one_entry(app, client, monkeypatch):
+    lookups = SkippedLookups(app)
+    monkeypatch.setattr(app, 'metadata_executor', lookups)
+    monkeypatch.setattr(app, 'start_player_thread', lambda: None)
+    response = client.post('/add', data={'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLabc123'})
+    assert response.status_code == 202
+    assert 'playlist' not in response.get_json()
+    with app.queue_lock:
+        assert [track.video_id for track in app.video_queue] == ['dQw4w9WgXcQ']
+    assert [track.video_id for track in lookups.tracks] == ['dQw4w9WgXcQ']
+
+
+@pytest.mark.parametrize('url', [
+    'dQw4w9WgXcQ',
+    '  dQw4w9WgXcQ  ',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+    'HTTPS://WWW.YOUTUBE.COM/watch?v=dQw4w9WgXcQ',
+    'youtube.com/watch?v=dQw4w9WgXcQ',
+    'https://m.youtube.com/watch?v=dQw4w9WgXcQ&t=42s',
+    'https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RDAMVM',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQ#t=5',
+    'https://youtu.be/dQw4w9WgXcQ?si=abc',
+    'https://www.youtube.com/shorts/dQw4w9WgXcQ?feature=share',
+    'https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ',
+    'https://www.youtube.com/live/dQw4w9WgXcQ',
+    'https://www.youtube.com/v/dQw4w9WgXcQ',
+])
+def test_normalize_video_id(app, url):
+    assert app.normalize_video_id(url) == 'dQw4w9WgXcQ'
+
+
+@pytest.mark.parametrize('url', [
+    None,
+    '',
+    'dQw4w9WgXc',                                     # One character short
+    'https://www.youtube.com/watch?v=dQw4w9WgXc',
+    'https://www.youtube.com/watch?v=dQw4w9WgXcQQ',
+    'https://www.youtube.com/watch',
+    'https://www.youtube.com/playlist?list=PLabc123',
+    'https://www.youtube.com/channel/UC1234567890',
+    'https://www.youtube.com.evil.example/watch?v=dQw4w9WgXcQ',
+    'https://vimeo.com/76979871',
+    'http://[::1',                                    # Not parseable at all
+])
+def test_normalize_video_id_rejects(app, url):
+    assert app.normalize_video_id(url) is None
+
+
+def test_duplicate_key_matches_forms_of_the_same_video(app):
+    keys = {app.duplicate_key(url) for url in ('https://youtu.be/dQw4w9WgXcQ',
+                                               'https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10',
+                                               'https://music.youtube.com/watch?v=dQw4w9WgXcQ')}
+    assert len(keys) == 1
@@ -0,0 +1,77 @@
+import pytest
+
+
+@pytest.fixture
+def queue(app):
+    """A VideoQueue of five tracks, a to e"""
+    queue = app.VideoQueue()
+    for name in 'abcde':
+        track = app.Track(f'https://www.youtube.com/watch?v={name * 11}', name * 11, status='ready')
+        track.entry_id = name
+        queue.append(track)
+    return queue
+
+
+def order(queue):
+    return ''.join(track.entry_id for track in queue)
+
+
+@pytest.mark.parametrize('entry_id, position, expected_position, expected_order', [
+    ('c', 0, 0, 'cabde'),
+    ('a', 0, 0, 'abcde'),      # Already there
+    ('e', 4, 4, 'abcde'),
+    ('a', 4, 4, 'bcdea'),
+    ('a', 2, 2, 'bcade'),
+    ('e', 1, 1, 'aebcd'),
+    ('b', -3, 0, 'bacde'),     # Clamped to the front
+    ('b', 99, 4, 'acdeb'),     # Clamped to the back
+])
+def test_move(queue, entry_id, position, expected_position, expected_order):
+    assert queue.move(entry_id, position) == expected_position
+    assert order(queue) == expected_order
+
+
+def test_move_unknown_entry(queue):
+    assert queue.move('z', 0) is None
+    assert order(queue) == 'abcde'
+
+
+def test_move_in_single_entry_queue(app):
+    queue = app.VideoQueue()
+    track = app.Track('https://www.youtube.com/watch?v=aaaaaaaaaaa', 'aaaaaaaaaaa')
+    queue.append(track)
+    assert queue.move(track.entry_id, 3) == 0
+    assert list(queue) == [track]
+
+
+def test_move_keeps_duplicate_index(queue):
+    queue.move('d', 1)
+    assert queue.find('d' * 11).entry_id == 'd'
+    assert queue.remove('d').entry_id == 'd'
+    assert queue.find('d' * 11) is None
+    assert order(queue) == 'abce'
+
+
+def test_promote_passes_entries_with_fewer_votes(queue):
+    queue.get('a').votes = 3
+    queue.get('d').votes = 2
+    assert queue.promote('d') == 1
+    assert order(queue) == 'adbce'
+
+
+def test_promote_stays_behind_equal_votes(queue):
+    for entry_id in 'abd':
+        queue.get(entry_id).votes = 2
+    assert queue.promote('d') == 2
+    assert order(queue) == 'abdce'
+
+
+def test_promote_at_front(queue):
+    queue.get('a').votes = 5
+    assert queue.promote('a') == 0
+    assert order(queue) == 'abcde'
+
+
+def test_promote_without_more_votes_stays_put(queue):
+    assert queue.promote('c') == 2
+    assert order(queue) == 'abcde'
@@ -0,0 +1,12 @@
+"""
+WSGI entry point for running Junie-Pie under an external server, e.g.
+
+    gunicorn --workers 1 --threads 48 --timeout 0 --keep-alive 5 -b 0.0.0.0:5000 wsgi:application
+
+Keep it to a single worker process: the queue and the player live in that process, so a second
+worker would have its own queue and its own VLC player. Scale with threads instead, and leave
+headroom above the number of open pages, since each /events stream holds a thread.
+"""
+from app import create_app
+
+application = create_app()